@@ -7,6 +7,10 @@ from flask import Flask, render_template, current_app
 from flask_wtf.csrf import CSRFProtect, CSRFError, generate_csrf
 from app.extensions import csrf, login_manager
 from app.mqtt import MqttManager  # pour le scanne des tickets MQTT
+from app.expiry import ExpirySweeper  # passage des tickets en "expired" en arrière-plan
+from app.stop_index import StopIndex  # index spatial en mémoire pour /stops/near
+from app.fulfilment import Fulfiller  # émission des tickets après webhook Stripe
+from app.stripe_gateway import StripeGateway  # client Stripe unique (ou backend factice)
 import os
 from config import DevelopmentConfig
 #from flask_login import LoginManager
@@ -52,6 +56,9 @@ def create_app():
     else:
         app.logger.warning("[Stripe] Secret manquante/invalide.")
 
+    # Client Stripe configuré une fois pour tout le processus
+    StripeGateway(app)
+
     #    ==========  DB/ EXTENSIONS =================    #
     # Attache la DB sur l'objet app (pratique pour y accéder dans les routes)
     app.db = init_db(app)
@@ -125,4 +132,13 @@ def create_app():
     # MQTT
     MqttManager(app)
 
+    # Expiration des tickets (thread de fond)
+    ExpirySweeper(app)
+
+    # Index spatial des arrêts (chargé en arrière-plan)
+    StopIndex(app)
+
+    # Émission des tickets payés (file alimentée par le webhook Stripe)
+    Fulfiller(app)
+
     return app
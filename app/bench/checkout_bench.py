@@ -0,0 +1,153 @@
+# app/bench/checkout_bench.py
+# Usage:
+#   python -m app.bench.checkout_bench --users 10 --duration 20 --out bench_checkout.json
+#   python -m app.bench.checkout_bench --latency-ms 150 --types single=60,day=30,week=10
+#
+# Banc de charge du parcours d'achat par carte, sans réseau ni vrai Stripe :
+# - L'app est créée dans ce process avec STRIPE_BACKEND=fake (app/stripe_gateway.py) ;
+#   --latency-ms simule le temps de réponse de Stripe.
+# - N clients connectés (un utilisateur de test "bench-<run>-<i>" chacun) enchaînent
+#   en boucle fermée : POST /payments/create-payment-intent puis
+#   POST /tickets/api/after-payment (rappelé tant que la réponse est 202).
+# - Sans --webhook, /after-payment vérifie le PaymentIntent auprès du faux backend et
+#   émet les tickets (chemin idempotent de app/fulfilment.py) ; avec --webhook, la
+#   file d'émission tourne en arrière-plan comme en production.
+# - Utilisateurs, paiements et tickets de test supprimés à la fin (sauf --keep).
+# - Rapport JSON : latences p50/p95/p99 d'un achat complet, débit, statuts HTTP,
+#   compteurs serveur (stripe, fulfilment).
+
+import os, json, time, uuid, argparse, threading
+from datetime import datetime, timezone
+
+from app.bench.scan_bench import summarize, git_revision
+
+
+def parse_types(s: str) -> list[str]:
+    """'single=60,day=40' -> liste pondérée de types."""
+    out = []
+    for part in s.split(","):
+        name, _, weight = part.partition("=")
+        out += [name.strip()] * max(0, int(weight or 1))
+    return out or ["single"]
+
+
+class Buyer:
+    def __init__(self, app, user_id: str, types: list[str], results: list, lock: threading.Lock, polls: int):
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess["_user_id"] = user_id
+            sess["_fresh"] = True
+        self.types = types
+        self.results = results
+        self.lock = lock
+        self.polls = polls
+
+    def buy_once(self, i: int) -> str:
+        kind = self.types[i % len(self.types)]
+        r = self.client.post("/payments/create-payment-intent", json={"type": kind, "qty": 1})
+        if r.status_code != 200:
+            return f"create_{r.status_code}"
+        pi_id = r.get_json()["client_secret"].split("_secret_")[0]
+        for _ in range(self.polls):
+            r = self.client.post("/tickets/api/after-payment", json={"pi_id": pi_id})
+            if r.status_code != 202:
+                return "ok" if r.status_code in (200, 201) else f"finalize_{r.status_code}"
+            time.sleep(0.05)
+        return "pending"
+
+    def run(self, deadline: float, max_requests: int | None):
+        i = 0
+        while time.perf_counter() < deadline and (max_requests is None or i < max_requests):
+            t0 = time.perf_counter()
+            try:
+                reason = self.buy_once(i)
+            except Exception as e:
+                reason = type(e).__name__
+            ms = (time.perf_counter() - t0) * 1000 if reason == "ok" else None
+            with self.lock:
+                self.results.append((ms, reason))
+            i += 1
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Banc de charge du parcours d'achat (Stripe factice)")
+    ap.add_argument("--users", type=int, default=10, help="Nb de clients simultanés")
+    ap.add_argument("--duration", type=float, default=10.0, help="Durée du test (s)")
+    ap.add_argument("--requests", type=int, default=None, help="Nb max d'achats par client")
+    ap.add_argument("--latency-ms", type=float, default=0.0, help="Latence simulée de Stripe (ms)")
+    ap.add_argument("--types", default="single=70,day=20,week=10", help="Répartition des types de ticket")
+    ap.add_argument("--webhook", action="store_true", help="Émission en file (comme avec le webhook)")
+    ap.add_argument("--out", default=None, help="Fichier du rapport JSON (défaut: stdout)")
+    ap.add_argument("--keep", action="store_true", help="Ne pas supprimer les données de test")
+    args = ap.parse_args()
+
+    os.environ["STRIPE_BACKEND"] = "fake"
+    os.environ["STRIPE_FAKE_LATENCY_MS"] = str(args.latency_ms)
+    os.environ["START_MQTT"] = "0"
+    if args.webhook:
+        # pas de vrai webhook ici : la file d'émission est alimentée par /after-payment
+        os.environ.setdefault("FULFILMENT_RETRY_INTERVAL", "1")
+    else:
+        os.environ["FULFILMENT_RETRY_INTERVAL"] = "0"
+    from app import create_app
+    app = create_app()
+    app.config["WTF_CSRF_ENABLED"] = False
+
+    run_id = uuid.uuid4().hex[:8]
+    emails = [f"bench-{run_id}-{i}@bench.local" for i in range(max(1, args.users))]
+    res = app.db.users.insert_many([{"email": e, "name": "bench"} for e in emails])
+    user_ids = [str(oid) for oid in res.inserted_ids]
+
+    results: list = []
+    lock = threading.Lock()
+    types = parse_types(args.types)
+    buyers = [Buyer(app, uid, types, results, lock, polls=200) for uid in user_ids]
+
+    started_at = datetime.now(timezone.utc)
+    print(f"[BENCH] users={len(buyers)} durée={args.duration}s latence_stripe={args.latency_ms}ms")
+    try:
+        t0 = time.perf_counter()
+        deadline = t0 + args.duration
+        threads = [threading.Thread(target=b.run, args=(deadline, args.requests), daemon=True) for b in buyers]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - t0
+    finally:
+        if not args.keep:
+            app.db.tickets.delete_many({"user_id": {"$in": user_ids}})
+            app.db.payments.delete_many({"user_id": {"$in": user_ids}})
+            app.db.users.delete_many({"email": {"$in": emails}})
+
+    gw = app.extensions.get("stripe")
+    ful = app.extensions.get("fulfiller")
+    report = {
+        "meta": {
+            "tool": "checkout_bench",
+            "revision": git_revision(),
+            "started_at": started_at.isoformat().replace("+00:00", "Z"),
+            "users": len(buyers),
+            "duration_s": args.duration,
+            "stripe_latency_ms": args.latency_ms,
+            "types": args.types,
+            "queued_fulfilment": bool(args.webhook),
+        },
+        **summarize(results, elapsed),
+        "server": {
+            "stripe": gw.stats() if gw else None,
+            "fulfilment": ful.stats() if ful else None,
+        },
+    }
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+        print(f"[BENCH] rapport écrit dans {args.out}")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,355 @@
+# app/bench/scan_bench.py
+# Usage:
+#   python -m app.bench.scan_bench --devices 20 --duration 30 --out bench_scan.json
+#   python -m app.bench.scan_bench --broker mqtt --url mqtt://localhost:1883 --devices 50
+#
+# Banc de charge du topic de scan (SCAN_REQ_TOPIC -> SCAN_RESP_TOPIC/<device_id>).
+#
+# - N bornes simulées (device_id = bench-<run>-<i>) envoient des scans en boucle fermée
+#   (requête suivante dès la réponse reçue, ou après --timeout).
+# - Broker :
+#     * inproc : broker local en mémoire branché directement sur MqttManager
+#                (mesure le pipeline de scan seul, sans réseau) ;
+#     * mqtt   : vrai broker (mosquitto local…). Par défaut l'app est démarrée
+#                dans ce process ; --external pour viser une app déjà lancée ;
+#     * auto   : mqtt si le broker de --url répond, sinon inproc (défaut).
+# - Tickets de test insérés dans db.tickets (user_id "bench-<run>") puis supprimés
+#   (sauf --keep). --mix choisit les payloads : token (réponse depuis le jeton),
+#   id (lecture DB/cache), invalid (jeton falsifié).
+# - Limiteur par borne (MQTT_DEVICE_RATE) désactivé par défaut : une borne en boucle
+#   fermée dépasse vite 20 req/s et le banc ne mesurerait que des "rate_limited".
+#   --rate-limit pour le garder (réglages de l'app) ; sans effet avec --external.
+# - Rapport JSON : latences p50/p95/p99 (requête -> réponse), débit, raisons d'erreur,
+#   métriques serveur (scan_stats) quand l'app tourne dans ce process.
+
+import os, json, math, time, uuid, socket, random, argparse, threading, subprocess
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from urllib.parse import urlparse
+
+import paho.mqtt.client as mqtt
+
+from app.mqtt import MqttManager, SCAN_REQ_TOPIC, SCAN_RESP_TOPIC
+from app.security import make_qr_token
+
+
+# ---------- Broker en mémoire ----------
+class LocalBroker:
+    """Routage topic -> callbacks (jokers MQTT + et #), livraison synchrone."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subs: list[tuple[str, callable]] = []
+
+    def subscribe(self, pattern: str, callback):
+        with self._lock:
+            self._subs.append((pattern, callback))
+
+    def publish(self, topic: str, payload):
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        msg = SimpleNamespace(topic=topic, payload=payload)
+        with self._lock:
+            targets = [cb for pattern, cb in self._subs if mqtt.topic_matches_sub(pattern, topic)]
+        for cb in targets:
+            cb(msg)
+
+
+class LocalClient:
+    """Sous-ensemble de mqtt.Client utilisé par MqttManager (publish / is_connected)."""
+
+    def __init__(self, broker: LocalBroker):
+        self.broker = broker
+
+    def is_connected(self) -> bool:
+        return True
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        self.broker.publish(topic, payload)
+        return SimpleNamespace(rc=mqtt.MQTT_ERR_SUCCESS, mid=0)
+
+
+# ---------- Bornes simulées ----------
+class Device:
+    """Une borne : envoie un scan, attend la réponse (corrélée par req_id), recommence."""
+
+    def __init__(self, device_id: str, payloads: list[dict], timeout: float, results: list, lock):
+        self.device_id = device_id
+        self.payloads = payloads
+        self.timeout = timeout
+        self.results = results          # liste partagée de (latence_ms | None, raison)
+        self.lock = lock
+        self._pending: dict[str, float] = {}
+        self._answered = threading.Event()
+        self._last_reason = None
+        self.send = None                # fn(topic, payload_str), branchée par le transport
+
+    @property
+    def resp_topic(self) -> str:
+        return SCAN_RESP_TOPIC.format(device_id=self.device_id)
+
+    def on_response(self, msg):
+        try:
+            data = json.loads(msg.payload)
+        except Exception:
+            return
+        if data.get("req_id") not in self._pending:
+            return
+        self._pending.pop(data["req_id"], None)
+        self._last_reason = "ok" if data.get("ok") else (data.get("reason") or "error")
+        self._answered.set()
+
+    def run(self, deadline: float, max_requests: int | None):
+        rng = random.Random(self.device_id)
+        sent = 0
+        while time.perf_counter() < deadline and (max_requests is None or sent < max_requests):
+            req_id = uuid.uuid4().hex
+            body = {**rng.choice(self.payloads), "req_id": req_id, "device_id": self.device_id}
+            self._answered.clear()
+            t0 = time.perf_counter()
+            self._pending[req_id] = t0
+            self.send(SCAN_REQ_TOPIC, json.dumps(body, separators=(",", ":")))
+            sent += 1
+            if self._answered.wait(self.timeout):
+                entry = ((time.perf_counter() - t0) * 1000, self._last_reason)
+            else:
+                self._pending.pop(req_id, None)
+                entry = (None, "timeout")
+            with self.lock:
+                self.results.append(entry)
+
+
+# ---------- Données de test ----------
+def seed_tickets(app, run_id: str, count: int) -> list[dict]:
+    """Insère des tickets validés et retourne les payloads de scan possibles."""
+    now = datetime.now(timezone.utc)
+    docs = [{
+        "user_id": f"bench-{run_id}",
+        "type": "single",
+        "status": "validated",
+        "validation_status": "validated",
+        "purchased_at": now,
+        "validated_at": now,
+        "expires_at": now + timedelta(hours=2),
+    } for _ in range(count)]
+    app.db.tickets.insert_many(docs)
+    with app.app_context():
+        return [{
+            "_id": str(d["_id"]),
+            "token": make_qr_token(d["_id"], d["type"], issued_at=now, valid_from=now,
+                                   valid_until=d["expires_at"]),
+        } for d in docs]
+
+
+def build_payloads(tickets: list[dict], mix: dict[str, int]) -> list[dict]:
+    """Répartit les payloads selon --mix (ex: token=70,id=25,invalid=5)."""
+    payloads = []
+    for kind, weight in mix.items():
+        for i in range(weight):
+            t = tickets[i % len(tickets)]
+            if kind == "token":
+                payloads.append({"token": t["token"]})
+            elif kind == "id":
+                payloads.append({"ticket_id": t["_id"]})
+            elif kind == "invalid":
+                payloads.append({"token": t["token"][:-4] + "AAAA"})
+    return payloads
+
+
+def parse_mix(s: str) -> dict[str, int]:
+    out = {}
+    for part in s.split(","):
+        kind, _, weight = part.partition("=")
+        kind = kind.strip()
+        if kind not in ("token", "id", "invalid"):
+            raise SystemExit(f"--mix: type inconnu '{kind}' (token, id, invalid)")
+        out[kind] = int(weight or 1)
+    return out
+
+
+# ---------- Statistiques ----------
+def percentile(sorted_values: list[float], p: float) -> float | None:
+    """Percentile par rang le plus proche (liste déjà triée)."""
+    if not sorted_values:
+        return None
+    k = min(len(sorted_values), max(1, math.ceil(p / 100 * len(sorted_values)))) - 1
+    return round(sorted_values[k], 3)
+
+
+def summarize(results: list, elapsed: float) -> dict:
+    latencies = sorted(ms for ms, _ in results if ms is not None)
+    reasons: dict[str, int] = {}
+    for _, reason in results:
+        reasons[reason] = reasons.get(reason, 0) + 1
+    return {
+        "requests": len(results),
+        "responses": len(latencies),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "max": round(latencies[-1], 3) if latencies else None,
+            "mean": round(sum(latencies) / len(latencies), 3) if latencies else None,
+        },
+        "reasons": reasons,
+    }
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except Exception:
+        return None
+
+
+def broker_reachable(url: str) -> bool:
+    u = urlparse(url)
+    try:
+        with socket.create_connection((u.hostname or "localhost", u.port or 1883), timeout=0.5):
+            return True
+    except OSError:
+        return False
+
+
+# ---------- Transports ----------
+def wire_inproc(app, devices: list[Device]) -> MqttManager:
+    broker = LocalBroker()
+    manager = MqttManager()
+    manager.setup_pipeline(app)
+    server_client = LocalClient(broker)
+    broker.subscribe(SCAN_REQ_TOPIC, lambda msg: manager._on_message(server_client, None, msg))
+    for d in devices:
+        broker.subscribe(d.resp_topic, d.on_response)
+        d.send = lambda topic, body: broker.publish(topic, body)
+    return manager
+
+
+def wire_mqtt(url: str, devices: list[Device]) -> list[mqtt.Client]:
+    u = urlparse(url)
+    host, port = u.hostname or "localhost", u.port or 1883
+    clients = []
+    for d in devices:
+        c = mqtt.Client(client_id=d.device_id, clean_session=True)
+        if u.username:
+            c.username_pw_set(u.username, u.password)
+        subscribed = threading.Event()
+        c.on_message = lambda client, userdata, msg, d=d: d.on_response(msg)
+        c.on_subscribe = lambda *args, ev=subscribed: ev.set()
+        c.connect(host, port, keepalive=30)
+        c.loop_start()
+        c.subscribe(d.resp_topic, qos=1)
+        if not subscribed.wait(5):
+            raise SystemExit(f"[BENCH] souscription impossible pour {d.device_id}")
+        d.send = lambda topic, body, c=c: c.publish(topic, body, qos=1)
+        clients.append(c)
+    return clients
+
+
+# ---------- Main ----------
+def main():
+    ap = argparse.ArgumentParser(description="Banc de charge du scan MQTT")
+    ap.add_argument("--devices", type=int, default=10, help="Nb de bornes simulées")
+    ap.add_argument("--duration", type=float, default=10.0, help="Durée du test (s)")
+    ap.add_argument("--requests", type=int, default=None, help="Nb max de scans par borne")
+    ap.add_argument("--timeout", type=float, default=5.0, help="Attente max d'une réponse (s)")
+    ap.add_argument("--tickets", type=int, default=200, help="Nb de tickets de test")
+    ap.add_argument("--mix", default="token=70,id=25,invalid=5", help="Répartition des payloads")
+    ap.add_argument("--broker", choices=("auto", "inproc", "mqtt"), default="auto")
+    ap.add_argument("--url", default="mqtt://localhost:1883", help="Broker pour --broker mqtt/auto")
+    ap.add_argument("--external", action="store_true", help="Ne pas démarrer l'app (déjà lancée ailleurs)")
+    ap.add_argument("--rate-limit", action="store_true", help="Garder le limiteur par borne (MQTT_DEVICE_RATE)")
+    ap.add_argument("--out", default=None, help="Fichier du rapport JSON (défaut: stdout)")
+    ap.add_argument("--keep", action="store_true", help="Ne pas supprimer les tickets de test")
+    args = ap.parse_args()
+
+    broker = args.broker
+    if broker == "auto":
+        broker = "mqtt" if broker_reachable(args.url) else "inproc"
+
+    # L'app (DB, SECRET_KEY, MqttManager) : MQTT démarré ici seulement pour --broker mqtt
+    os.environ["START_MQTT"] = "1" if broker == "mqtt" and not args.external else "0"
+    if broker == "mqtt":
+        os.environ["MQTT_URL"] = args.url
+    if not args.rate_limit:
+        os.environ["MQTT_DEVICE_RATE"] = "0"
+    from app import create_app
+    app = create_app()
+
+    run_id = uuid.uuid4().hex[:8]
+    tickets = seed_tickets(app, run_id, max(1, args.tickets))
+    payloads = build_payloads(tickets, parse_mix(args.mix))
+
+    results: list = []
+    lock = threading.Lock()
+    devices = [Device(f"bench-{run_id}-{i}", payloads, args.timeout, results, lock)
+               for i in range(args.devices)]
+
+    manager, clients = None, []
+    try:
+        if broker == "inproc":
+            manager = wire_inproc(app, devices)
+        else:
+            clients = wire_mqtt(args.url, devices)
+            manager = app.extensions.get("mqtt")
+            if manager and manager.client:
+                t_wait = time.time() + 10
+                while not manager.client.is_connected() and time.time() < t_wait:
+                    time.sleep(0.1)
+                time.sleep(0.5)  # laisse passer la souscription au topic de scan
+
+        started_at = datetime.now(timezone.utc)
+        print(f"[BENCH] broker={broker} devices={args.devices} durée={args.duration}s mix={args.mix}")
+        t0 = time.perf_counter()
+        deadline = t0 + args.duration
+        threads = [threading.Thread(target=d.run, args=(deadline, args.requests), daemon=True) for d in devices]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - t0
+    finally:
+        for c in clients:
+            c.loop_stop()
+            c.disconnect()
+        if not args.keep:
+            app.db.tickets.delete_many({"user_id": f"bench-{run_id}"})
+
+    limiter = getattr(manager, "device_limiter", None) if manager and manager.app else None
+    report = {
+        "meta": {
+            "tool": "scan_bench",
+            "revision": git_revision(),
+            "started_at": started_at.isoformat().replace("+00:00", "Z"),
+            "broker": broker,
+            "url": args.url if broker == "mqtt" else None,
+            "external_app": bool(args.external),
+            "devices": args.devices,
+            "duration_s": args.duration,
+            "mix": parse_mix(args.mix),
+            "tickets": len(tickets),
+            "scan_workers": int(os.getenv("MQTT_SCAN_WORKERS") or app.config.get("MQTT_SCAN_WORKERS", 4)),
+            "scan_queue": int(os.getenv("MQTT_SCAN_QUEUE") or app.config.get("MQTT_SCAN_QUEUE", 100)),
+            "device_limiter": ({"rate": limiter.rate, "burst": limiter.burst} if limiter else None),
+        },
+        **summarize(results, elapsed),
+        "server": manager.scan_stats() if manager and manager.app else None,
+    }
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+        print(f"[BENCH] rapport écrit dans {args.out}")
+    else:
+        print(text)
+    lat = report["latency_ms"]
+    print(f"[BENCH] {report['throughput_rps']} scans/s  p50={lat['p50']}ms  p95={lat['p95']}ms  "
+          f"p99={lat['p99']}ms  raisons={report['reasons']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+# app/bench/stops_bench.py
+# Usage:
+#   python -m app.bench.stops_bench --queries 2000 --out bench_stops.json
+#   python -m app.bench.stops_bench --synthetic 50000 --radius 800 --k 20
+#
+# Compare les deux chemins de /stops/near :
+#   - memory : index spatial en mémoire (app/stop_index.py, StopGrid.near)
+#   - mongo  : $geoNear sur l'index stops_geo (routes.arret_bus.near_mongo)
+#
+# - Points de requête tirés autour d'arrêts existants (jitter ~ --jitter m).
+# - --synthetic N : génère N arrêts aléatoires (autour de --center) dans une base
+#   temporaire "<base>_bench", supprimée à la fin ; sinon utilise db.stops tel quel.
+# - Rapport JSON : latences p50/p95/p99 (µs) par chemin, accord des résultats
+#   (mêmes arrêts dans le même ordre) et temps de chargement de l'index.
+
+import json, math, time, random, argparse
+
+from pymongo import GEOSPHERE
+
+from app.liste_ville.import_all_stop import get_db
+from app.stop_index import StopGrid, stop_row, M_PER_DEG_LAT
+from app.routes.arret_bus import near_mongo
+from app.bench.scan_bench import percentile, git_revision
+
+
+def load_points(db) -> list[tuple[float, float, dict]]:
+    points = []
+    for d in db.stops.find({"location.coordinates": {"$exists": True}},
+                           {"name": 1, "code": 1, "zone": 1, "location": 1}):
+        coords = (d.get("location") or {}).get("coordinates") or []
+        if len(coords) == 2:
+            lng, lat = float(coords[0]), float(coords[1])
+            points.append((lat, lng, stop_row(d, lat, lng)))
+    return points
+
+
+def seed_synthetic(db, n: int, center: tuple[float, float], spread_km: float, seed: int):
+    rng = random.Random(seed)
+    lat0, lng0 = center
+    dlat = spread_km * 1000 / M_PER_DEG_LAT
+    dlng = dlat / max(0.01, math.cos(math.radians(lat0)))
+    docs = [{
+        "name": f"Arrêt {i}",
+        "code": f"BN-{i}",
+        "city": "Bench",
+        "location": {"type": "Point", "coordinates": [lng0 + rng.uniform(-dlng, dlng),
+                                                      lat0 + rng.uniform(-dlat, dlat)]},
+    } for i in range(n)]
+    for i in range(0, n, 5000):
+        db.stops.insert_many(docs[i:i + 5000], ordered=False)
+    db.stops.create_index([("location", GEOSPHERE)], name="stops_geo")
+
+
+def timed(fn, queries) -> tuple[list[float], list[list[str]]]:
+    lat_us, ids = [], []
+    for q in queries:
+        t0 = time.perf_counter()
+        rows = fn(*q)
+        lat_us.append((time.perf_counter() - t0) * 1e6)
+        ids.append([r["id"] for r in rows])
+    return lat_us, ids
+
+
+def summary(lat_us: list[float]) -> dict:
+    s = sorted(lat_us)
+    total = sum(s)
+    return {
+        "queries": len(s),
+        "p50_us": percentile(s, 50),
+        "p95_us": percentile(s, 95),
+        "p99_us": percentile(s, 99),
+        "max_us": round(s[-1], 3) if s else None,
+        "qps": round(len(s) / (total / 1e6), 1) if total else None,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark /stops/near : index mémoire vs Mongo")
+    ap.add_argument("--queries", type=int, default=1000)
+    ap.add_argument("--radius", type=float, default=1200, help="Rayon (m), 0 = k plus proches seulement")
+    ap.add_argument("--k", type=int, default=20)
+    ap.add_argument("--jitter", type=float, default=500, help="Décalage max des points de requête (m)")
+    ap.add_argument("--cell-deg", type=float, default=0.01)
+    ap.add_argument("--synthetic", type=int, default=0, help="Nb d'arrêts générés (base temporaire)")
+    ap.add_argument("--center", default="49.2583,4.0317", help="Centre des arrêts générés (lat,lng)")
+    ap.add_argument("--spread-km", type=float, default=20)
+    ap.add_argument("--skip-mongo", action="store_true", help="Ne mesurer que l'index mémoire")
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--out", default=None, help="Fichier du rapport JSON (défaut: stdout)")
+    args = ap.parse_args()
+
+    db = get_db()
+    scratch = None
+    if args.synthetic:
+        scratch = db.client[f"{db.name}_bench"]
+        scratch.stops.drop()
+        lat0, lng0 = (float(x) for x in args.center.split(","))
+        seed_synthetic(scratch, args.synthetic, (lat0, lng0), args.spread_km, args.seed)
+        db = scratch
+
+    try:
+        t0 = time.perf_counter()
+        points = load_points(db)
+        grid = StopGrid(points, args.cell_deg)
+        load_ms = (time.perf_counter() - t0) * 1000
+        if not points:
+            raise SystemExit("Aucun arrêt géolocalisé : importez des arrêts ou utilisez --synthetic N.")
+
+        rng = random.Random(args.seed)
+        radius = args.radius if args.radius > 0 else None
+        queries = []
+        for _ in range(args.queries):
+            lat, lng, _row = rng.choice(points)
+            dlat = rng.uniform(-args.jitter, args.jitter) / M_PER_DEG_LAT
+            dlng = rng.uniform(-args.jitter, args.jitter) / (M_PER_DEG_LAT * max(0.01, math.cos(math.radians(lat))))
+            queries.append((lat + dlat, lng + dlng, radius, args.k))
+
+        mem_us, mem_ids = timed(grid.near, queries)
+        report = {
+            "meta": {
+                "tool": "stops_bench",
+                "revision": git_revision(),
+                "stops": len(points),
+                "synthetic": bool(args.synthetic),
+                "radius_m": args.radius,
+                "k": args.k,
+                "cell_deg": args.cell_deg,
+                "index_cells": len(grid.cells),
+                "index_load_ms": round(load_ms, 3),
+            },
+            "memory": summary(mem_us),
+            "mongo": None,
+            "agreement": None,
+        }
+
+        if not args.skip_mongo:
+            mongo_us, mongo_ids = timed(lambda la, ln, r, k: near_mongo(db, la, ln, r, k), queries)
+            report["mongo"] = summary(mongo_us)
+            same = sum(1 for a, b in zip(mem_ids, mongo_ids) if a == b)
+            same_set = sum(1 for a, b in zip(mem_ids, mongo_ids) if set(a) == set(b))
+            report["agreement"] = {
+                "same_order": round(same / len(queries), 4),
+                "same_set": round(same_set / len(queries), 4),
+            }
+            if report["memory"]["p50_us"]:
+                report["speedup_p50"] = round(report["mongo"]["p50_us"] / report["memory"]["p50_us"], 1)
+    finally:
+        if scratch is not None:
+            scratch.client.drop_database(scratch.name)
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+        print(f"[BENCH] rapport écrit dans {args.out}")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
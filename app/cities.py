@@ -0,0 +1,107 @@
+# app/cities.py
+"""
+Clé de ville normalisée + catalogue des villes.
+
+Points clés :
+- city_key : nom de ville sans accents, en minuscules, espaces normalisés
+  ("Besançon", "BESANCON ", "besancon" -> "besancon"). Posée sur chaque arrêt par
+  l'import (et par app/liste_ville/migrate_city_key.py pour les arrêts existants),
+  indexée (idx_stop_city_key) : /stops/by_city devient une égalité sur index.
+- Catalogue db.cities précalculé, un document par ville :
+      {_id: city_key, name, count, bbox: [min_lng, min_lat, max_lng, max_lat], updated_at}
+  Reconstruit après chaque import (rebuild_city_catalogue) : /stops/cities lit
+  quelques documents au lieu d'agréger toute la collection.
+- Marqueur db.meta {_id: "cities", ready: true} : posé lors de la première
+  reconstruction complète faite quand plus aucun arrêt n'est sans city_key
+  (migrate_city_key.py, ou premier import sur une base déjà à jour). Tant qu'il
+  est absent, les routes gardent l'ancien chemin (agrégation / $regex) : un
+  catalogue partiel (import d'une seule ville) ne masque jamais les autres villes.
+"""
+
+from datetime import datetime, timezone
+
+from app.stop_search import normalize
+
+# Anciens jeux de données : la ville peut être dans l'un de ces champs
+CITY_FIELDS = ("city", "ville", "town")
+CATALOGUE_META_ID = "cities"
+
+
+def city_key(name: str | None) -> str:
+    return " ".join(normalize(name).split())
+
+
+def raw_city(doc: dict) -> str | None:
+    for field in CITY_FIELDS:
+        value = doc.get(field)
+        if isinstance(value, str) and value.strip():
+            return value.strip()
+    return None
+
+
+def catalogue_ready(db) -> bool:
+    """Vrai si le catalogue couvre toutes les villes (marqueur posé en db.meta)."""
+    return bool((db.meta.find_one({"_id": CATALOGUE_META_ID}, {"ready": 1}) or {}).get("ready"))
+
+
+def _has_unmigrated_stops(db) -> bool:
+    return db.stops.find_one({"city_key": {"$exists": False}}, {"_id": 1}) is not None
+
+
+def rebuild_city_catalogue(db, keys=None) -> int:
+    """
+    Recalcule le catalogue (toutes les villes, ou seulement `keys`).
+    Les villes qui n'ont plus d'arrêt sont retirées. Retourne le nb de villes écrites.
+    Tant que le catalogue n'est pas marqué complet, une reconstruction partielle
+    devient complète dès que tous les arrêts ont leur city_key (puis marqueur posé).
+    """
+    complete = False
+    if not catalogue_ready(db) and not _has_unmigrated_stops(db):
+        keys, complete = None, True
+
+    match = {"city_key": {"$type": "string", "$ne": ""}}
+    if keys is not None:
+        keys = sorted({k for k in keys if k})
+        if not keys:
+            return 0
+        match["city_key"] = {"$in": keys}
+
+    rows = list(db.stops.aggregate([
+        {"$match": match},
+        {"$group": {
+            "_id": "$city_key",
+            "name": {"$first": {"$ifNull": ["$city", {"$ifNull": ["$ville", "$town"]}]}},
+            "count": {"$sum": 1},
+            "min_lng": {"$min": {"$arrayElemAt": ["$location.coordinates", 0]}},
+            "min_lat": {"$min": {"$arrayElemAt": ["$location.coordinates", 1]}},
+            "max_lng": {"$max": {"$arrayElemAt": ["$location.coordinates", 0]}},
+            "max_lat": {"$max": {"$arrayElemAt": ["$location.coordinates", 1]}},
+        }},
+    ]))
+
+    now = datetime.now(timezone.utc)
+    for r in rows:
+        bbox = [r["min_lng"], r["min_lat"], r["max_lng"], r["max_lat"]]
+        db.cities.replace_one(
+            {"_id": r["_id"]},
+            {
+                "name": r.get("name") or r["_id"],
+                "count": r["count"],
+                "bbox": bbox if None not in bbox else None,
+                "updated_at": now,
+            },
+            upsert=True,
+        )
+
+    found = [r["_id"] for r in rows]
+    gone = {"_id": {"$nin": found}}
+    if keys is not None:
+        gone = {"_id": {"$in": [k for k in keys if k not in set(found)]}}
+    db.cities.delete_many(gone)
+    if complete:
+        db.meta.update_one(
+            {"_id": CATALOGUE_META_ID},
+            {"$set": {"ready": True, "updated_at": now}},
+            upsert=True,
+        )
+    return len(rows)
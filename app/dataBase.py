@@ -72,6 +72,25 @@ def ensure_minimum_indexes(db):
     db.tickets.create_index([("user_id", ASCENDING)],  name="idx_ticket_user")
     db.tickets.create_index([("status",  ASCENDING)],  name="idx_ticket_status")
     db.tickets.create_index([("expires_at", ASCENDING)], name="idx_ticket_expires_at")
+    # Dashboard : abonnements non expirés (utilisateur, statut, échéance)
+    db.tickets.create_index(
+        [("user_id", ASCENDING), ("status", ASCENDING), ("expires_at", ASCENDING)],
+        name="idx_ticket_user_status_exp",
+    )
+    # Liste paginée "Mes tickets" (keyset sur _id décroissant)
+    db.tickets.create_index([("user_id", ASCENDING), ("_id", ASCENDING)], name="idx_ticket_user_id")
+    # Tickets émis pour un paiement Stripe : (pi_id, pi_seq) unique -> émission idempotente
+    db.tickets.create_index(
+        [("pi_id", ASCENDING), ("pi_seq", ASCENDING)],
+        name="uniq_ticket_pi_seq", unique=True,
+        partialFilterExpression={"pi_seq": {"$exists": True}},
+    )
+
+    # --- PAYMENTS (cf. app/fulfilment.py) ---
+    db.payments.create_index([("pi_id", ASCENDING)], unique=True, name="uniq_payment_pi")
+    # reprise des paiements "paid" non encore honorés
+    db.payments.create_index([("status", ASCENDING), ("updated_at", ASCENDING)], name="idx_payment_status_updated")
+
     # Si on veut que Mongo purge auto les tickets arrivés à expires_at,
     # db.tickets.create_index([("expires_at", ASCENDING)], expireAfterSeconds=0, name="ttl_expires_at")
 
@@ -102,6 +121,9 @@ def ensure_minimum_indexes(db):
             except Exception:
                 pass  # on ne bloque pas l'appli si l'index texte résiste
 
+    # 2) Ville normalisée (voir app/cities.py) : /stops/by_city = égalité sur index
+    db.stops.create_index([("city_key", ASCENDING)], name="idx_stop_city_key")
+
     # Index géospatial 2dsphere sur 'location'- idempotent (pas de crash si déjà présent)
     try:
         infos = db.stops.index_information()
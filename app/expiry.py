@@ -0,0 +1,155 @@
+# app/expiry.py
+"""
+Expiration des tickets.
+
+Points clés :
+- Les pages (liste, dashboard, détail…) n'écrivent plus rien : elles calculent
+  le statut "effectif" à partir de expires_at (apply_effective_status).
+- Un balayeur en arrière-plan (ExpirySweeper) passe réellement les tickets en
+  status="expired", par lots, en parcourant l'index idx_ticket_expires_at.
+- Config (app.config ou ENV) :
+    * EXPIRY_SWEEP_INTERVAL -> secondes entre deux passages (défaut 60, 0 = désactivé)
+    * EXPIRY_SWEEP_BATCH    -> taille d'un lot (défaut 500)
+- Les métriques (débit, durée du dernier passage…) sont exposées via stats()
+  et la route GET /metrics.
+"""
+
+import os
+import time
+import threading
+from datetime import datetime, timezone
+
+from flask import current_app
+
+EXPIRED_SET = {"status": "expired", "validation_status": None}
+
+
+def _aware(dt):
+    if dt is not None and getattr(dt, "tzinfo", None) is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt
+
+
+def is_expired(doc: dict, now: datetime | None = None) -> bool:
+    """Vrai si le ticket est expiré (statut en base OU échéance dépassée)."""
+    if doc.get("status") == "expired":
+        return True
+    exp = _aware(doc.get("expires_at"))
+    return bool(exp and exp <= (now or datetime.now(timezone.utc)))
+
+
+def apply_effective_status(doc: dict, now: datetime | None = None) -> dict:
+    """
+    Corrige le document EN MÉMOIRE (sans écrire en base) si l'échéance est passée
+    mais que le balayeur n'est pas encore passé.
+    """
+    if doc.get("status") != "expired" and is_expired(doc, now):
+        doc["status"] = "expired"
+        doc["validation_status"] = None
+        doc.setdefault("expired_at", _aware(doc.get("expires_at")))
+    return doc
+
+
+class ExpirySweeper:
+    def __init__(self, app=None):
+        self.app = None
+        self.interval = 60.0
+        self.batch = 500
+        self._thread: threading.Thread | None = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        # Borne basse : tout ce qui expire avant a déjà été balayé (expires_at est
+        # toujours fixé dans le futur à la validation, donc on ne rate rien).
+        self._watermark: datetime | None = None
+        self._stats = {
+            "runs": 0,
+            "errors": 0,
+            "swept_total": 0,
+            "last_run_at": None,
+            "last_run_swept": 0,
+            "last_run_ms": 0.0,
+            "last_run_rate": 0.0,   # tickets/s
+        }
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Lit la config, s'enregistre dans app.extensions et démarre le thread (daemon)."""
+        self.app = app
+        self.interval = float(os.getenv("EXPIRY_SWEEP_INTERVAL") or app.config.get("EXPIRY_SWEEP_INTERVAL", 60))
+        self.batch = max(1, int(os.getenv("EXPIRY_SWEEP_BATCH") or app.config.get("EXPIRY_SWEEP_BATCH", 500)))
+        app.extensions["expiry_sweeper"] = self
+
+        if self.interval <= 0:
+            app.logger.info("[EXPIRY] balayeur désactivé (EXPIRY_SWEEP_INTERVAL=0)")
+            return
+        self._thread = threading.Thread(target=self._run, name="expiry-sweeper", daemon=True)
+        self._thread.start()
+        app.logger.info(f"[EXPIRY] balayeur démarré (interval={self.interval}s batch={self.batch})")
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.sweep_once()
+            except Exception as e:
+                with self._lock:
+                    self._stats["errors"] += 1
+                self.app.logger.error(f"[EXPIRY] passage échoué: {e}")
+            self._stop.wait(self.interval)
+
+    def sweep_once(self, now: datetime | None = None) -> int:
+        """Un passage complet : marque expirés, lot par lot. Retourne le nombre de tickets modifiés."""
+        db = self.app.db
+        now = now or datetime.now(timezone.utc)
+        t0 = time.perf_counter()
+        swept = 0
+        lower = self._watermark
+
+        while True:
+            rng = {"$lte": now}
+            if lower is not None:
+                rng["$gte"] = lower
+            batch = list(
+                db.tickets.find(
+                    {"expires_at": rng, "status": {"$ne": "expired"}},
+                    {"_id": 1, "expires_at": 1},
+                )
+                .hint("idx_ticket_expires_at")
+                .sort("expires_at", 1)
+                .limit(self.batch)
+            )
+            if not batch:
+                break
+            # expired_at = échéance réelle (comme apply_effective_status), pas l'heure du passage
+            res = db.tickets.update_many(
+                {"_id": {"$in": [d["_id"] for d in batch]}, "status": {"$ne": "expired"}},
+                [{"$set": {**EXPIRED_SET, "expired_at": "$expires_at"}}],
+            )
+            swept += res.modified_count
+            lower = batch[-1]["expires_at"]
+            if len(batch) < self.batch:
+                break
+
+        self._watermark = now
+        elapsed = time.perf_counter() - t0
+        with self._lock:
+            st = self._stats
+            st["runs"] += 1
+            st["swept_total"] += swept
+            st["last_run_at"] = now.isoformat().replace("+00:00", "Z")
+            st["last_run_swept"] = swept
+            st["last_run_ms"] = round(elapsed * 1000, 2)
+            st["last_run_rate"] = round(swept / elapsed, 1) if elapsed > 0 else 0.0
+        return swept
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "interval_s": self.interval, "batch": self.batch}
+
+
+# Helper pour récupérer le balayeur depuis n'importe où
+def expiry_sweeper() -> "ExpirySweeper | None":
+    return current_app.extensions.get("expiry_sweeper")
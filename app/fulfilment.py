@@ -0,0 +1,200 @@
+# app/fulfilment.py
+"""
+Émission des tickets après paiement Stripe, pilotée par le webhook.
+
+Points clés :
+- db.payments : un document par PaymentIntent, unique sur pi_id (uniq_payment_pi)
+      {pi_id, user_id, type, qty, amount_cents, currency, status, ticket_ids, ...}
+  status : "created" (PI créé) -> "paid" (webhook payment_intent.succeeded)
+           -> "fulfilled" (tickets créés) ; ou "failed".
+- La route webhook (/payments/webhook) ne fait qu'enregistrer le paiement et le
+  mettre en file : la création des tickets tourne dans le thread Fulfiller.
+- Seuls les PaymentIntents créés par cette app (tracés par record_created, avec
+  metadata.user_id) sont honorés : ceux du Checkout hébergé ou d'un autre produit
+  du même compte Stripe sont ignorés.
+- Idempotence : chaque ticket d'un paiement porte (pi_id, pi_seq), unique
+  (uniq_ticket_pi_seq) -> un webhook rejoué, un finalize répété ou une reprise
+  après crash ne créent jamais de second lot.
+- File en mémoire + reprise : toutes les FULFILMENT_RETRY_INTERVAL secondes, les
+  paiements restés "paid" (processus arrêté, erreur…) sont traités à nouveau.
+- Le front (/payments/finalize, /tickets/api/after-payment) ne fait plus qu'une
+  lecture du statut : plus d'appel Stripe sur le chemin critique du paiement.
+"""
+
+import os
+import queue
+import threading
+from datetime import datetime, timedelta, timezone
+
+from flask import current_app
+
+PAID = "paid"
+FULFILLED = "fulfilled"
+FAILED = "failed"
+CREATED = "created"
+
+
+def record_created(db, pi_id: str, user_id: str, ttype: str, qty: int, amount_cents: int, currency: str):
+    """Trace le PaymentIntent dès sa création (le webhook le complètera)."""
+    now = datetime.now(timezone.utc)
+    db.payments.update_one(
+        {"pi_id": pi_id},
+        {"$setOnInsert": {
+            "pi_id": pi_id, "user_id": user_id, "type": ttype, "qty": qty,
+            "amount_cents": amount_cents, "currency": currency,
+            "status": CREATED, "ticket_ids": [], "created_at": now, "updated_at": now,
+        }},
+        upsert=True,
+    )
+
+
+def record_paid(db, pi: dict, prices: dict) -> dict | None:
+    """
+    Enregistre un PaymentIntent réussi (objet du webhook ou de PaymentIntent.retrieve).
+    Vérifie le montant ; retourne le document payments, ou None si le paiement est
+    inconnu (jamais tracé par record_created) ou déjà honoré.
+    """
+    meta = pi.get("metadata") or {}
+    if not meta.get("user_id"):
+        # pas un achat de tickets de cette app : on ne crée rien, on marque s'il était tracé
+        db.payments.update_one(
+            {"pi_id": pi["id"], "status": {"$ne": FULFILLED}},
+            {"$set": {"status": FAILED, "error": "metadata.user_id absent",
+                      "updated_at": datetime.now(timezone.utc)}},
+        )
+        return None
+    ttype = (meta.get("type") or "single").strip()
+    try:
+        qty = max(1, int(meta.get("qty") or 1))
+    except (TypeError, ValueError):
+        qty = 1
+    received = int(pi.get("amount_received") or 0)
+    expected = prices.get(ttype, prices["single"]) * qty
+    now = datetime.now(timezone.utc)
+
+    fields = {
+        "type": ttype, "qty": qty, "amount_cents": received,
+        "currency": (pi.get("currency") or "eur").lower(), "updated_at": now,
+    }
+    if received < expected:
+        fields.update(status=FAILED, error="Montant incohérent")
+    else:
+        fields.update(status=PAID, paid_at=now)
+
+    # pas d'upsert : seul un paiement tracé à la création, pour le même utilisateur,
+    # et jamais de retour en arrière sur un paiement déjà honoré
+    return db.payments.find_one_and_update(
+        {"pi_id": pi["id"], "user_id": meta["user_id"], "status": {"$ne": FULFILLED}},
+        {"$set": fields},
+        return_document=True,
+    )
+
+
+def record_failed(db, pi: dict):
+    db.payments.update_one(
+        {"pi_id": pi["id"], "status": {"$in": [CREATED, FAILED]}},
+        {"$set": {"status": FAILED, "error": (pi.get("last_payment_error") or {}).get("message"),
+                  "updated_at": datetime.now(timezone.utc)}},
+    )
+
+
+def fulfil(db, pi_id: str) -> dict | None:
+    """Crée les tickets d'un paiement "paid" (idempotent). Retourne le document payments."""
+    from app.routes.tickets import _insert_tickets  # import tardif (blueprint -> app)
+
+    pay = db.payments.find_one({"pi_id": pi_id})
+    if not pay or pay.get("status") != PAID:
+        return pay
+    ids = _insert_tickets(db, pay.get("user_id"), pay.get("type"), pay.get("qty") or 1, pi_id=pi_id)
+    return db.payments.find_one_and_update(
+        {"pi_id": pi_id},
+        {"$set": {"status": FULFILLED, "ticket_ids": ids, "fulfilled_at": datetime.now(timezone.utc)}},
+        return_document=True,
+    )
+
+
+class Fulfiller:
+    def __init__(self, app=None):
+        self.app = None
+        self.retry_interval = 30.0
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: threading.Thread | None = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._stats = {"queued": 0, "fulfilled": 0, "retried": 0, "errors": 0, "last_error": None}
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Lit la config, s'enregistre dans app.extensions et démarre le thread (daemon)."""
+        self.app = app
+        self.retry_interval = float(
+            os.getenv("FULFILMENT_RETRY_INTERVAL") or app.config.get("FULFILMENT_RETRY_INTERVAL", 30)
+        )
+        app.extensions["fulfiller"] = self
+
+        if self.retry_interval <= 0:
+            app.logger.info("[FULFIL] file désactivée (FULFILMENT_RETRY_INTERVAL=0) : traitement immédiat")
+            return
+        self._thread = threading.Thread(target=self._run, name="fulfiller", daemon=True)
+        self._thread.start()
+        app.logger.info(f"[FULFIL] file démarrée (reprise toutes les {self.retry_interval}s)")
+
+    def stop(self):
+        self._stop.set()
+
+    def submit(self, pi_id: str):
+        """Met un paiement en file ; sans thread (désactivé), traitement immédiat."""
+        with self._lock:
+            self._stats["queued"] += 1
+        if self._thread is None:
+            self._process(pi_id)
+        else:
+            self._queue.put(pi_id)
+
+    def _process(self, pi_id: str):
+        try:
+            with self.app.test_request_context():  # url_for (qr_path) hors requête
+                pay = fulfil(self.app.db, pi_id)
+            if pay and pay.get("status") == FULFILLED:
+                with self._lock:
+                    self._stats["fulfilled"] += 1
+        except Exception as e:
+            with self._lock:
+                self._stats["errors"] += 1
+                self._stats["last_error"] = str(e)
+            self.app.logger.error(f"[FULFIL] {pi_id} échoué (reprise au prochain passage): {e}")
+
+    def retry_stale(self, now: datetime | None = None) -> int:
+        """Reprend les paiements restés "paid" depuis plus d'un intervalle."""
+        now = now or datetime.now(timezone.utc)
+        cutoff = now - timedelta(seconds=self.retry_interval)
+        stale = [d["pi_id"] for d in self.app.db.payments.find(
+            {"status": PAID, "updated_at": {"$lte": cutoff}}, {"pi_id": 1}
+        ).limit(100)]
+        for pi_id in stale:
+            self._process(pi_id)
+        with self._lock:
+            self._stats["retried"] += len(stale)
+        return len(stale)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                pi_id = self._queue.get(timeout=self.retry_interval)
+            except queue.Empty:
+                try:
+                    self.retry_stale()
+                except Exception as e:
+                    self.app.logger.error(f"[FULFIL] reprise échouée: {e}")
+                continue
+            self._process(pi_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "pending": self._queue.qsize(), "retry_interval_s": self.retry_interval}
+
+
+# Helper pour récupérer la file depuis n'importe où
+def fulfiller() -> "Fulfiller | None":
+    return current_app.extensions.get("fulfiller")
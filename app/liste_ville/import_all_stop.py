@@ -3,16 +3,33 @@
 #   python -m app.liste_ville.import_all_json /app/data/arrets.json --clear
 #
 # - Normalise en {name, code, city, lines:[], location:{type:"Point", coordinates:[lng,lat]}}
-# - Crée les index (texte + 2dsphere)
+# - Crée les index (texte + 2dsphere + city_key)
+# - Pose city_key (ville normalisée) et met à jour le catalogue db.cities
 # - --clear : purge chaque ville avant insertion (ou flag "clear" par ville en A)
+# - --diff  : import différentiel par ville (clé = code, sinon hash stable) :
+#             insertions / mises à jour / suppressions en bulk_write non ordonnés
+#             par paquets de --chunk ; les arrêts inchangés ne sont pas touchés.
+#             lines n'est écrit qu'à l'insertion (le JSON n'en fournit pas : les
+#             lignes posées par import_gtfs sont conservées). Un arrêt d'avant
+#             import_key qui ne diffère que par cette clé est compté à part ("clés").
+#             --keep-missing : ne pas supprimer les arrêts absents du fichier.
+# - --bulk  : chargement en masse : les villes du fichier (remplacées) et les autres
+#             villes (recopiées) vont dans stops_staging sans index secondaire, les
+#             index sont construits une fois à la fin, puis stops_staging remplace
+#             stops d'un coup (renameCollection) : aucun lecteur ne voit d'import partiel.
+#             Les écritures faites sur stops pendant le chargement sont perdues.
 
-import os, json, argparse
+import os, json, hashlib, argparse
 from collections import defaultdict
 from typing import List, Dict, Any
 
-from pymongo import MongoClient, TEXT
+from pymongo import MongoClient, TEXT, ASCENDING, InsertOne, UpdateOne, DeleteOne
 from pymongo.errors import OperationFailure
 
+from app.stop_index import mark_stops_changed
+from app.cities import city_key, rebuild_city_catalogue
+from app.stop_search import normalize
+
 # ---------- DB ----------
 def get_db():
     """
@@ -35,28 +52,44 @@ def get_db():
 
     return db
 
-def ensure_indexes(db):
+def ensure_indexes(db, coll=None):
+    coll = db.stops if coll is None else coll
     try:
-        db.stops.create_index(
+        coll.create_index(
             [("name", TEXT), ("code", TEXT), ("city", TEXT)],
             name="stops_text", default_language="french",
         )
     except OperationFailure:
         pass
     try:
-        db.stops.create_index([("location", "2dsphere")], name="stops_geo")
+        coll.create_index([("location", "2dsphere")], name="stops_geo")
     except OperationFailure:
         pass
+    coll.create_index([("city_key", ASCENDING)], name="idx_stop_city_key")
+    # identité d'un arrêt dans sa ville (upserts de import_gtfs)
+    coll.create_index([("city_key", ASCENDING), ("import_key", ASCENDING)], name="idx_stop_city_import_key")
 
 # ---------- Normalisation ----------
+def stop_import_key(code, name: str, ckey: str, lng: float, lat: float) -> str:
+    """Identité stable d'un arrêt dans sa ville : le code s'il existe, sinon un hash."""
+    if code:
+        return f"c:{code}"
+    raw = f"{ckey}|{normalize(name)}|{lat:.6f}|{lng:.6f}"
+    return "h:" + hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
 def norm_stop(s: Dict[str, Any], city: str) -> Dict[str, Any]:
     # tolère lat/lng en str
     lat = float(s["lat"])
     lng = float(s["lng"])
+    name = s["name"].strip()
+    code = s.get("code") or None
+    ckey = city_key(city)
     return {
-        "name": s["name"].strip(),
-        "code": (s.get("code") or None),
+        "name": name,
+        "code": code,
         "city": city,
+        "city_key": ckey,
+        "import_key": stop_import_key(code, name, ckey, lng, lat),
         "lines": [],
         "location": {"type": "Point", "coordinates": [lng, lat]},
     }
@@ -103,12 +136,137 @@ def import_by_city(db, data_by_city: Dict[str, List[Dict[str, Any]]], clear_all:
             print(f"[{city}] avertissement insert_many: {e}")
         total = db.stops.count_documents({"city": city})
         print(f"[{city}] total en base: {total}")
+    # Catalogue des villes (nb d'arrêts, emprise) pour les villes touchées
+    cities = rebuild_city_catalogue(db, keys=[city_key(c) for c in data_by_city])
+    print(f"catalogue: {cities} villes mises à jour")
+    # Les index en mémoire de l'app (proximité…) se rechargeront
+    mark_stops_changed(db)
+
+# ---------- Chargement en masse ----------
+STAGING = "stops_staging"
+
+def bulk_load(db, data_by_city: Dict[str, List[Dict[str, Any]]], chunk: int = 5000):
+    staging = db[STAGING]
+    staging.drop()
+
+    # 1) villes absentes du fichier : recopiées telles quelles (même _id)
+    names = [c for c, docs in data_by_city.items() if docs]
+    keys = sorted({city_key(c) for c in names})
+    keep = {"$nor": [{"city_key": {"$in": keys}}, {"city": {"$in": names}}]}
+    db.stops.aggregate([{"$match": keep}, {"$out": STAGING}])
+    kept = staging.count_documents({})
+    print(f"recopie: {kept} arrêts des autres villes")
+
+    # 2) villes du fichier, sans maintenance d'index pendant l'insertion
+    for city in names:
+        docs = data_by_city[city]
+        for i in range(0, len(docs), chunk):
+            staging.insert_many(docs[i:i + chunk], ordered=False)
+        print(f"[{city}] import: +{len(docs)}")
+
+    # 3) index construits une fois, puis bascule atomique
+    ensure_indexes(db, staging)
+    staging.rename("stops", dropTarget=True)
+    print(f"bascule: stops = {kept + sum(len(data_by_city[c]) for c in names)} arrêts")
+
+    cities = rebuild_city_catalogue(db)
+    print(f"catalogue: {cities} villes")
+    mark_stops_changed(db)
+
+# ---------- Import différentiel ----------
+# Champs comparés entre le fichier et la base (le reste, dont lines, n'est jamais écrasé)
+DIFF_FIELDS = ("name", "code", "city", "city_key", "import_key", "location")
+
+def _existing_key(doc: Dict[str, Any]) -> str:
+    if doc.get("import_key"):
+        return doc["import_key"]
+    coords = (doc.get("location") or {}).get("coordinates") or [0.0, 0.0]
+    return stop_import_key(doc.get("code"), doc.get("name") or "", doc.get("city_key") or city_key(doc.get("city")),
+                           float(coords[0]), float(coords[1]))
+
+def diff_city(db, city: str, docs: List[Dict[str, Any]], delete_missing: bool = True):
+    """
+    Compare les arrêts du fichier à ceux de la ville en base.
+    Retourne (opérations bulk_write, compteurs).
+    """
+    counts = {"inserted": 0, "updated": 0, "keyed": 0, "deleted": 0, "unchanged": 0, "duplicates": 0}
+    wanted: Dict[str, Dict[str, Any]] = {}
+    for d in docs:
+        if d["import_key"] in wanted:
+            counts["duplicates"] += 1  # même clé deux fois dans le fichier : la dernière gagne
+        wanted[d["import_key"]] = d
+
+    ckey = city_key(city)
+    proj = {f: 1 for f in DIFF_FIELDS}
+    existing: Dict[str, Dict[str, Any]] = {}
+    ops = []
+    for cur in db.stops.find({"$or": [{"city_key": ckey}, {"city": city}]}, proj):
+        key = _existing_key(cur)
+        if key in existing:
+            ops.append(DeleteOne({"_id": cur["_id"]}))  # doublon déjà en base
+            counts["deleted"] += 1
+            continue
+        existing[key] = cur
+
+    for key, new in wanted.items():
+        cur = existing.get(key)
+        if cur is None:
+            ops.append(InsertOne(new))
+            counts["inserted"] += 1
+            continue
+        changes = {f: new.get(f) for f in DIFF_FIELDS if cur.get(f) != new.get(f)}
+        if changes:
+            ops.append(UpdateOne({"_id": cur["_id"]}, {"$set": changes}))
+            # seule la clé manquait (arrêt importé avant import_key) : rattrapage, pas une modif
+            counts["keyed" if changes.keys() == {"import_key"} and not cur.get("import_key") else "updated"] += 1
+        else:
+            counts["unchanged"] += 1
+
+    if delete_missing:
+        for key, cur in existing.items():
+            if key not in wanted:
+                ops.append(DeleteOne({"_id": cur["_id"]}))
+                counts["deleted"] += 1
+    return ops, counts
+
+def apply_ops(db, ops, chunk: int = 1000):
+    """bulk_write non ordonné, par paquets de `chunk` opérations."""
+    for i in range(0, len(ops), chunk):
+        db.stops.bulk_write(ops[i:i + chunk], ordered=False)
+
+def import_diff(db, data_by_city: Dict[str, List[Dict[str, Any]]], chunk: int = 1000, delete_missing: bool = True):
+    ensure_indexes(db)
+    totals = {"inserted": 0, "updated": 0, "keyed": 0, "deleted": 0, "unchanged": 0, "duplicates": 0}
+    touched = []
+    for city, docs in data_by_city.items():
+        if not docs:
+            continue
+        ops, counts = diff_city(db, city, docs, delete_missing=delete_missing)
+        if ops:
+            apply_ops(db, ops, chunk)
+            touched.append(city_key(city))
+        for k, v in counts.items():
+            totals[k] += v
+        print(f"[{city}] diff: +{counts['inserted']} ~{counts['updated']} -{counts['deleted']} "
+              f"={counts['unchanged']}" + (f" (clés: {counts['keyed']})" if counts["keyed"] else "")
+              + (f" (doublons fichier: {counts['duplicates']})" if counts["duplicates"] else ""))
+    if touched:
+        cities = rebuild_city_catalogue(db, keys=touched)
+        print(f"catalogue: {cities} villes mises à jour")
+        mark_stops_changed(db)
+    print(f"total: +{totals['inserted']} ~{totals['updated']} -{totals['deleted']} ={totals['unchanged']}"
+          + (f" (clés: {totals['keyed']})" if totals["keyed"] else ""))
+    return totals
 
 # ---------- Main ----------
 def main():
     ap = argparse.ArgumentParser(description="Import multi-villes depuis un JSON unique")
     ap.add_argument("json_path", help="Chemin du JSON (/app/data/arrets.json)")
     ap.add_argument("--clear", action="store_true", help="Purger chaque ville avant import")
+    ap.add_argument("--diff", action="store_true", help="Import différentiel (upsert/suppression ciblés)")
+    ap.add_argument("--keep-missing", action="store_true", help="--diff : garder les arrêts absents du fichier")
+    ap.add_argument("--bulk", action="store_true", help="Chargement en masse (collection de transit + renameCollection)")
+    ap.add_argument("--chunk", type=int, default=1000, help="--diff / --bulk : opérations par écriture")
     args = ap.parse_args()
 
     with open(args.json_path, "r", encoding="utf-8") as f:
@@ -134,7 +292,14 @@ def main():
         return
 
     db = get_db()
-    import_by_city(db, data_by_city, clear_all=args.clear, per_city_clear=per_city_clear)
+    if args.diff and args.bulk:
+        raise SystemExit("--diff et --bulk sont incompatibles.")
+    if args.bulk:
+        bulk_load(db, data_by_city, chunk=max(1, args.chunk))
+    elif args.diff:
+        import_diff(db, data_by_city, chunk=max(1, args.chunk), delete_missing=not args.keep_missing)
+    else:
+        import_by_city(db, data_by_city, clear_all=args.clear, per_city_clear=per_city_clear)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,137 @@
+# app/liste_ville/import_gtfs.py
+# Usage:
+#   python -m app.liste_ville.import_gtfs /app/data/gtfs.zip --city Besançon --clear
+#   python -m app.liste_ville.import_gtfs /app/data/gtfs.zip --city Besançon --no-lines
+#
+# Import d'un flux GTFS (zip local) dans la collection stops, même schéma que
+# import_all_stop : {name, code, city, city_key, import_key, lines, location}.
+# - stops.txt est lu en flux (csv sur le zip, sans extraction) ; seuls les arrêts /
+#   quais (location_type vide ou 0) sont gardés, les gares "parentes" sont ignorées.
+# - code = stop_code, sinon stop_id.
+# - lines : noms courts des lignes qui desservent l'arrêt, via routes.txt ->
+#   trips.txt -> stop_times.txt (lu en flux, seul {stop_id: lignes} est gardé).
+#   --no-lines pour sauter cette étape (stop_times.txt est souvent le plus gros fichier).
+# - Écriture par paquets de --chunk, progression et arrêts/s comme stream_import ;
+#   puis catalogue db.cities et version des arrêts.
+#     * --clear : purge de la ville puis insert_many non ordonné ;
+#     * sinon   : upsert sur (city_key, import_key) (bulk_write non ordonné) -> relancer
+#                 l'import met à jour les arrêts au lieu de les dupliquer.
+
+import argparse
+import csv
+import io
+import os
+import zipfile
+from typing import Any, Dict, Iterator, List, Set
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from app.cities import city_key, rebuild_city_catalogue
+from app.liste_ville.import_all_stop import get_db, ensure_indexes, norm_stop
+from app.liste_ville.stream_import import Progress, chunked
+from app.stop_index import mark_stops_changed
+
+
+def _read_csv(zf: zipfile.ZipFile, name: str) -> Iterator[Dict[str, str]]:
+    """Lignes d'un fichier du zip (tolère un sous-dossier et le BOM UTF-8)."""
+    member = next((n for n in zf.namelist() if n == name or n.endswith("/" + name)), None)
+    if member is None:
+        return
+    with zf.open(member) as raw:
+        for row in csv.DictReader(io.TextIOWrapper(raw, encoding="utf-8-sig", newline="")):
+            yield {k.strip(): (v or "").strip() for k, v in row.items() if k}
+
+
+def stop_lines(zf: zipfile.ZipFile) -> Dict[str, List[str]]:
+    """{stop_id: [noms de lignes triés]} à partir de routes / trips / stop_times."""
+    route_name = {
+        r["route_id"]: r.get("route_short_name") or r.get("route_long_name") or r["route_id"]
+        for r in _read_csv(zf, "routes.txt")
+    }
+    if not route_name:
+        return {}
+    trip_line = {t["trip_id"]: route_name.get(t.get("route_id"), "") for t in _read_csv(zf, "trips.txt")}
+    lines: Dict[str, Set[str]] = {}
+    for st in _read_csv(zf, "stop_times.txt"):
+        line = trip_line.get(st.get("trip_id"))
+        if line:
+            lines.setdefault(st.get("stop_id"), set()).add(line)
+    return {sid: sorted(v) for sid, v in lines.items()}
+
+
+def iter_gtfs_stops(zf: zipfile.ZipFile, city: str, lines: Dict[str, List[str]]) -> Iterator[Dict[str, Any]]:
+    for r in _read_csv(zf, "stops.txt"):
+        if r.get("location_type") not in ("", "0", None):
+            continue
+        try:
+            doc = norm_stop({
+                "name": r.get("stop_name") or r["stop_id"],
+                "code": r.get("stop_code") or r.get("stop_id"),
+                "lat": r["stop_lat"],
+                "lng": r["stop_lon"],
+            }, city)
+        except (KeyError, ValueError):
+            continue
+        doc["lines"] = lines.get(r.get("stop_id"), [])
+        if r.get("zone_id"):
+            doc["zone"] = r["zone_id"]
+        yield doc
+
+
+def import_gtfs(db, path: str, city: str, clear: bool = False, with_lines: bool = True,
+                chunk: int = 5000, progress: float = 5.0) -> Progress:
+    ensure_indexes(db)
+    key = city_key(city)
+    if clear:
+        deleted = db.stops.delete_many({"$or": [{"city_key": key}, {"city": city}]}).deleted_count
+        print(f"[{city}] purge: {deleted} documents supprimés")
+
+    prog = Progress(progress)
+    updated = 0
+    with zipfile.ZipFile(path) as zf:
+        lines = stop_lines(zf) if with_lines else {}
+        if with_lines:
+            print(f"[{city}] lignes: {len(lines)} arrêts desservis")
+        for batch in chunked(iter_gtfs_stops(zf, city, lines), chunk):
+            if clear:
+                try:
+                    prog.add((len(db.stops.insert_many(batch, ordered=False).inserted_ids), 0, 0))
+                except BulkWriteError as e:
+                    prog.add((e.details.get("nInserted", 0), 0, len(e.details.get("writeErrors", []))))
+                continue
+            ops = [UpdateOne({"city_key": key, "import_key": d["import_key"]}, {"$set": d}, upsert=True)
+                   for d in batch]
+            try:
+                res = db.stops.bulk_write(ops, ordered=False).bulk_api_result
+                errors = 0
+            except BulkWriteError as e:
+                res, errors = e.details, len(e.details.get("writeErrors", []))
+            updated += res.get("nMatched", 0)
+            prog.add((res.get("nUpserted", 0), 0, errors))
+
+    print(f"[{city}] " + prog.summary() + (f", mis à jour: {updated}" if updated else ""))
+    cities = rebuild_city_catalogue(db, keys=[key])
+    print(f"catalogue: {cities} villes mises à jour")
+    mark_stops_changed(db)
+    return prog
+
+
+# ---------- Main ----------
+def main():
+    ap = argparse.ArgumentParser(description="Import des arrêts depuis un flux GTFS (zip)")
+    ap.add_argument("zip_path", help="Chemin du zip GTFS (/app/data/gtfs.zip)")
+    ap.add_argument("--city", required=True, help="Ville à laquelle rattacher les arrêts du réseau")
+    ap.add_argument("--clear", action="store_true", help="Purger la ville avant import")
+    ap.add_argument("--no-lines", action="store_true", help="Ne pas lire routes/trips/stop_times")
+    ap.add_argument("--chunk", type=int, default=int(os.getenv("IMPORT_CHUNK") or 5000),
+                    help="Arrêts par paquet (insert_many / bulk_write)")
+    ap.add_argument("--progress", type=float, default=5.0, help="Intervalle de progression (s, 0 = muet)")
+    args = ap.parse_args()
+
+    import_gtfs(get_db(), args.zip_path, args.city.strip(), clear=args.clear,
+                with_lines=not args.no_lines, chunk=max(1, args.chunk), progress=args.progress)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+# app/liste_ville/migrate_city_key.py
+# Usage:
+#   python -m app.liste_ville.migrate_city_key            (arrêts sans city_key seulement)
+#   python -m app.liste_ville.migrate_city_key --all      (recalcule tout)
+#
+# - Pose city_key (cf. app/cities.py) sur les arrêts existants, par lots (bulk_write)
+# - Crée l'index idx_stop_city_key puis reconstruit le catalogue db.cities
+#   et pose le marqueur db.meta "cities" : /stops/cities et /stops/by_city passent
+#   alors sur le catalogue (ancien chemin agrégation / $regex jusque-là)
+# - Idempotent : peut être relancé sans risque
+
+import argparse
+
+from pymongo import ASCENDING, UpdateOne
+
+from app.cities import city_key, raw_city, rebuild_city_catalogue, CITY_FIELDS
+from app.liste_ville.import_all_stop import get_db
+from app.stop_index import mark_stops_changed
+
+
+def backfill_city_keys(db, batch: int = 1000, only_missing: bool = True) -> int:
+    query = {"city_key": {"$exists": False}} if only_missing else {}
+    proj = {f: 1 for f in CITY_FIELDS}
+    ops, updated = [], 0
+    for d in db.stops.find(query, proj):
+        key = city_key(raw_city(d))
+        ops.append(UpdateOne({"_id": d["_id"]}, {"$set": {"city_key": key}}))
+        if len(ops) >= batch:
+            updated += db.stops.bulk_write(ops, ordered=False).modified_count
+            ops = []
+    if ops:
+        updated += db.stops.bulk_write(ops, ordered=False).modified_count
+    return updated
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Migration : champ city_key + catalogue des villes")
+    ap.add_argument("--all", action="store_true", help="Recalculer city_key pour tous les arrêts")
+    ap.add_argument("--batch", type=int, default=1000)
+    args = ap.parse_args()
+
+    db = get_db()
+    updated = backfill_city_keys(db, batch=args.batch, only_missing=not args.all)
+    print(f"city_key posé sur {updated} arrêts")
+    db.stops.create_index([("city_key", ASCENDING)], name="idx_stop_city_key")
+    cities = rebuild_city_catalogue(db)
+    print(f"catalogue: {cities} villes")
+    mark_stops_changed(db)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+# app/liste_ville/stream_import.py
+# Usage:
+#   python -m app.liste_ville.stream_import /app/data/arrets.ndjson
+#   python -m app.liste_ville.stream_import /app/data/arrets.json --clear --workers 4
+#
+# Import en flux pour les gros jeux d'arrêts (centaines de milliers de lignes) :
+# - Entrées : NDJSON (une ligne = {city, name, lat, lng, code} ; une ligne illisible
+#   est comptée dans les "ignorés" sans interrompre l'import), format A
+#   ({"cities": [...]}, lu ville par ville sans charger le fichier) ou format B
+#   (liste JSON, lue élément par élément). --format auto : extension .ndjson/.jsonl,
+#   sinon premier caractère du fichier.
+# - Pipeline de générateurs : lecture -> normalisation (norm_stop) -> paquets de
+#   --chunk arrêts -> insert_many non ordonné. La mémoire ne dépend que de --chunk
+#   (et, en format A, de la plus grosse ville).
+# - --workers N : les paquets sont répartis sur un pool de N processus (une
+#   connexion Mongo par processus, au plus 2*N paquets en attente).
+# - --clear : purge chaque ville la première fois qu'elle apparaît (ou flag "clear"
+#   par ville en format A), avant tout envoi de ses arrêts.
+# - Progression (arrêts, arrêts/s) toutes les --progress secondes, bilan à la fin ;
+#   puis catalogue db.cities et version des arrêts mis à jour.
+
+import argparse
+import json
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from itertools import islice
+from typing import Any, Dict, Iterator, List, Tuple
+
+from pymongo.errors import BulkWriteError
+
+from app.cities import city_key, rebuild_city_catalogue
+from app.liste_ville.import_all_stop import get_db, ensure_indexes, norm_stop
+from app.stop_index import mark_stops_changed
+
+READ_SIZE = 1 << 16
+BAD_LINES_SHOWN = 10  # lignes NDJSON illisibles signalées une à une, au-delà : seulement comptées
+_CITIES_RE = re.compile(r'"cities"\s*:\s*\[')
+
+# ligne brute du pipeline : (ville, arrêt brut, purge demandée pour cette ville)
+Row = Tuple[str, Dict[str, Any], bool]
+
+
+# ---------- Lecture ----------
+def iter_json_array(fp, buf: str = "") -> Iterator[Any]:
+    """
+    Itère les éléments d'un tableau JSON dont le '[' vient d'être consommé
+    (`buf` = texte déjà lu après le '['). Un élément à la fois en mémoire.
+    `pos` avance dans le tampon ; il n'est compacté (buf[pos:]) qu'au moment de lire
+    la suite du fichier, pas à chaque élément.
+    """
+    decoder = json.JSONDecoder()
+    pos, eof = 0, False
+    while True:
+        # séparateurs entre éléments
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buf) or eof:
+                break
+            buf, pos = fp.read(READ_SIZE), 0
+            eof = not buf
+        if pos >= len(buf):
+            raise ValueError("JSON tronqué : ']' attendu")
+        if buf[pos] == "]":
+            return
+        try:
+            item, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            more = fp.read(READ_SIZE)
+            eof = not more
+            buf, pos = buf[pos:] + more, 0
+            continue
+        yield item
+        pos = end
+
+
+def _open_array(fp, pattern) -> str:
+    """Avance jusqu'au '[' cherché ; retourne le texte lu après lui."""
+    buf = ""
+    while True:
+        chunk = fp.read(READ_SIZE)
+        buf += chunk
+        m = pattern.search(buf)
+        if m:
+            return buf[m.end():]
+        if not chunk:
+            raise ValueError("tableau introuvable dans le JSON")
+        buf = buf[-64:]  # garde de quoi retrouver un motif coupé entre deux lectures
+
+
+def detect_format(path: str) -> str:
+    if path.endswith((".ndjson", ".jsonl")):
+        return "ndjson"
+    with open(path, "r", encoding="utf-8") as fp:
+        while True:
+            ch = fp.read(1)
+            if not ch or not ch.isspace():
+                break
+    if ch == "[":
+        return "b"
+    if ch == "{":
+        return "a"
+    raise ValueError("format non reconnu (attendu NDJSON, {'cities': [...]} ou une liste)")
+
+
+def iter_rows(path: str, fmt: str = "auto", clear_all: bool = False) -> Iterator[Row]:
+    if fmt == "auto":
+        fmt = detect_format(path)
+    with open(path, "r", encoding="utf-8") as fp:
+        if fmt == "ndjson":
+            bad = 0
+            for n, line in enumerate(fp, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    s = json.loads(line)
+                except json.JSONDecodeError as e:
+                    s = None
+                    err = e.msg
+                else:
+                    err = "objet attendu"
+                if not isinstance(s, dict):
+                    bad += 1
+                    if bad <= BAD_LINES_SHOWN:
+                        print(f"ligne {n} ignorée : {err}")
+                    yield None, {}, clear_all  # comptée dans les "ignorés"
+                    continue
+                yield s.get("city"), s, clear_all
+            if bad:
+                print(f"{bad} ligne(s) NDJSON illisible(s) ignorée(s)")
+        elif fmt == "b":
+            for s in iter_json_array(fp, _open_array(fp, re.compile(r"\["))):
+                yield s.get("city"), s, clear_all
+        else:
+            for c in iter_json_array(fp, _open_array(fp, _CITIES_RE)):
+                city = c.get("city") or c.get("name")
+                clear = clear_all or bool(c.get("clear", False))
+                for s in c.get("stops") or []:
+                    yield city, s, clear
+
+
+def chunked(it, size: int) -> Iterator[list]:
+    while True:
+        batch = list(islice(it, size))
+        if not batch:
+            return
+        yield batch
+
+
+# ---------- Écriture ----------
+def normalize_rows(rows: List[Tuple[str, Dict[str, Any]]]) -> Tuple[List[Dict[str, Any]], int]:
+    docs, skipped = [], 0
+    for city, s in rows:
+        if not city or not all(k in s for k in ("name", "lat", "lng")):
+            skipped += 1
+            continue
+        try:
+            docs.append(norm_stop(s, city))
+        except (TypeError, ValueError, AttributeError):
+            skipped += 1
+    return docs, skipped
+
+
+def insert_batch(db, rows: List[Tuple[str, Dict[str, Any]]]) -> Tuple[int, int, int]:
+    """Normalise et insère un paquet. Retourne (insérés, ignorés, erreurs d'écriture)."""
+    docs, skipped = normalize_rows(rows)
+    if not docs:
+        return 0, skipped, 0
+    try:
+        return len(db.stops.insert_many(docs, ordered=False).inserted_ids), skipped, 0
+    except BulkWriteError as e:
+        errors = len(e.details.get("writeErrors", []))
+        return e.details.get("nInserted", 0), skipped, errors
+
+
+_worker_db = None
+
+
+def _worker_init():
+    global _worker_db
+    _worker_db = get_db()
+
+
+def _worker_insert(rows):
+    return insert_batch(_worker_db, rows)
+
+
+class Progress:
+    def __init__(self, every: float = 5.0):
+        self.every = every
+        self.start = self.last = time.monotonic()
+        self.inserted = self.skipped = self.errors = 0
+
+    def add(self, result: Tuple[int, int, int]):
+        self.inserted += result[0]
+        self.skipped += result[1]
+        self.errors += result[2]
+        now = time.monotonic()
+        if self.every and now - self.last >= self.every:
+            self.last = now
+            print(f"... {self.inserted} arrêts, {self.rate():.0f}/s")
+
+    def rate(self) -> float:
+        return self.inserted / max(time.monotonic() - self.start, 1e-9)
+
+    def summary(self) -> str:
+        took = time.monotonic() - self.start
+        return (f"import: +{self.inserted} arrêts en {took:.1f}s ({self.rate():.0f}/s), "
+                f"ignorés: {self.skipped}, erreurs: {self.errors}")
+
+
+def stream_import(db, rows: Iterator[Row], chunk: int = 5000, workers: int = 0, progress: float = 5.0) -> Progress:
+    ensure_indexes(db)
+    seen: set = set()
+    prog = Progress(progress)
+
+    def batches():
+        for batch in chunked(rows, chunk):
+            out = []
+            for city, s, clear in batch:
+                key = city_key(city) if city else ""
+                if key and key not in seen:
+                    seen.add(key)
+                    if clear:
+                        deleted = db.stops.delete_many({"$or": [{"city_key": key}, {"city": city}]}).deleted_count
+                        print(f"[{city}] purge: {deleted} documents supprimés")
+                out.append((city, s))
+            yield out
+
+    if workers <= 0:
+        for b in batches():
+            prog.add(insert_batch(db, b))
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_worker_init) as pool:
+            pending = set()
+            for b in batches():
+                if len(pending) >= 2 * workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for f in done:
+                        prog.add(f.result())
+                pending.add(pool.submit(_worker_insert, b))
+            for f in pending:
+                prog.add(f.result())
+
+    print(prog.summary())
+    if seen:
+        cities = rebuild_city_catalogue(db, keys=seen)
+        print(f"catalogue: {cities} villes mises à jour")
+        mark_stops_changed(db)
+    return prog
+
+
+# ---------- Main ----------
+def main():
+    ap = argparse.ArgumentParser(description="Import en flux des arrêts (NDJSON / JSON multi-villes)")
+    ap.add_argument("path", help="Fichier NDJSON ou JSON (/app/data/arrets.ndjson)")
+    ap.add_argument("--format", choices=("auto", "ndjson", "a", "b"), default="auto")
+    ap.add_argument("--clear", action="store_true", help="Purger chaque ville avant import")
+    ap.add_argument("--chunk", type=int, default=int(os.getenv("IMPORT_CHUNK") or 5000),
+                    help="Arrêts par insert_many")
+    ap.add_argument("--workers", type=int, default=0, help="Processus d'insertion (0 = aucun pool)")
+    ap.add_argument("--progress", type=float, default=5.0, help="Intervalle de progression (s, 0 = muet)")
+    args = ap.parse_args()
+
+    db = get_db()
+    rows = iter_rows(args.path, args.format, clear_all=args.clear)
+    stream_import(db, rows, chunk=max(1, args.chunk), workers=max(0, args.workers), progress=args.progress)
+
+
+if __name__ == "__main__":
+    main()
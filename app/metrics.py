@@ -0,0 +1,125 @@
+# app/metrics.py
+"""
+Petits compteurs en mémoire (thread-safe) pour l'observabilité.
+
+- Counters     : compteurs nommés (accepted, rejected_busy, errors…)
+- StageTimings : durée par étape (nb, total, max) en millisecondes, depuis le démarrage
+                 + histogramme glissant par étape (RollingHistogram : p50/p95/p99
+                 sur les dernières `window` secondes)
+
+Chaque process garde ses propres valeurs ; elles sont servies par GET /metrics.
+"""
+
+import time
+import threading
+from bisect import bisect_left
+
+# Bornes hautes des seaux (ms), à peu près logarithmiques ; dernier seau = au-delà
+HIST_BOUNDS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+
+class Counters:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values: dict[str, int] = {}
+
+    def inc(self, name: str, n: int = 1):
+        with self._lock:
+            self._values[name] = self._values.get(name, 0) + n
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self._values)
+
+
+class RollingHistogram:
+    """
+    Histogramme à seaux fixes sur une fenêtre glissante : la fenêtre est découpée
+    en `slots` tranches ; la plus ancienne est recyclée quand le temps avance.
+    Pas de verrou propre : appelé sous le verrou de StageTimings.
+    """
+
+    def __init__(self, window: float = 60.0, slots: int = 6):
+        self.slot_seconds = window / slots
+        self._slots = [[-1, [0] * (len(HIST_BOUNDS_MS) + 1), 0.0] for _ in range(slots)]  # [époque, seaux, max]
+
+    def _slot(self, now: float) -> list:
+        epoch = int(now // self.slot_seconds)
+        slot = self._slots[epoch % len(self._slots)]
+        if slot[0] != epoch:
+            slot[0], slot[1], slot[2] = epoch, [0] * (len(HIST_BOUNDS_MS) + 1), 0.0
+        return slot
+
+    def record(self, ms: float, now: float):
+        slot = self._slot(now)
+        slot[1][bisect_left(HIST_BOUNDS_MS, ms)] += 1
+        if ms > slot[2]:
+            slot[2] = ms
+
+    def snapshot(self, now: float) -> dict:
+        oldest = int(now // self.slot_seconds) - len(self._slots) + 1
+        buckets = [0] * (len(HIST_BOUNDS_MS) + 1)
+        mx = 0.0
+        for epoch, counts, slot_max in self._slots:
+            if epoch >= oldest:
+                buckets = [a + b for a, b in zip(buckets, counts)]
+                mx = max(mx, slot_max)
+        n = sum(buckets)
+
+        def quantile(q):
+            # borne haute du seau qui contient le q-ième quantile (max observé pour le dernier)
+            if not n:
+                return None
+            rank, acc = q * n, 0
+            for i, c in enumerate(buckets):
+                acc += c
+                if acc >= rank:
+                    return min(HIST_BOUNDS_MS[i], round(mx, 3)) if i < len(HIST_BOUNDS_MS) else round(mx, 3)
+
+        return {
+            "count": n,
+            "p50_ms": quantile(0.50),
+            "p95_ms": quantile(0.95),
+            "p99_ms": quantile(0.99),
+            "max_ms": round(mx, 3),
+            "buckets": {("le_%g" % b if i < len(HIST_BOUNDS_MS) else "inf"): c
+                        for i, (b, c) in enumerate(zip(HIST_BOUNDS_MS + (None,), buckets)) if c},
+        }
+
+
+class StageTimings:
+    def __init__(self, window: float = 60.0):
+        self.window = window
+        self._lock = threading.Lock()
+        self._stages: dict[str, list] = {}  # nom -> [n, total_ms, max_ms]
+        self._hist: dict[str, RollingHistogram] = {}
+
+    def record(self, stage: str, ms: float):
+        now = time.monotonic()
+        with self._lock:
+            st = self._stages.setdefault(stage, [0, 0.0, 0.0])
+            st[0] += 1
+            st[1] += ms
+            if ms > st[2]:
+                st[2] = ms
+            hist = self._hist.get(stage)
+            if hist is None:
+                hist = self._hist[stage] = RollingHistogram(self.window)
+            hist.record(ms, now)
+
+    def window_snapshot(self) -> dict:
+        """Histogrammes glissants par étape (dernières `window` secondes)."""
+        now = time.monotonic()
+        with self._lock:
+            return {name: hist.snapshot(now) for name, hist in self._hist.items()}
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                name: {
+                    "count": n,
+                    "avg_ms": round(total / n, 3) if n else 0.0,
+                    "max_ms": round(mx, 3),
+                }
+                for name, (n, total, mx) in self._stages.items()
+            }
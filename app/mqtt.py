@@ -11,15 +11,45 @@ Points clés :
     * MQTT_TRANSPORT          -> "tcp" (défaut) ou "websockets"
     * MQTT_TLS                -> "1"/"true" pour activer TLS (si URL mqtts:// ou wss:// c'est auto)
     * START_MQTT              -> "0"/"false" pour désactiver MQTT proprement
+    * MQTT_SCAN_WORKERS       -> nb de threads qui traitent les scans (défaut 4)
+    * MQTT_SCAN_QUEUE         -> scans en attente max ; au-delà réponse "busy" (défaut 100)
+    * MQTT_SCAN_BATCH_MAX     -> nb max de tickets dans un scan groupé (défaut 50)
+    * MQTT_DEVICE_RATE / MQTT_DEVICE_BURST -> débit max par borne (jetons/s, rafale),
+                                 cf. app/rate_limit.py (défaut 20/s, rafale 40)
+    * MQTT_METRICS_INTERVAL   -> période (s) du résumé retenu publié sur METRICS_TOPIC (défaut 30, 0 = off)
+    * SCAN_METRICS_WINDOW     -> fenêtre glissante des histogrammes par étape (s, défaut 60)
+    * MQTT_SHARED_GROUP       -> groupe d'abonnement partagé ($share/<groupe>/...) pour
+                                 répartir les scans entre plusieurs instances (défaut: aucun)
+    * MQTT_REQ_DEDUP_TTL / MQTT_REQ_DEDUP_SIZE -> mémoire des req_id déjà traités
+                                 (défaut 60 s / 10000 ; TTL 0 = désactivé)
 
 - Connexion asynchrone (connect_async + loop_start) : l'app Flask démarre même si le broker n'est pas dispo.
 - Reconnexion automatique (backoff 1..30s) + LWT "online"/"offline".
+- Les événements (publish_event…) passent par une outbox durable (app/outbox.py) :
+  aucune attente du broker dans la requête HTTP, rien de perdu s'il redémarre.
 - Souscription au topic de scan et réponse par device_id.
+- Les tickets lus par les scans sont gardés dans un cache TTL/LRU (app/ticket_cache.py),
+  invalidé à chaque publish_event / publish_user_event (et par change stream si dispo).
+- Les scans sont traités par un pool de threads borné (pas sur le thread réseau
+  de paho) ; file pleine -> rejet immédiat avec reason="busy".
+- Contrôle d'admission, du moins cher au plus cher et toujours avant la DB :
+  doublon -> ignoré ; borne au-delà de son débit -> reason="rate_limited" ;
+  plafond global (workers + file) atteint -> reason="busy".
+- Durées par étape (decode, token_verify, db_lookup, expiry_update, publish…) en
+  histogrammes glissants ; résumé publié (retenu) sur METRICS_TOPIC et servi par
+  GET /metrics/scan (même contenu, cf. metrics_summary()).
+- Une requête (device_id, req_id) déjà reçue récemment (redélivrance QoS 1) est ignorée :
+  ni DB, ni seconde réponse. Mémoire locale à l'instance ; entre instances, les
+  transitions conditionnelles (app/ticket_state.py) restent de toute façon idempotentes.
 """
 
 import os
 import json
+import time
 import uuid
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlparse
 from datetime import datetime, timezone
 
@@ -27,16 +57,63 @@ import paho.mqtt.client as mqtt
 from flask import current_app
 from bson.objectid import ObjectId
 
+from app.expiry import apply_effective_status
+from app import ticket_state
+from app.security import verify_qr_token, token_window_state
+from app.metrics import Counters, StageTimings
+from app.ticket_cache import TicketCache, SCAN_FIELDS
+from app.outbox import Outbox
+from app.rate_limit import DeviceRateLimiter
+
 # --- Topics (convention)
 SCAN_REQ_TOPIC = "bc/tickets/scan/req"                         # demandes de scan
 SCAN_RESP_TOPIC = "bc/tickets/scan/resp/{device_id}"           # réponses par device
 EVENT_TOPIC = "bc/users/{user_id}/tickets/{ticket_id}/events"  # événements émis par l'app
+USER_EVENT_TOPIC = "bc/users/{user_id}/tickets/events"         # événements groupés (plusieurs tickets)
+STATUS_TOPIC = "bc/service/bus-city-api/status"                # online/offline (retenu)
+METRICS_TOPIC = "bc/service/bus-city-api/metrics"              # résumé périodique du scan (retenu)
 
 
 def _truthy(v) -> bool:
     return str(v).lower() in ("1", "true", "yes", "on")
 
 
+def scan_subscription(app) -> str:
+    """Filtre d'abonnement aux scans : partagé ($share/<groupe>/...) si MQTT_SHARED_GROUP est défini."""
+    group = (os.getenv("MQTT_SHARED_GROUP") or app.config.get("MQTT_SHARED_GROUP") or "").strip()
+    return f"$share/{group}/{SCAN_REQ_TOPIC}" if group else SCAN_REQ_TOPIC
+
+
+class RecentRequests:
+    """Clés vues récemment (TTL + taille max) : détection des redélivrances."""
+
+    def __init__(self, ttl: float = 60.0, max_items: int = 10000):
+        self.ttl = float(ttl)
+        self.max_items = max(1, int(max_items))
+        self._lock = threading.Lock()
+        self._seen: OrderedDict[tuple, float] = OrderedDict()  # clé -> échéance (monotonic)
+
+    def check_and_add(self, key: tuple) -> bool:
+        """True si la clé était déjà connue (doublon), sinon l'enregistre et retourne False."""
+        if self.ttl <= 0:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            # purge des plus anciennes (ordre d'insertion = ordre d'échéance)
+            while self._seen and next(iter(self._seen.values())) < now:
+                self._seen.popitem(last=False)
+            if key in self._seen:
+                return True
+            self._seen[key] = now + self.ttl
+            while len(self._seen) > self.max_items:
+                self._seen.popitem(last=False)
+            return False
+
+    def forget(self, key: tuple):
+        with self._lock:
+            self._seen.pop(key, None)
+
+
 def _load_cfg(app):
     """
     Résout la configuration MQTT depuis ENV et app.config.
@@ -104,6 +181,16 @@ class MqttManager:
     def __init__(self, app=None):
         self.client: mqtt.Client | None = None
         self.app = None
+        self._scan_pool: ThreadPoolExecutor | None = None
+        self._scan_slots: threading.BoundedSemaphore | None = None
+        self.scan_counters = Counters()
+        self.scan_timings = StageTimings()
+        self.ticket_cache = TicketCache(max_items=0)  # remplacé dans init_app
+        self.outbox: Outbox | None = None
+        self.recent_requests = RecentRequests(ttl=0)  # remplacé dans setup_pipeline
+        self.device_limiter = DeviceRateLimiter(rate=0)
+        self.instance_id: str | None = None
+        self._metrics_stop = threading.Event()
         if app:
             self.init_app(app)
 
@@ -122,11 +209,15 @@ class MqttManager:
             app.logger.info("[MQTT] désactivé (START_MQTT=0)")
             return
 
+        self.setup_pipeline(app)
+
         host, port, transport, use_tls, user, pwd = _load_cfg(app)
+        scan_filter = scan_subscription(app)
         app.logger.info(f"[MQTT] connexion → host={host} port={port} transport={transport} tls={use_tls}")
 
         # Crée le client MQTT
         cid = f"bus-city-api-{uuid.uuid4().hex[:8]}"
+        self.instance_id = cid
         self.client = mqtt.Client(client_id=cid, clean_session=True, transport=transport)
 
         # Auth si fournie
@@ -143,7 +234,7 @@ class MqttManager:
         # Reconnexion progressive (1..30s) + LWT (Last Will and Testament)
         self.client.reconnect_delay_set(min_delay=1, max_delay=30)
         self.client.will_set(
-            "bc/service/bus-city-api/status", payload="offline", qos=1, retain=True
+            STATUS_TOPIC, payload="offline", qos=1, retain=True
         )
 
         # --- Callbacks
@@ -152,13 +243,16 @@ class MqttManager:
                 app.logger.info(f"[MQTT] connecté ({host}:{port}, {transport})")
                 # Annonce "online"
                 client.publish(
-                    "bc/service/bus-city-api/status",
+                    STATUS_TOPIC,
                     payload="online",
                     qos=1,
                     retain=True,
                 )
-                # Souscription au topic de scan
-                client.subscribe(SCAN_REQ_TOPIC, qos=1)
+                # Souscription au topic de scan (partagée entre instances si MQTT_SHARED_GROUP)
+                client.subscribe(scan_filter, qos=1)
+                # Vide l'arriéré d'événements accumulé pendant la déconnexion
+                if self.outbox:
+                    self.outbox.wake()
             else:
                 app.logger.error(f"[MQTT] échec connection rc={rc}")
 
@@ -179,9 +273,60 @@ class MqttManager:
         except Exception as e:
             app.logger.error(f"[MQTT] connect_async error: {e}")
 
+        # Résumé périodique des métriques de scan (message retenu)
+        interval = float(os.getenv("MQTT_METRICS_INTERVAL") or app.config.get("MQTT_METRICS_INTERVAL", 30))
+        if interval > 0:
+            threading.Thread(
+                target=self._metrics_loop, args=(interval,), name="mqtt-metrics", daemon=True
+            ).start()
+
         # Expose dans app.extensions
         app.extensions["mqtt"] = self
 
+    def setup_pipeline(self, app):
+        """
+        Prépare le traitement des scans et des événements, sans client réseau :
+        pool de workers, cache des tickets, outbox.
+        Réutilisé tel quel par le banc de charge (app/bench/scan_bench.py).
+        """
+        self.app = app
+        self.scan_timings = StageTimings(
+            window=float(os.getenv("SCAN_METRICS_WINDOW") or app.config.get("SCAN_METRICS_WINDOW", 60))
+        )
+
+        # Pool de traitement des scans : workers + file bornée (sémaphore = workers + file)
+        workers = max(1, int(os.getenv("MQTT_SCAN_WORKERS") or app.config.get("MQTT_SCAN_WORKERS", 4)))
+        queue_depth = max(0, int(os.getenv("MQTT_SCAN_QUEUE") or app.config.get("MQTT_SCAN_QUEUE", 100)))
+        self._scan_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="mqtt-scan")
+        self._scan_slots = threading.BoundedSemaphore(workers + queue_depth)
+
+        # Cache des tickets "chauds" (scans répétés) + invalidation par change stream si possible
+        self.ticket_cache = TicketCache(
+            max_items=int(os.getenv("SCAN_CACHE_SIZE") or app.config.get("SCAN_CACHE_SIZE", 10000)),
+            ttl=float(os.getenv("SCAN_CACHE_TTL") or app.config.get("SCAN_CACHE_TTL", 120)),
+            ttl_no_stream=float(os.getenv("SCAN_CACHE_TTL_NO_STREAM") or app.config.get("SCAN_CACHE_TTL_NO_STREAM", 5)),
+        )
+        if _truthy(os.getenv("SCAN_CACHE_CHANGE_STREAM") or app.config.get("SCAN_CACHE_CHANGE_STREAM", "1")):
+            self.ticket_cache.watch(app.db, app.logger)
+        elif self.ticket_cache.enabled:
+            self.ticket_cache.without_change_stream(app.logger, "SCAN_CACHE_CHANGE_STREAM=0")
+
+        # Outbox des événements (thread de publication + débordement Mongo)
+        self.outbox = Outbox(app, lambda: self.client)
+
+        # Redélivrances QoS 1 : (device_id, req_id) déjà traités
+        self.recent_requests = RecentRequests(
+            ttl=float(os.getenv("MQTT_REQ_DEDUP_TTL") or app.config.get("MQTT_REQ_DEDUP_TTL", 60)),
+            max_items=int(os.getenv("MQTT_REQ_DEDUP_SIZE") or app.config.get("MQTT_REQ_DEDUP_SIZE", 10000)),
+        )
+
+        # Seau à jetons par borne (avant la file, donc avant toute lecture DB)
+        self.device_limiter = DeviceRateLimiter(
+            rate=float(os.getenv("MQTT_DEVICE_RATE") or app.config.get("MQTT_DEVICE_RATE", 20)),
+            burst=float(os.getenv("MQTT_DEVICE_BURST") or app.config.get("MQTT_DEVICE_BURST", 40)),
+            max_devices=int(os.getenv("MQTT_DEVICE_TRACK_MAX") or app.config.get("MQTT_DEVICE_TRACK_MAX", 10000)),
+        )
+
     # ---- API utilitaire ---------------------------------------------------
 
     def publish_event(
@@ -194,116 +339,400 @@ class MqttManager:
     ):
         """
         Publie un événement (achat, validation, expiration…) sur le topic par ticket.
-        N'envoie rien si le client n'est pas connecté (et log un warning).
+        L'événement est déposé dans l'outbox : publié en arrière-plan, conservé
+        si le broker est indisponible.
         """
         topic = EVENT_TOPIC.format(user_id=user_id, ticket_id=ticket_id)
-        if not self.client or not self.client.is_connected():
-            current_app.logger.warning(f"[MQTT] publish ignoré (client non connecté) → {topic}")
+        self.ticket_cache.invalidate(ticket_id)  # le ticket vient de changer
+        self._enqueue_json(topic, payload, qos=qos, retain=retain)
+
+    def publish_user_event(
+        self,
+        user_id: str,
+        payload: dict,
+        qos: int = 1,
+        retain: bool = False,
+    ):
+        """
+        Publie UN seul événement groupé pour un utilisateur (ex.: achat de N tickets).
+        Le payload porte la liste des ticket_ids concernés.
+        """
+        topic = USER_EVENT_TOPIC.format(user_id=user_id)
+        self.ticket_cache.invalidate(*(payload.get("ticket_ids") or []))
+        self._enqueue_json(topic, payload, qos=qos, retain=retain)
+
+    def _enqueue_json(self, topic: str, payload: dict, qos: int = 1, retain: bool = False):
+        body = json.dumps(payload, separators=(",", ":"))
+        if self.outbox is None:
+            current_app.logger.warning(f"[MQTT] publish ignoré (outbox absente) → {topic}")
             return
-        try:
-            self.client.publish(
-                topic, json.dumps(payload, separators=(",", ":")), qos=qos, retain=retain
-            )
-        except Exception as e:
-            current_app.logger.error(f"[MQTT] publish error: {e}")
+        self.outbox.enqueue(topic, body, qos=qos, retain=retain)
 
     # ---- Callbacks messages ----------------------------------------------
 
     def _on_message(self, client: mqtt.Client, userdata, msg):
         """
-        Réception d'un message (ex.: requête de scan).
-        On ouvre un app_context Flask pour accéder à current_app / DB.
+        Réception d'un message (ex.: requête de scan) sur le thread réseau de paho.
+        On ne fait ici que le décodage JSON et l'admission, puis on délègue au pool :
+        borne trop bavarde -> "rate_limited", file pleine -> "busy" (backpressure).
         """
         # Filtre : nous n'écoutons que SCAN_REQ_TOPIC ici, mais on reste générique
+        # (en abonnement partagé, le broker livre le topic réel, sans le préfixe $share)
         topic = msg.topic or ""
         if topic != SCAN_REQ_TOPIC:
             return
 
-        # Contexte Flask
-        with self.app.app_context():
-            try:
-                data = json.loads(msg.payload.decode("utf-8"))
-            except Exception:
-                # payload invalide => on ignore
-                return
+        t0 = time.perf_counter()
+        try:
+            data = json.loads(msg.payload.decode("utf-8"))
+        except Exception:
+            # payload invalide => on ignore
+            self.scan_counters.inc("invalid_payload")
+            return
+        if not isinstance(data, dict):
+            self.scan_counters.inc("invalid_payload")
+            return
+        t_decoded = time.perf_counter()
+        self.scan_timings.record("decode", (t_decoded - t0) * 1000)
+
+        # Redélivrance (QoS 1) d'une requête déjà reçue : rien à refaire, rien à renvoyer
+        device_id = str(data.get("device_id") or "").strip() or "unknown"
+        dedup_key = (device_id, str(data["req_id"])) if data.get("req_id") else None
+        if dedup_key and self.recent_requests.check_and_add(dedup_key):
+            self.scan_counters.inc("duplicates")
+            self.device_limiter.count(device_id, "duplicates")
+            return
 
-            device_id = (data.get("device_id") or "unknown").strip()
+        # Débit par borne : une borne qui boucle ne doit pas affamer les autres
+        if not self.device_limiter.allow(device_id):
+            self.scan_counters.inc("rejected_rate_limited")
+            if dedup_key:
+                self.recent_requests.forget(dedup_key)
             req_id = data.get("req_id") or uuid.uuid4().hex
-            token = data.get("token")
-            ticket_id_raw = data.get("ticket_id")  # fallback si pas de token signé
+            self._publish_scan_response(client, data, {"req_id": req_id, "ok": False, "reason": "rate_limited"})
+            return
 
-            # --- Vérification token/ID
-            db = current_app.db
-            ticket_doc = None
+        if self._scan_slots is None or not self._scan_slots.acquire(blocking=False):
+            self.scan_counters.inc("rejected_busy")
+            self.device_limiter.count(device_id, "busy")
+            if dedup_key:
+                self.recent_requests.forget(dedup_key)  # la borne pourra renvoyer le même req_id
+            req_id = data.get("req_id") or uuid.uuid4().hex
+            self._publish_scan_response(client, data, {"req_id": req_id, "ok": False, "reason": "busy"})
+            return
 
-            # Option A : token signé (recommandé)
-            payload = None
+        self.scan_counters.inc("accepted")
+        self.device_limiter.count(device_id, "accepted")
+        try:
+            self._scan_pool.submit(self._process_scan, client, data, t_decoded)
+        except RuntimeError:
+            # pool arrêté (fin de process)
+            self._scan_slots.release()
+
+    def _process_scan(self, client: mqtt.Client, data: dict, t_enqueued: float):
+        """Exécuté par un worker du pool : traitement du scan + réponse."""
+        t_start = time.perf_counter()
+        self.scan_timings.record("queue_wait", (t_start - t_enqueued) * 1000)
+        try:
+            # Contexte Flask
+            with self.app.app_context():
+                try:
+                    resp = self._handle_scan(data)
+                except Exception as e:
+                    self.scan_counters.inc("errors")
+                    current_app.logger.error(f"[MQTT] scan error: {e}")
+                    resp = {"req_id": data.get("req_id"), "ok": False, "reason": "error"}
+                t_handled = time.perf_counter()
+                self.scan_timings.record("handle", (t_handled - t_start) * 1000)
+
+                self._publish_scan_response(client, data, resp)
+                t_done = time.perf_counter()
+                self.scan_timings.record("publish", (t_done - t_handled) * 1000)
+                self.scan_timings.record("total", (t_done - t_enqueued) * 1000)
+        finally:
+            self._scan_slots.release()
+
+    def _publish_scan_response(self, client: mqtt.Client, data: dict, resp: dict):
+        # Répondre sur le topic du device
+        device_id = (str(data.get("device_id") or "")).strip() or "unknown"
+        resp_topic = SCAN_RESP_TOPIC.format(device_id=device_id)
+        try:
+            client.publish(resp_topic, json.dumps(resp, separators=(",", ":")), qos=1, retain=False)
+        except Exception as e:
+            self.app.logger.error(f"[MQTT] publish response error: {e}")
+
+    def scan_stats(self) -> dict:
+        """Compteurs et durées par étape du pipeline de scan (servis par GET /metrics)."""
+        return {
+            "counters": self.scan_counters.snapshot(),
+            "stages": self.scan_timings.snapshot(),
+            "cache": self.ticket_cache.stats(),
+            "devices": self.device_limiter.stats(),
+        }
+
+    def metrics_summary(self) -> dict:
+        """
+        Vue "live" du scan : compteurs + histogrammes glissants par étape.
+        Même contenu sur METRICS_TOPIC (MQTT, retenu) et GET /metrics/scan (HTTP).
+        """
+        return {
+            "instance": self.instance_id,
+            "ts": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
+            "window_s": self.scan_timings.window,
+            "counters": self.scan_counters.snapshot(),
+            "stages": self.scan_timings.window_snapshot(),
+        }
+
+    def _metrics_loop(self, interval: float):
+        while not self._metrics_stop.wait(interval):
+            if not self.client or not self.client.is_connected():
+                continue
             try:
-                from app.security import verify_qr_token  # si implémenté
-                if token:
-                    payload = verify_qr_token(token)
-            except Exception:
-                payload = None
+                self.client.publish(
+                    METRICS_TOPIC,
+                    json.dumps(self.metrics_summary(), separators=(",", ":")),
+                    qos=0,
+                    retain=True,
+                )
+            except Exception as e:
+                self.app.logger.error(f"[MQTT] publish metrics error: {e}")
 
-            tid = None
-            if payload and payload.get("tid"):
-                tid = payload["tid"]
-            elif ticket_id_raw:
-                tid = ticket_id_raw
+    def _handle_scan(self, data: dict) -> dict:
+        """
+        Traite une requête de scan et retourne la réponse (dict).
+        Enveloppe "lot" si la requête contient items / tokens / ticket_ids (cf. _handle_scan_batch).
+        Ordre de résolution pour un ticket :
+          1) jeton signé portant une fenêtre de validité -> réponse sans DB
+             (sauf contrôle de révocation si QR_REVOCATION_CHECK=1) ;
+          2) sinon lecture du ticket en base (ticket_id du jeton ou brut).
+        """
+        if any(isinstance(data.get(k), list) for k in ("items", "tokens", "ticket_ids")):
+            return self._handle_scan_batch(data)
 
-            resp = {"req_id": req_id, "ok": False, "reason": "invalid"}
+        req_id = data.get("req_id") or uuid.uuid4().hex
+        want_validate = bool(data.get("validate"))  # borne : valider le ticket au passage
 
-            if tid:
-                try:
-                    ticket_doc = db.tickets.find_one({"_id": ObjectId(tid)})
-                except Exception:
-                    ticket_doc = None
-
-            now = datetime.now(timezone.utc)
-
-            if ticket_doc:
-                # Normaliser tz de expires_at si naïf
-                exp = ticket_doc.get("expires_at")
-                if exp and getattr(exp, "tzinfo", None) is None:
-                    exp = exp.replace(tzinfo=timezone.utc)
-
-                status = ticket_doc.get("status") or "active"
-                vstat = ticket_doc.get("validation_status")
-
-                # Marquer expiré si nécessaire
-                if exp and exp <= now and status != "expired":
-                    db.tickets.update_one(
-                        {"_id": ticket_doc["_id"]},
-                        {"$set": {"status": "expired", "expired_at": now, "validation_status": None}},
-                    )
-                    status = "expired"
-                    vstat = None
-
-                remaining = int((exp - now).total_seconds()) if exp else None
-
-                resp.update(
-                    {
-                        "ok": True,
-                        "reason": None,
-                        "ticket_id": str(ticket_doc["_id"]),
-                        "type": ticket_doc.get("type"),
-                        "status": status,
-                        "validation_status": vstat,
-                        "validated_at": ticket_doc.get("validated_at").isoformat()
-                        if ticket_doc.get("validated_at")
-                        else None,
-                        "expires_at": exp.isoformat().replace("+00:00", "Z") if exp else None,
-                        "server_now": now.isoformat().replace("+00:00", "Z"),
-                        "remaining_seconds": remaining,
-                    }
-                )
+        db = current_app.db
+        now = datetime.now(timezone.utc)
+        resp = {"req_id": req_id, "ok": False, "reason": "invalid"}
+
+        # --- Vérification token/ID
+        tid, early = self._resolve_scan_item(data, now, want_validate)
+        if early is not None:
+            if early.get("source") == "token" and self._is_revoked(db, tid):
+                return {**resp, "reason": "revoked"}
+            return {**resp, **early}
 
-            # Répondre sur le topic du device
-            resp_topic = SCAN_RESP_TOPIC.format(device_id=device_id or "unknown")
+        ticket_doc = None
+        validated_now = False
+
+        if tid and want_validate:
+            # active|pending -> validated en un seul aller-retour (cf. app/ticket_state.py)
+            t0 = time.perf_counter()
             try:
-                client.publish(resp_topic, json.dumps(resp, separators=(",", ":")), qos=1, retain=False)
-            except Exception as e:
-                current_app.logger.error(f"[MQTT] publish response error: {e}")
+                ticket_doc = ticket_state.transition(db, tid, "validate", now=now)
+                validated_now = True
+                self.ticket_cache.put(ticket_doc)
+            except ticket_state.InvalidTransition:
+                # déjà validé / expiré : l'état en cache est peut-être périmé (écrit par un
+                # autre process), on relit Mongo ci-dessous
+                ticket_doc = None
+                self.ticket_cache.invalidate(tid)
+            except ticket_state.TicketNotFound:
+                self.ticket_cache.invalidate(tid)
+                tid = None
+            self.scan_timings.record("expiry_update", (time.perf_counter() - t0) * 1000)
+
+        if tid and ticket_doc is None:
+            ticket_doc = self._lookup_ticket(db, tid, fresh=want_validate)
+
+        if not ticket_doc:
+            return resp
+        return {**resp, **self._doc_response(ticket_doc, now, validated_now)}
+
+    def _handle_scan_batch(self, data: dict) -> dict:
+        """
+        Lot de scans sous un seul req_id :
+            {"req_id": "...", "device_id": "...", "validate": false,
+             "items": [{"token": "..."}, {"ticket_id": "..."}, "<token>", ...]}
+        (ou "tokens": [...] / "ticket_ids": [...]).
+        Tous les tickets à lire sont résolus par UN find {_id: {$in: [...]}}
+        (+ UN update_many si validate), et la réponse est un seul message :
+            {"req_id", "ok": true, "batch": true, "count": N, "results": [...]}
+        """
+        req_id = data.get("req_id") or uuid.uuid4().hex
+        want_validate = bool(data.get("validate"))
+
+        items = []
+        for it in data.get("items") or []:
+            items.append(it if isinstance(it, dict) else {"token": it})
+        items += [{"token": t} for t in data.get("tokens") or []]
+        items += [{"ticket_id": t} for t in data.get("ticket_ids") or []]
+
+        max_batch = int(os.getenv("MQTT_SCAN_BATCH_MAX") or self.app.config.get("MQTT_SCAN_BATCH_MAX", 50))
+        if not items or len(items) > max_batch:
+            return {"req_id": req_id, "ok": False, "batch": True,
+                    "reason": "batch_empty" if not items else "batch_too_large"}
+
+        db = current_app.db
+        # précision milliseconde (celle de Mongo) pour reconnaître "validé par ce lot"
+        now = datetime.now(timezone.utc)
+        now = now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+        results: list[dict | None] = [None] * len(items)
+        lookups: dict[int, str] = {}      # index -> ticket_id à lire en base
+        revocations: dict[int, str] = {}  # index -> ticket_id répondu par jeton
+        for i, item in enumerate(items):
+            tid, early = self._resolve_scan_item(item, now, want_validate)
+            if early is not None:
+                results[i] = {"ok": False, "reason": "invalid", **early}
+                if early.get("source") == "token":
+                    revocations[i] = tid
+            elif tid and ObjectId.is_valid(str(tid)):
+                lookups[i] = str(tid)
+            else:
+                results[i] = {"ok": False, "reason": "invalid"}
+
+        if revocations and not self._revocation_check_enabled():
+            revocations = {}
+
+        wanted = set(lookups.values()) | set(revocations.values())
+        docs = {}
+        if want_validate and lookups:
+            t0 = time.perf_counter()
+            ticket_state.transition_many(db, set(lookups.values()), "validate", now=now)
+            self.ticket_cache.invalidate(*lookups.values())
+            self.scan_timings.record("expiry_update", (time.perf_counter() - t0) * 1000)
+        for tid in wanted:
+            cached = self.ticket_cache.get(tid)
+            if cached is not None:
+                docs[tid] = cached
+        missing = wanted - set(docs)
+        if missing:
+            t0 = time.perf_counter()
+            for d in db.tickets.find({"_id": {"$in": [ObjectId(t) for t in missing]}}, SCAN_FIELDS):
+                self.ticket_cache.put(d)
+                docs[str(d["_id"])] = d
+            self.scan_timings.record("db_lookup", (time.perf_counter() - t0) * 1000)
+
+        for i, tid in revocations.items():
+            if tid not in docs:
+                results[i] = {"ok": False, "reason": "revoked"}
+        for i, tid in lookups.items():
+            doc = docs.get(tid)
+            if doc is None:
+                results[i] = {"ok": False, "reason": "invalid"}
+                continue
+            validated_now = want_validate and doc.get("validated_at") == now
+            results[i] = self._doc_response(dict(doc), now, validated_now)
+
+        for i, r in enumerate(results):
+            r["index"] = i
+        return {"req_id": req_id, "ok": True, "batch": True, "count": len(results), "results": results}
+
+    def _resolve_scan_item(self, item: dict, now: datetime, want_validate: bool) -> tuple[str | None, dict | None]:
+        """
+        Décode un élément de scan. Retourne (ticket_id, réponse_anticipée) :
+          - réponse_anticipée = {"reason": "invalid"} si jeton falsifié,
+          - réponse construite depuis le jeton seul si sa fenêtre suffit,
+          - None s'il faut consulter la base pour ce ticket_id.
+        """
+        token = item.get("token")
+        claims = None
+        if token:
+            t0 = time.perf_counter()
+            claims = verify_qr_token(token)
+            self.scan_timings.record("token_verify", (time.perf_counter() - t0) * 1000)
+        if token and not claims:
+            return None, {"reason": "invalid"}  # jeton falsifié ou signé avec une autre clé
+        tid = claims["tid"] if claims else item.get("ticket_id")  # fallback si pas de token signé
+
+        # Option A : la réponse tient dans le jeton signé (pas d'aller-retour DB)
+        if claims and not want_validate:
+            tstate = token_window_state(claims, now)
+            if tstate:
+                return tid, self._token_response(claims, tstate, now)
+        return tid, None
+
+    @staticmethod
+    def _doc_response(ticket_doc: dict, now: datetime, validated_now: bool) -> dict:
+        """Champs de réponse construits depuis le document ticket."""
+        # Normaliser tz de expires_at si naïf
+        exp = ticket_doc.get("expires_at")
+        if exp and getattr(exp, "tzinfo", None) is None:
+            exp = exp.replace(tzinfo=timezone.utc)
+
+        # Statut effectif (lecture seule : le balayeur d'expiration écrit en base)
+        apply_effective_status(ticket_doc, now)
+        remaining = int((exp - now).total_seconds()) if exp else None
+
+        return {
+            "ok": True,
+            "reason": None,
+            "source": "db",
+            "ticket_id": str(ticket_doc["_id"]),
+            "type": ticket_doc.get("type"),
+            "status": ticket_doc.get("status") or "active",
+            "state": ticket_state.state_of(ticket_doc, now),
+            "validation_status": ticket_doc.get("validation_status"),
+            "validated_now": validated_now,
+            "validated_at": ticket_doc.get("validated_at").isoformat()
+            if ticket_doc.get("validated_at")
+            else None,
+            "expires_at": exp.isoformat().replace("+00:00", "Z") if exp else None,
+            "server_now": now.isoformat().replace("+00:00", "Z"),
+            "remaining_seconds": remaining,
+        }
+
+    @staticmethod
+    def _token_response(claims: dict, tstate: str, now: datetime) -> dict:
+        """Champs de réponse construits uniquement à partir du jeton."""
+        def iso(ts):
+            return datetime.fromtimestamp(ts, timezone.utc).isoformat().replace("+00:00", "Z") if ts else None
+
+        return {
+            "ok": True,
+            "reason": None,
+            "source": "token",
+            "ticket_id": claims["tid"],
+            "type": claims.get("typ"),
+            "status": tstate,
+            "state": tstate,
+            "validation_status": "validated" if tstate == "validated" else None,
+            "validated_now": False,
+            "validated_at": iso(claims.get("nbf")),
+            "expires_at": iso(claims.get("exp")),
+            "server_now": now.isoformat().replace("+00:00", "Z"),
+            "remaining_seconds": int(claims["exp"] - now.timestamp()),
+        }
+
+    def _revocation_check_enabled(self) -> bool:
+        return _truthy(os.getenv("QR_REVOCATION_CHECK") or self.app.config.get("QR_REVOCATION_CHECK", "0"))
+
+    def _is_revoked(self, db, tid) -> bool:
+        """Contrôle de révocation (ticket supprimé) : seule lecture DB du chemin "jeton"."""
+        if not self._revocation_check_enabled():
+            return False
+        return self._lookup_ticket(db, tid) is None
+
+    def _lookup_ticket(self, db, tid, fresh: bool = False) -> dict | None:
+        """
+        Lecture d'un ticket pour le scan : cache d'abord, puis Mongo (champs SCAN_FIELDS).
+        fresh=True : lecture Mongo directe (après un échec de transition).
+        """
+        doc = None if fresh else self.ticket_cache.get(tid)
+        if doc is not None:
+            return doc
+        t0 = time.perf_counter()
+        try:
+            doc = db.tickets.find_one({"_id": ObjectId(tid)}, SCAN_FIELDS)
+        except Exception:
+            self.ticket_cache.invalidate(tid)
+            return None
+        finally:
+            self.scan_timings.record("db_lookup", (time.perf_counter() - t0) * 1000)
+        self.ticket_cache.put(doc)
+        return doc
 
 
 # Helper pour récupérer le manager depuis n’importe où
@@ -0,0 +1,258 @@
+# app/outbox.py
+"""
+Outbox des événements MQTT publiés par l'app.
+
+Points clés :
+- publish_event ne publie plus dans la requête HTTP : l'événement est déposé
+  dans un tampon circulaire en mémoire (deque) puis publié par un thread de fond.
+- Tampon plein (ou broker absent longtemps) -> débordement dans une collection
+  Mongo "capped" (mqtt_outbox) : un redémarrage du broker ou du process ne perd
+  rien (les entrées non envoyées sont reprises) TANT QUE la collection n'est pas
+  pleine. Au-delà, Mongo écrase les plus anciennes, même non envoyées : chaque
+  entrée porte un numéro de séquence, les trous sont comptés ("overwritten") et loggés.
+- Plusieurs instances (abonnement $share) partagent la collection : chaque entrée
+  porte le nom de l'instance qui l'a écrite (owner) et chaque instance ne relit,
+  ne numérote et ne publie QUE ses propres entrées (pas de double publication, pas
+  de collision de seq, pas de faux "overwritten"). Le nom par défaut est le nom
+  d'hôte : stable d'un redémarrage du conteneur à l'autre, donc l'arriéré d'une
+  instance est repris par elle-même.
+- Ordre FIFO global conservé (donc par ticket) : dès que le débordement est actif,
+  tout nouvel événement part dans la collection jusqu'à ce que les entrées de
+  l'instance y soient toutes publiées.
+  Les inserts de débordement sont sérialisés (_spill_lock) et la sortie du mode
+  débordement se décide sous ce même verrou : aucun insert ne peut s'intercaler
+  entre "collection vide" et le retour au tampon mémoire.
+- Config (app.config ou ENV) :
+    * OUTBOX_MEMORY_SIZE    -> taille du tampon mémoire (défaut 1000)
+    * OUTBOX_SPILL_BYTES    -> taille de la collection capped (défaut 16 Mo)
+    * OUTBOX_BATCH          -> événements publiés par passage (défaut 100)
+    * OUTBOX_FLUSH_INTERVAL -> attente max entre deux passages, en s (défaut 1)
+    * OUTBOX_INSTANCE       -> nom de l'instance (défaut : nom d'hôte ; à fixer par
+                               processus si plusieurs tournent sur le même hôte)
+"""
+
+import os
+import socket
+import threading
+from collections import deque
+from datetime import datetime, timezone
+
+import paho.mqtt.client as mqtt
+from pymongo.errors import CollectionInvalid
+
+SPILL_COLLECTION = "mqtt_outbox"
+
+
+class Outbox:
+    def __init__(self, app, client_getter):
+        cfg = app.config
+        self.app = app
+        self._client_getter = client_getter       # -> mqtt.Client | None
+        self.memory_size = max(1, int(os.getenv("OUTBOX_MEMORY_SIZE") or cfg.get("OUTBOX_MEMORY_SIZE", 1000)))
+        self.batch = max(1, int(os.getenv("OUTBOX_BATCH") or cfg.get("OUTBOX_BATCH", 100)))
+        self.interval = float(os.getenv("OUTBOX_FLUSH_INTERVAL") or cfg.get("OUTBOX_FLUSH_INTERVAL", 1))
+        spill_bytes = int(os.getenv("OUTBOX_SPILL_BYTES") or cfg.get("OUTBOX_SPILL_BYTES", 16 * 1024 * 1024))
+        self.owner = os.getenv("OUTBOX_INSTANCE") or cfg.get("OUTBOX_INSTANCE") or socket.gethostname()
+        self._mine = {"owner": self.owner}
+
+        self._lock = threading.Lock()
+        self._mem: deque[tuple] = deque()
+        self._spill_lock = threading.Lock()   # sérialise les inserts de débordement (ordre = seq)
+        self._spill_inflight = 0   # enqueue décidés "débordement" dont l'insert n'est pas fini
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._stats = {"enqueued": 0, "published": 0, "spilled": 0, "dropped": 0,
+                       "overwritten": 0, "publish_errors": 0}
+
+        self.spill = self._ensure_spill(app.db, spill_bytes)
+        # Reprise : des événements non envoyés par un process précédent ?
+        self._spill_active = self._spill_pending() > 0
+        self._next_seq = self._last_seq(self._mine) + 1
+        self._last_read_seq = self._last_seq({**self._mine, "sent": True}) or None
+
+        self._thread = threading.Thread(target=self._run, name="mqtt-outbox", daemon=True)
+        self._thread.start()
+
+    # ---- collection de débordement -----------------------------------------
+
+    def _ensure_spill(self, db, size: int):
+        try:
+            db.create_collection(SPILL_COLLECTION, capped=True, size=size)
+        except CollectionInvalid:
+            pass  # existe déjà
+        except Exception as e:
+            self.app.logger.warning(f"[OUTBOX] collection {SPILL_COLLECTION} indisponible: {e}")
+            return None
+        return db[SPILL_COLLECTION]
+
+    def _last_seq(self, query: dict) -> int:
+        if self.spill is None:
+            return 0
+        try:
+            doc = self.spill.find_one(query, {"seq": 1}, sort=[("$natural", -1)])
+        except Exception:
+            return 0
+        return int((doc or {}).get("seq") or 0)
+
+    def _spill_pending(self) -> int:
+        if self.spill is None:
+            return 0
+        try:
+            return self.spill.count_documents({**self._mine, "sent": False})
+        except Exception:
+            return 0
+
+    # ---- API -------------------------------------------------------------
+
+    def enqueue(self, topic: str, payload: str, qos: int = 1, retain: bool = False):
+        """Dépose un événement (non bloquant côté requête, sauf débordement = 1 insert)."""
+        item = (topic, payload, qos, retain)
+        with self._lock:
+            self._stats["enqueued"] += 1
+            if not self._spill_active and len(self._mem) < self.memory_size:
+                self._mem.append(item)
+                item = None
+            elif self.spill is not None:
+                self._spill_active = True
+                self._spill_inflight += 1
+            else:
+                # pas de collection : on garde le plus récent, le plus ancien est perdu
+                self._mem.popleft()
+                self._mem.append(item)
+                self._stats["dropped"] += 1
+                item = None
+        if item is not None:
+            with self._spill_lock:
+                try:
+                    self.spill.insert_one({
+                        "owner": self.owner, "seq": self._next_seq,
+                        "topic": topic, "payload": payload, "qos": qos, "retain": retain,
+                        "sent": False, "at": datetime.now(timezone.utc),
+                    })
+                    self._next_seq += 1
+                    with self._lock:
+                        self._stats["spilled"] += 1
+                except Exception as e:
+                    self.app.logger.error(f"[OUTBOX] débordement impossible, événement perdu: {e}")
+                    with self._lock:
+                        self._stats["dropped"] += 1
+                finally:
+                    with self._lock:
+                        self._spill_inflight -= 1
+        self._wake.set()
+
+    def wake(self):
+        """À appeler à la (re)connexion : vide l'arriéré sans attendre."""
+        self._wake.set()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self._stats,
+                "memory_queued": len(self._mem),
+                "spill_active": self._spill_active,
+            }
+
+    # ---- thread de publication -------------------------------------------
+
+    def _connected_client(self):
+        client = self._client_getter()
+        return client if client is not None and client.is_connected() else None
+
+    def _publish(self, client, item) -> bool:
+        topic, payload, qos, retain = item
+        try:
+            info = client.publish(topic, payload, qos=qos, retain=retain)
+        except Exception:
+            return False
+        return info.rc == mqtt.MQTT_ERR_SUCCESS
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                while self.flush_once():
+                    pass
+            except Exception as e:
+                self.app.logger.error(f"[OUTBOX] flush error: {e}")
+
+    def flush_once(self) -> bool:
+        """Publie un lot (mémoire d'abord, puis débordement). Retourne True s'il reste du travail."""
+        client = self._connected_client()
+        if client is None:
+            return False
+
+        # 1) tampon mémoire (événements les plus anciens)
+        with self._lock:
+            items = [self._mem.popleft() for _ in range(min(self.batch, len(self._mem)))]
+        sent = 0
+        for i, item in enumerate(items):
+            if not self._publish(client, item):
+                # on remet le reste en tête, dans l'ordre
+                with self._lock:
+                    self._mem.extendleft(reversed(items[i:]))
+                    self._stats["publish_errors"] += 1
+                    self._stats["published"] += sent
+                return False
+            sent += 1
+        with self._lock:
+            self._stats["published"] += sent
+        if items:
+            return True
+
+        # 2) débordement Mongo (ordre naturel = ordre d'insertion)
+        with self._lock:
+            spill_active = self._spill_active
+        if not spill_active or self.spill is None:
+            return False
+        docs = list(self.spill.find({**self._mine, "sent": False}).sort("$natural", 1).limit(self.batch))
+        if not docs:
+            # Sortie du mode débordement : re-vérifiée sous _spill_lock (aucun insert en
+            # cours), puis décidée sous _lock (aucun enqueue "débordement" en attente).
+            with self._spill_lock:
+                if self.spill.find_one({**self._mine, "sent": False}, {"_id": 1}) is not None:
+                    return True
+                with self._lock:
+                    if self._spill_inflight == 0:
+                        self._spill_active = False
+                        return False
+            return True
+        self._check_overwritten(docs)
+
+        done, ok = [], True
+        for doc in docs:
+            if not self._publish(client, (doc["topic"], doc["payload"], doc.get("qos", 1), doc.get("retain", False))):
+                ok = False
+                break
+            done.append(doc["_id"])
+        if done:
+            # mise à jour de même taille (autorisée sur une collection capped)
+            self.spill.update_many({"_id": {"$in": done}}, {"$set": {"sent": True}})
+        with self._lock:
+            self._stats["published"] += len(done)
+            if not ok:
+                self._stats["publish_errors"] += 1
+        return ok
+
+    def _check_overwritten(self, docs: list[dict]):
+        """Trous dans les seq lus (de cette instance) = entrées écrasées par la collection capped avant envoi."""
+        lost = 0
+        for doc in docs:
+            seq = doc.get("seq")
+            if seq is None:
+                continue
+            if self._last_read_seq is not None and seq > self._last_read_seq + 1:
+                lost += seq - self._last_read_seq - 1
+            self._last_read_seq = seq
+        if lost:
+            with self._lock:
+                self._stats["overwritten"] += lost
+            self.app.logger.warning(
+                f"[OUTBOX] {lost} événement(s) écrasé(s) avant envoi : {SPILL_COLLECTION} pleine "
+                f"(augmenter OUTBOX_SPILL_BYTES)"
+            )
@@ -4,7 +4,9 @@
 Blueprint 'payments' : endpoints Stripe
 - /payments/config                  -> expose la clé publique (pk_*)
 - /payments/create-payment-intent   -> crée un PaymentIntent pour Elements
-- /payments/finalize                -> crée les tickets après paiement réussi
+- /payments/finalize                -> statut du paiement / tickets émis (lecture seule)
+- /payments/webhook                 -> événements Stripe signés : enregistre le paiement
+                                       et met l'émission des tickets en file (app/fulfilment.py)
 """
 
 #######------- BIBLIOTHEQUE NECESSAIRE -----------  #########
@@ -13,8 +15,8 @@ from flask_login import login_required, current_user
 import os
 import stripe as s
 from app.extensions import csrf
-from datetime import datetime
-from bson import ObjectId 
+from app.fulfilment import record_created, record_paid, record_failed, fulfil, fulfiller, PAID, FULFILLED, FAILED
+from app.stripe_gateway import stripe_gateway
 
 bp = Blueprint("payments", __name__, url_prefix="/payments")
 
@@ -29,33 +31,66 @@ PRICES = {
 # Pour exempter TOUT le blueprint des vérifications CSRF
 csrf.exempt(bp)
 
-def _setup_stripe_from_env():
-    """
-    Détermine les clés à partir de app.config puis .env (fallback).
-    Ne lève pas de KeyError et logge l'état.
-    """
-    pub = current_app.config.get("STRIPE_PUBLISHABLE_KEY") or os.getenv("STRIPE_PUBLISHABLE_KEY", "")
-    sec = current_app.config.get("STRIPE_SECRET_KEY")      or os.getenv("STRIPE_SECRET_KEY", "")
+def _webhook_secret() -> str:
+    return os.getenv("STRIPE_WEBHOOK_SECRET") or current_app.config.get("STRIPE_WEBHOOK_SECRET", "") or ""
 
-    s.api_key = sec or None
 
-    if pub.startswith("pk_"):
-        current_app.logger.info("[Stripe] Publishable OK.")
-    else:
-        current_app.logger.warning("[Stripe] Publishable manquante/invalide.")
+def _publishable_key() -> str:
+    # Clés lues une fois au démarrage (app/stripe_gateway.py)
+    gw = stripe_gateway()
+    return gw.publishable_key if gw else ""
+
+
+def _as_dict(obj) -> dict:
+    """Objet Stripe -> dict (les versions récentes du SDK ne sont plus des dict)."""
+    return obj if isinstance(obj, dict) else obj.to_dict()
 
-    if sec.startswith("sk_"):
-        current_app.logger.info(f"[Stripe] Secret présent (prefix={sec[:7]}...).")
+
+def _enqueue(pi_id: str):
+    ful = fulfiller()
+    if ful:
+        ful.submit(pi_id)
     else:
-        current_app.logger.warning("[Stripe] Secret manquante/invalide.")
+        fulfil(current_app.db, pi_id)
+
 
-    return pub, sec
+def payment_status(pi_id: str, user_id: str):
+    """
+    Statut d'un paiement pour le front, sans appel Stripe quand le webhook est configuré :
+      200 {status: "fulfilled", ticket_ids} | 202 {status: "created"|"paid"} (en cours)
+      402 {status: "failed", error}         | 404 paiement inconnu
+    Sans STRIPE_WEBHOOK_SECRET (dev) ou avec le backend factice (pas de webhook),
+    le PaymentIntent est vérifié auprès du backend puis passe par le même chemin
+    idempotent que le webhook.
+    """
+    db = current_app.db
+    query = {"pi_id": pi_id, "user_id": user_id}
+    proj = {"_id": 0, "status": 1, "ticket_ids": 1, "error": 1}
+    pay = db.payments.find_one(query, proj)
+
+    gw = stripe_gateway()
+    if (not pay or pay.get("status") not in (PAID, FULFILLED, FAILED)) and (gw.fake or not _webhook_secret()):
+        pi = gw.retrieve_payment_intent(pi_id)
+        if pi.get("status") == "succeeded" and (pi.get("metadata") or {}).get("user_id") == user_id:
+            paid = record_paid(db, pi, PRICES)
+            if paid and paid.get("status") == PAID:
+                _enqueue(pi_id)
+        pay = db.payments.find_one(query, proj)
+
+    if not pay:
+        return {"error": "Paiement inconnu"}, 404
+    status = pay.get("status")
+    if status == FULFILLED:
+        return {"ok": True, "status": status, "ticket_ids": pay.get("ticket_ids") or []}, 200
+    if status == FAILED:
+        return {"error": pay.get("error") or "Paiement refusé", "status": status}, 402
+    return {"ok": True, "status": status, "pending": True}, 202
 
 
 @bp.get("/config")
 def config():
     """Renvoyer la clé publique pour Stripe.js"""
-    pub, _ = _setup_stripe_from_env()
+    pub = _publishable_key()
     if not pub.startswith("pk_"):
         # Le front saura afficher un message propre
         return jsonify({"error": "No publishable key"}), 500
@@ -65,7 +100,7 @@ def config():
 @bp.get("/elements-test")
 def elements_test():
     # réutilise ton helper, et passe la clé publique au template
-    pub, _ = _setup_stripe_from_env()
+    pub = _publishable_key()
     return render_template("payments/elements_test.html", publishable_key=pub)
 
 
@@ -78,7 +113,6 @@ def create_payment_intent():
     Body JSON attendu: { amount_cents: int, type: 'single|day|week|month', qty: int }
     le montant est recalculé côté serveur 
     """
-    _setup_stripe_from_env()
     try:
         data = request.get_json(force=True, silent=True) or {}
         type = (data.get("type") or "single").strip()
@@ -88,17 +122,20 @@ def create_payment_intent():
         amount_cents = PRICES.get(type, PRICES["single"]) * qty
         currency = current_app.config.get("STRIPE_CURRENCY", "eur") or "eur"
 
-        intent = s.PaymentIntent.create(
+        user_id = str(getattr(current_user, "id", ""))
+        intent = stripe_gateway().create_payment_intent(
             amount=amount_cents,
             currency=currency,
             automatic_payment_methods={"enabled": True},
             metadata={
                 "type": type,
                 "qty": str(qty),
-                "user_id": str(getattr(current_user, "id", "")),
+                "user_id": user_id,
             },
         )
-        return jsonify({"client_secret": intent.client_secret})
+        # Trace locale : le webhook la complètera, /finalize la lira
+        record_created(current_app.db, intent["id"], user_id, type, qty, amount_cents, currency)
+        return jsonify({"client_secret": intent["client_secret"]})
 
     except Exception as e:
         # Quand la clé est invalide, Stripe renvoie une page HTML -> on renvoie JSON propre
@@ -113,58 +150,65 @@ def create_payment_intent():
 @login_required
 def finalize_from_client():
     """
-    Appelée par le front APRES confirmCardPayment() pour créer les tickets.
-    Body JSON: { pi_id: str, type: str, qty: int }
+    Appelée par le front APRES confirmCardPayment() : simple lecture du statut.
+    Les tickets sont émis par le webhook (file app/fulfilment.py) ; 202 = pas encore,
+    le front rappelle.
+    Body JSON: { pi_id: str }
     """
-    _setup_stripe_from_env()
-
     try:
         data = request.get_json(force=True, silent=True) or {}
         pi_id = (data.get("pi_id") or "").strip()
-        kind  = (data.get("type") or "single").strip()
-        qty   = max(1, int(data.get("qty") or 1))
-
         if not pi_id:
             return jsonify({"error": "pi_id manquant"}), 400
 
-        # On récupère le PI pour vérifier le statut et le montant payé
-        pi = s.PaymentIntent.retrieve(pi_id)
-        if pi.status != "succeeded":
-            return jsonify({"error": "Paiement non confirmé"}), 400
-
-        expected = PRICES.get(kind, PRICES["single"]) * qty
-        amount_received = int(pi.get("amount_received") or 0)
-        if amount_received < expected:
-            return jsonify({"error": "Montant incohérent"}), 400
-
-        # -- Création des tickets en DB --
-        created_ids = []
-        uid = getattr(current_user, "id", None)
-        for _ in range(qty):
-            doc = {
-                "user_id": ObjectId(uid) if uid and ObjectId.is_valid(uid) else uid,
-                "type": kind,
-                "status": "paid",            # adapte au vocabulaire de ton app
-                "source": "stripe",
-                "pi_id": pi.id,
-                "amount_cents": expected // qty,
-                "created_at": datetime.utcnow(),
-            }
-            res = current_app.db.tickets.insert_one(doc)
-            created_ids.append(str(res.inserted_id))
-
-        return jsonify({"ok": True, "ticket_ids": created_ids})
+        body, status = payment_status(pi_id, str(getattr(current_user, "id", "")))
+        return jsonify(body), status
 
     except Exception as e:
         msg = str(e)
         current_app.logger.error(f"[Stripe] finalize failed: {msg}")
         return jsonify({"error": msg}), 400
 
+
+@bp.post("/webhook")
+def webhook():
+    """
+    Événements Stripe (signature vérifiée avec STRIPE_WEBHOOK_SECRET).
+    Répond vite : l'émission des tickets part en file (app/fulfilment.py).
+    """
+    secret = _webhook_secret()
+    if not secret:
+        return jsonify({"error": "Webhook non configuré"}), 503
+    try:
+        event = s.Webhook.construct_event(
+            request.get_data(), request.headers.get("Stripe-Signature", ""), secret
+        )
+    except ValueError:
+        return jsonify({"error": "Payload invalide"}), 400
+    except s.SignatureVerificationError:
+        current_app.logger.warning("[Stripe] webhook: signature invalide")
+        return jsonify({"error": "Signature invalide"}), 400
+
+    kind = event["type"]
+    if kind in ("payment_intent.succeeded", "payment_intent.payment_failed"):
+        pi = _as_dict(event["data"]["object"])
+        if kind == "payment_intent.succeeded":
+            pay = record_paid(current_app.db, pi, PRICES)
+            if pay is None:
+                current_app.logger.info(f"[Stripe] {pi['id']}: paiement inconnu ou déjà honoré, ignoré")
+            elif pay.get("status") == PAID:
+                _enqueue(pi["id"])
+            elif pay.get("status") == FAILED:
+                current_app.logger.warning(f"[Stripe] {pi['id']}: {pay.get('error')}")
+        else:
+            record_failed(current_app.db, pi)
+
+    return jsonify({"received": True}), 200
+
 @bp.post("/create-checkout-session")
 @csrf.exempt
 def create_checkout_session():
     """Démarre une session Stripe Checkout (redirigée Stripe)"""
-    _setup_stripe_from_env()
     try:
         data = request.get_json(force=True, silent=True) or {}
         amount_cents = max(50, int(data.get("amount_cents") or 100))
@@ -175,7 +219,7 @@ def create_checkout_session():
         success_url = f"{base}{url_for('tickets.liste')}"
         cancel_url  = f"{base}{url_for('tickets.buy')}"
 
-        session = s.checkout.Session.create(
+        session = stripe_gateway().create_checkout_session(
             mode="payment",
             success_url=success_url,
             cancel_url=cancel_url,
@@ -190,7 +234,7 @@ def create_checkout_session():
             allow_promotion_codes=True,
             ui_mode="hosted",
         )
-        return jsonify({"url": session.url})
+        return jsonify({"url": session["url"]})
     except Exception as e:
         msg = str(e)
         current_app.logger.error(f"[Stripe] checkout create failed: {msg}")
@@ -0,0 +1,186 @@
+# app/qrcodes.py
+"""
+Rendu des QR codes des tickets (à la demande, avec cache borné).
+
+Points clés :
+- Aucun PNG n'est écrit à l'achat : l'image est générée la PREMIÈRE fois
+  qu'elle est demandée (GET /tickets/<id>/qrcode.png).
+- Cache adressé par contenu : clé = sha256 du texte encodé dans le QR.
+    * niveau 1 : mémoire (LRU borné en octets)
+    * niveau 2 : disque  (LRU borné en octets, répertoire dédié hors /static)
+- La clé sert aussi d'ETag fort côté HTTP (réponses 304 pour les navigateurs/scanners).
+- Config (app.config ou ENV) :
+    * QR_CACHE_MEM_BYTES  -> défaut 8 Mo
+    * QR_CACHE_DISK_BYTES -> défaut 64 Mo
+    * QR_CACHE_DIR        -> défaut <instance_path>/qrcache
+"""
+
+import os
+import json
+import hashlib
+import threading
+from io import BytesIO
+from collections import OrderedDict
+
+import qrcode
+from flask import current_app
+
+
+def qr_text(payload) -> str:
+    """Sérialisation compacte (et stable) du contenu d'un QR."""
+    if isinstance(payload, str):
+        return payload
+    return json.dumps(payload, separators=(",", ":"), sort_keys=True)
+
+
+def qr_key(text: str) -> str:
+    """Clé de cache (et ETag) : empreinte sha256 du contenu."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def render_png(text: str) -> bytes:
+    """Encode 'text' en QR et retourne les octets PNG."""
+    img = qrcode.make(text)
+    buf = BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+class QrCache:
+    """
+    Cache LRU à deux niveaux (mémoire puis disque), borné en octets.
+    Thread-safe : un seul verrou, les rendus se font hors verrou.
+    """
+
+    def __init__(self, disk_dir: str | None, mem_bytes: int, disk_bytes: int):
+        self.mem_bytes = max(0, int(mem_bytes))
+        self.disk_bytes = max(0, int(disk_bytes))
+        self.disk_dir = disk_dir if disk_dir and self.disk_bytes > 0 else None
+        self._lock = threading.Lock()
+        self._mem: OrderedDict[str, bytes] = OrderedDict()
+        self._mem_used = 0
+        self._disk: OrderedDict[str, int] = OrderedDict()  # clé -> taille du fichier
+        self._disk_used = 0
+        self.hits_mem = 0
+        self.hits_disk = 0
+        self.misses = 0
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._load_disk_index()
+
+    # ---- niveau disque ---------------------------------------------------
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.png")
+
+    def _load_disk_index(self):
+        """Reconstruit l'index disque au démarrage (du plus ancien au plus récent)."""
+        entries = []
+        for name in os.listdir(self.disk_dir):
+            if not name.endswith(".png"):
+                continue
+            try:
+                st = os.stat(os.path.join(self.disk_dir, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, name[:-4], st.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_used += size
+        self._evict_disk()
+
+    def _evict_disk(self):
+        while self._disk and self._disk_used > self.disk_bytes:
+            key, size = self._disk.popitem(last=False)
+            self._disk_used -= size
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def _disk_get(self, key: str) -> bytes | None:
+        if not self.disk_dir or key not in self._disk:
+            return None
+        try:
+            with open(self._path(key), "rb") as f:
+                data = f.read()
+        except OSError:
+            self._disk_used -= self._disk.pop(key, 0)
+            return None
+        self._disk.move_to_end(key)
+        return data
+
+    def _disk_put(self, key: str, data: bytes):
+        if not self.disk_dir or len(data) > self.disk_bytes or key in self._disk:
+            return
+        tmp = self._path(key) + ".tmp"
+        try:
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, self._path(key))  # écriture atomique
+        except OSError:
+            return
+        self._disk[key] = len(data)
+        self._disk_used += len(data)
+        self._evict_disk()
+
+    # ---- niveau mémoire --------------------------------------------------
+
+    def _mem_put(self, key: str, data: bytes):
+        if len(data) > self.mem_bytes:
+            return
+        old = self._mem.pop(key, None)
+        if old is not None:
+            self._mem_used -= len(old)
+        self._mem[key] = data
+        self._mem_used += len(data)
+        while self._mem_used > self.mem_bytes:
+            _, evicted = self._mem.popitem(last=False)
+            self._mem_used -= len(evicted)
+
+    # ---- API -------------------------------------------------------------
+
+    def get_png(self, text: str) -> tuple[str, bytes]:
+        """Retourne (clé, png) en passant par mémoire → disque → rendu."""
+        key = qr_key(text)
+        with self._lock:
+            data = self._mem.get(key)
+            if data is not None:
+                self._mem.move_to_end(key)
+                self.hits_mem += 1
+                return key, data
+            data = self._disk_get(key)
+            if data is not None:
+                self.hits_disk += 1
+                self._mem_put(key, data)
+                return key, data
+            self.misses += 1
+
+        data = render_png(text)  # rendu hors verrou
+        with self._lock:
+            self._mem_put(key, data)
+            self._disk_put(key, data)
+        return key, data
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "mem_items": len(self._mem), "mem_bytes": self._mem_used,
+                "disk_items": len(self._disk), "disk_bytes": self._disk_used,
+                "hits_mem": self.hits_mem, "hits_disk": self.hits_disk, "misses": self.misses,
+            }
+
+
+def qr_cache() -> QrCache:
+    """Cache partagé de l'application (créé à la première utilisation)."""
+    app = current_app._get_current_object()
+    cache = app.extensions.get("qr_cache")
+    if cache is None:
+        cfg = app.config
+        cache = QrCache(
+            disk_dir=cfg.get("QR_CACHE_DIR") or os.path.join(app.instance_path, "qrcache"),
+            mem_bytes=int(cfg.get("QR_CACHE_MEM_BYTES") or 8 * 1024 * 1024),
+            disk_bytes=int(cfg.get("QR_CACHE_DISK_BYTES") or 64 * 1024 * 1024),
+        )
+        app.extensions["qr_cache"] = cache
+    return cache
@@ -0,0 +1,74 @@
+# app/rate_limit.py
+"""
+Limitation de débit par borne (device_id) sur le topic de scan.
+
+Points clés :
+- Un seau à jetons par device_id : `rate` requêtes/s en régime établi,
+  `burst` requêtes d'un coup au maximum. Vérifié dans MqttManager._on_message,
+  AVANT la file de traitement et donc avant tout accès DB.
+- Compteurs par borne (accepted / rate_limited / busy / duplicates) pour repérer
+  le matériel bruyant ; servis par GET /metrics (scan.devices).
+- Nb de bornes suivies borné (LRU) : une borne inactive finit par être oubliée.
+- Config (app.config ou ENV) :
+    * MQTT_DEVICE_RATE      -> requêtes/s par borne (défaut 20, 0 = pas de limite)
+    * MQTT_DEVICE_BURST     -> rafale max par borne (défaut 40)
+    * MQTT_DEVICE_TRACK_MAX -> nb max de bornes suivies (défaut 10000)
+"""
+
+import time
+import threading
+from collections import OrderedDict
+
+
+class DeviceRateLimiter:
+    def __init__(self, rate: float = 20.0, burst: float = 40.0, max_devices: int = 10000):
+        self.rate = max(0.0, float(rate))
+        self.burst = max(1.0, float(burst))
+        self.max_devices = max(1, int(max_devices))
+        self._lock = threading.Lock()
+        # device_id -> [jetons, dernière recharge (monotonic), {compteurs}]
+        self._devices: OrderedDict[str, list] = OrderedDict()
+
+    def _entry(self, device_id: str, now: float) -> list:
+        entry = self._devices.get(device_id)
+        if entry is None:
+            entry = [self.burst, now, {}]
+            self._devices[device_id] = entry
+            while len(self._devices) > self.max_devices:
+                self._devices.popitem(last=False)
+        else:
+            self._devices.move_to_end(device_id)
+        return entry
+
+    def allow(self, device_id: str) -> bool:
+        """Consomme un jeton ; False si la borne dépasse son débit (compté "rate_limited")."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entry(device_id, now)
+            if self.rate > 0:
+                entry[0] = min(self.burst, entry[0] + (now - entry[1]) * self.rate)
+                entry[1] = now
+                if entry[0] < 1.0:
+                    entry[2]["rate_limited"] = entry[2].get("rate_limited", 0) + 1
+                    return False
+                entry[0] -= 1.0
+            return True
+
+    def count(self, device_id: str, outcome: str):
+        with self._lock:
+            counters = self._entry(device_id, time.monotonic())[2]
+            counters[outcome] = counters.get(outcome, 0) + 1
+
+    def stats(self, top: int = 20) -> dict:
+        """Réglages + bornes les plus bruyantes (triées par requêtes rejetées puis totales)."""
+        with self._lock:
+            rows = [{"device_id": dev, **counters} for dev, (_, _, counters) in self._devices.items()]
+        rejected = lambda r: r.get("rate_limited", 0) + r.get("busy", 0)
+        total = lambda r: sum(v for k, v in r.items() if k != "device_id")
+        rows.sort(key=lambda r: (rejected(r), total(r)), reverse=True)
+        return {
+            "rate_per_s": self.rate,
+            "burst": self.burst,
+            "tracked": len(rows),
+            "top": rows[:top],
+        }
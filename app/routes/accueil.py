@@ -1,5 +1,9 @@
 # app/routes/accueil.py
-from flask import Blueprint, render_template
+import hmac
+import os
+from functools import wraps
+
+from flask import Blueprint, render_template, current_app, request
 #from app import csrf
 
 bp = Blueprint("accueil", __name__)
@@ -14,4 +18,52 @@ def healthz():
     # Pour Docker/K8s: simple check
     return {"status": "ok"}, 200
 
+def metrics_auth(view):
+    """
+    /metrics* exposent des identifiants de bornes et des compteurs internes :
+    réservés aux porteurs de METRICS_TOKEN (en-tête "Authorization: Bearer <jeton>").
+    Sans METRICS_TOKEN configuré, les routes n'existent pas (404).
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        token = os.getenv("METRICS_TOKEN") or current_app.config.get("METRICS_TOKEN", "")
+        if not token:
+            return {"error": "not found"}, 404
+        given = request.headers.get("Authorization", "").removeprefix("Bearer ").strip()
+        if not hmac.compare_digest(given.encode(), token.encode()):
+            return {"error": "unauthorized"}, 401
+        return view(*args, **kwargs)
+    return wrapper
+
+@bp.get("/metrics")
+@metrics_auth
+def metrics():
+    # Compteurs internes (JSON) : débit du balayeur d'expiration, pipeline de scan MQTT, etc.
+    out = {}
+    sweeper = current_app.extensions.get("expiry_sweeper")
+    if sweeper:
+        out["expiry"] = sweeper.stats()
+    mm = current_app.extensions.get("mqtt")
+    if mm:
+        out["scan"] = mm.scan_stats()
+        if mm.outbox:
+            out["outbox"] = mm.outbox.stats()
+    idx = current_app.extensions.get("stop_index")
+    if idx:
+        out["stop_index"] = idx.stats()
+    gw = current_app.extensions.get("stripe")
+    if gw:
+        out["stripe"] = gw.stats()
+    ful = current_app.extensions.get("fulfiller")
+    if ful:
+        out["fulfilment"] = ful.stats()
+    return out, 200
 
+@bp.get("/metrics/scan")
+@metrics_auth
+def metrics_scan():
+    # Histogrammes glissants du pipeline de scan (même contenu que le topic MQTT retenu)
+    mm = current_app.extensions.get("mqtt")
+    if not mm:
+        return {}, 200
+    return mm.metrics_summary(), 200
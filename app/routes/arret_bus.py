@@ -18,11 +18,16 @@ from flask_login import login_required
 from bson.objectid import ObjectId
 from pymongo.errors import OperationFailure 
 
+from app.stop_index import stop_index, stop_row, mark_stops_changed, stops_version
+from app.stop_tiles import tile_bounds, valid_tile, within_mongo, build_tile
+from app.cities import city_key, rebuild_city_catalogue, catalogue_ready
+
 bp = Blueprint("arret_bus", __name__, url_prefix="/stops")
 
 
 # ----------------------------------------------------------------------------- 
-# LISTE + RECHERCHE (plein-texte si index dispo, sinon regex)
+# LISTE + RECHERCHE (plein-texte si index dispo, sinon index de recherche
+# en mémoire, sinon regex)
 # GET /stops/?q=... 
 # -----------------------------------------------------------------------------
 @bp.route("/", methods=["GET"])
@@ -52,8 +57,17 @@ def index():
             # Si l'index texte n'existe pas encore (ou autre souci), on tombera en regex
             rows = []
 
+        # fallback : index en mémoire (accents, préfixes, fautes de frappe), sans scan Mongo
+        idx = stop_index()
+        if not rows and idx and idx.is_fresh(db):
+            hits = idx.search(q, limit=SEARCH_MAX_RESULTS)
+            if hits:
+                by_id = {str(d["_id"]): d for d in db.stops.find(
+                    {"_id": {"$in": [ObjectId(h["id"]) for h in hits if ObjectId.is_valid(h["id"])]}}, proj
+                )}
+                rows = [by_id[h["id"]] for h in hits if h["id"] in by_id]
         # fallback regex (moins performant mais fonctionne partout)
-        if not rows:
+        elif not rows:
             # On découpe "gare centre" => tokens ["gare","centre"]
             # et on fabrique une regex tolérante "gare.*centre" (ordre conservé)
             tokens = [re.escape(t) for t in q.split() if t]
@@ -77,6 +91,42 @@ def index():
     return render_template("arret_bus/index.html", stops=rows, q=q)
 
 
+# ---------------------------------------------------------------------------
+# AUTOCOMPLÉTION (JSON), appelée à chaque frappe par arret_bus.js
+# GET /stops/autocomplete?q=hot&limit=10
+# ---------------------------------------------------------------------------
+SEARCH_MAX_RESULTS = 200
+AUTOCOMPLETE_MAX_RESULTS = 50
+
+
+@bp.route("/autocomplete", methods=["GET"])
+@login_required
+def autocomplete():
+    q = (request.args.get("q") or "").strip()
+    try:
+        limit = max(1, min(int(request.args.get("limit", "10")), AUTOCOMPLETE_MAX_RESULTS))
+    except ValueError:
+        return jsonify({"error": "Paramètre limit invalide"}), 400
+    if not q:
+        return jsonify({"items": []})
+
+    db = current_app.db
+    idx = stop_index()
+    if idx and idx.is_fresh(db):
+        items = idx.search(q, limit)
+    else:
+        # index pas encore (re)chargé : préfixe ancré sur le nom, borné par limit
+        if idx:
+            idx.count_fallback()
+        rows = db.stops.find(
+            {"name": {"$regex": "^" + re.escape(q), "$options": "i"}},
+            {"name": 1, "code": 1, "city": 1},
+        ).limit(limit)
+        items = [{"id": str(x["_id"]), "name": x.get("name"), "code": x.get("code"),
+                  "city": x.get("city"), "score": None} for x in rows]
+    return jsonify({"items": items})
+
+
 # ----------------------------------------------------------------------------- 
 # DÉTAIL d'un arrêt
 # GET /stops/<stop_id>
@@ -121,8 +171,36 @@ def detail(stop_id):
 
 # ---------------------------------------------------------------------------
 # PROCHES DE MOI (JSON)
-# /stops/near?lat=..&lng=..&r=1000
+# /stops/near?lat=..&lng=..&r=1000&k=20
+#   r : rayon en mètres (0 = pas de rayon, k plus proches uniquement)
+#   k : nb max de résultats (défaut 20, max 100)
+# Index spatial en mémoire (app/stop_index.py) ; Mongo si l'instantané est périmé.
 # ---------------------------------------------------------------------------
+NEAR_MAX_RESULTS = 100
+
+
+def near_mongo(db, lat: float, lng: float, radius_m: float | None, limit: int) -> list[dict]:
+    """Même réponse que l'index en mémoire, via $geoNear (index stops_geo)."""
+    geo = {
+        "near": {"type": "Point", "coordinates": [lng, lat]},
+        "distanceField": "distance_m",
+        "key": "location",
+        "spherical": True,
+    }
+    if radius_m is not None:
+        geo["maxDistance"] = radius_m
+    rows = db.stops.aggregate([
+        {"$geoNear": geo},
+        {"$limit": limit},
+        {"$project": {"name": 1, "code": 1, "zone": 1, "location": 1, "distance_m": 1}},
+    ])
+    out = []
+    for x in rows:
+        coords = (x.get("location") or {}).get("coordinates") or [None, None]
+        out.append({**stop_row(x, coords[1], coords[0]), "distance_m": round(x["distance_m"], 1)})
+    return out
+
+
 @bp.route("/near", methods=["GET"])
 @login_required
 def near():
@@ -131,29 +209,52 @@ def near():
         lat = float(request.args.get("lat", ""))
         lng = float(request.args.get("lng", ""))
         r = int(request.args.get("r", "1000"))
+        k = int(request.args.get("k", "20"))
     except Exception:
-        return jsonify({"error": "Paramètres lat/lng/r invalides"}), 400
-
-    q = {
-        "location": {
-            "$near": {
-                "$geometry": {"type": "Point", "coordinates": [lng, lat]},
-                "$maxDistance": r
-            }
-        }
-    }
-    rows = list(db.stops.find(q).limit(20))
-    data = [{
-        "id": str(x["_id"]),
-        "name": x.get("name"),
-        "code": x.get("code"),
-        "zone": x.get("zone"),
-        "lat": (x.get("location", {}) or {}).get("coordinates", [None, None])[1],
-        "lng": (x.get("location", {}) or {}).get("coordinates", [None, None])[0],
-    } for x in rows]
+        return jsonify({"error": "Paramètres lat/lng/r/k invalides"}), 400
+    radius = r if r > 0 else None
+    k = max(1, min(k, NEAR_MAX_RESULTS))
+
+    idx = stop_index()
+    if idx and idx.is_fresh(db):
+        data = idx.near(lat, lng, radius, k)
+    else:
+        if idx:
+            idx.count_fallback()
+        data = near_mongo(db, lat, lng, radius, k)
     return jsonify({"items": data})
 
 
+# ---------------------------------------------------------------------------
+# TUILES D'ARRÊTS (JSON) pour la carte : agrégats aux petits zooms
+# GET /stops/tiles/<z>/<x>/<y>.json   (découpage des tuiles OSM/Leaflet)
+# Cacheable : ETag = version des arrêts (db.meta), 304 si inchangée.
+# ---------------------------------------------------------------------------
+@bp.route("/tiles/<int:z>/<int:x>/<int:y>.json", methods=["GET"])
+def stops_tile(z, x, y):
+    if not valid_tile(z, x, y):
+        return jsonify({"error": "Tuile invalide"}), 404
+    db = current_app.db
+    etag = f"stops-v{stops_version(db)}"
+    max_age = int(current_app.config.get("STOPS_TILE_MAX_AGE", 300))
+
+    if etag in request.if_none_match:
+        resp = current_app.response_class(status=304)
+    else:
+        south, west, north, east = tile_bounds(z, x, y)
+        idx = stop_index()
+        if idx and idx.is_fresh(db):
+            points = idx.within(south, west, north, east)
+        else:
+            if idx:
+                idx.count_fallback()
+            points = within_mongo(db, south, west, north, east)
+        resp = jsonify(build_tile(points, z, x, y))
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = f"public, max-age={max_age}"
+    return resp
+
+
 # ---------------------------------------------------------------------------
 # PAGE CARTE (ville -> marqueurs)
 # ---------------------------------------------------------------------------
@@ -165,12 +266,34 @@ def map_by_city():
 
 
 # ---------------------------------------------------------------------------
-# API CITIES (JSON) – sans $coalesce (compat vieux Mongo)
+# API CITIES (JSON)
+# Catalogue précalculé db.cities (voir app/cities.py) ; agrégation complète
+# tant que le catalogue n'est pas marqué complet (migration pas lancée).
 # ---------------------------------------------------------------------------
+def _catalogue_ready(db) -> bool:
+    """catalogue_ready, mémorisé dans l'app une fois vrai (le marqueur n'est jamais retiré)."""
+    if current_app.extensions.get("city_catalogue_ready"):
+        return True
+    ready = catalogue_ready(db)
+    if ready:
+        current_app.extensions["city_catalogue_ready"] = True
+    return ready
+
 @bp.route("/cities", methods=["GET"])
 def cities_list():
-    """Liste des villes disponibles."""
+    """Liste des villes disponibles (+ nb d'arrêts et emprise dans "items")."""
     db = current_app.db
+    catalogue = []
+    if _catalogue_ready(db):
+        catalogue = list(db.cities.find({}, {"name": 1, "count": 1, "bbox": 1}).sort("_id", 1))
+    if catalogue:
+        return jsonify({
+            "cities": [c["name"].lower() for c in catalogue],
+            "items": [{"key": c["_id"], "name": c["name"], "count": c.get("count", 0),
+                       "bbox": c.get("bbox")} for c in catalogue],
+        })
+
+    # sans $coalesce (compat vieux Mongo)
     pipeline = [
         {"$project": {
             "city_raw": {"$ifNull": ["$city", {"$ifNull": ["$ville", "$town"]}]}
@@ -211,9 +334,19 @@ def stops_by_city():
     if not city:
         return jsonify({"items": []})
 
-    # insensible à la casse sur plusieurs champs (city/ville/town)
-    regex = {"$regex": f"^{re.escape(city)}$", "$options": "i"}
-    query = {"$or": [{"city": regex}, {"ville": regex}, {"town": regex}]}
+    key = city_key(city)
+    catalogued = None
+    if _catalogue_ready(db):
+        catalogued = db.cities.find_one({"_id": key}, {"bbox": 1})
+        if not catalogued:
+            # catalogue complet : ville inconnue = aucun arrêt, pas de balayage de stops
+            return jsonify({"items": [], "bbox": None})
+        # ville normalisée (accents/casse) : égalité sur idx_stop_city_key
+        query = {"city_key": key}
+    else:
+        # arrêts pas encore migrés : insensible à la casse sur plusieurs champs (city/ville/town)
+        regex = {"$regex": f"^{re.escape(city)}$", "$options": "i"}
+        query = {"$or": [{"city": regex}, {"ville": regex}, {"town": regex}]}
 
     # récupère seulement ce qu'il faut
     rows = db.stops.find(query, {"name":1, "code":1, "location":1, "lat":1, "lng":1})
@@ -234,7 +367,7 @@ def stops_by_city():
             "lat": float(lat) if lat is not None else None,
             "lng": float(lng) if lng is not None else None,
         })
-    return jsonify({"items": items})
+    return jsonify({"items": items, "bbox": (catalogued or {}).get("bbox")})
 
 # ---------------------------------------------------------------------------
 # SEED DEV (facultatif) – insère 3 arrêts de test si tu n’as pas de données
@@ -253,6 +386,9 @@ def seed_dev():
     ]
     # évite les doublons grossiers
     for s in sample:
+        s["city_key"] = city_key(s["city"])
         if not db.stops.find_one({"code": s["code"]}):
             db.stops.insert_one(s)
+    rebuild_city_catalogue(db, keys=[s["city_key"] for s in sample])
+    mark_stops_changed(db)
     return redirect(url_for("arret_bus.map_by_city"))
\ No newline at end of file
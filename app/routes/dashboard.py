@@ -8,6 +8,7 @@ from flask import Blueprint, render_template, current_app
 from flask_login import login_required, current_user
 from datetime import datetime, timezone
 from bson.objectid import ObjectId
+from app.expiry import apply_effective_status
 
 
 bp= Blueprint("dashboard", __name__, url_prefix="/dashboard")
@@ -19,6 +20,58 @@ def _norm_doc_dates(doc):
             doc[k] = doc[k].replace(tzinfo=timezone.utc)
     return doc
 
+# Abonnements = tickets longue durée (types normalisés + anciens libellés)
+ABON_TYPES = ["week", "month", "weekly", "monthly", "yearly"]
+
+# Champs utiles au template (évite de transférer qr_payload & co)
+ROW_FIELDS = {"type": 1, "status": 1, "validation_status": 1,
+              "purchased_at": 1, "validated_at": 1, "expires_at": 1, "expired_at": 1}
+
+def _counts_pipeline(user_id: str, now: datetime) -> list:
+    """
+    Compteurs par état, groupés côté Mongo (pas de tri, 3 champs lus par ticket).
+    "_expired" reproduit app.expiry.is_expired côté serveur (statut OU échéance passée).
+    """
+    expired = {"$or": [
+        {"$eq": ["$status", "expired"]},
+        {"$and": [
+            {"$ne": [{"$ifNull": ["$expires_at", None]}, None]},   # échéance fixée (date)
+            {"$lte": ["$expires_at", now]},
+        ]},
+    ]}
+    not_expired = {"$eq": [expired, False]}
+
+    def count_if(*conds):
+        return {"$sum": {"$cond": [{"$and": list(conds)}, 1, 0]}}
+
+    return [
+        {"$match": {"user_id": user_id}},
+        {"$project": {"_id": 0, "status": 1, "validation_status": 1, "expires_at": 1}},
+        {"$group": {
+            "_id": None,
+            "total":     {"$sum": 1},
+            "active":    count_if(not_expired, {"$eq": ["$status", "active"]},
+                                  {"$eq": [{"$ifNull": ["$validation_status", None]}, None]}),
+            "pending":   count_if(not_expired, {"$eq": ["$validation_status", "pending"]}),
+            "validated": count_if(not_expired, {"$eq": ["$status", "validated"]}),
+            "expired":   count_if(expired),
+        }},
+    ]
+
+def _active_subscriptions_query(user_id: str, now: datetime) -> dict:
+    """
+    Abonnements non expirés : chaque branche du $or est servie par l'index
+    (user_id, status, expires_at) -> seuls les tickets encore valides sont lus.
+    """
+    alive = ["active", "validated"]
+    return {
+        "$or": [
+            {"user_id": user_id, "status": {"$in": alive}, "expires_at": None},
+            {"user_id": user_id, "status": {"$in": alive}, "expires_at": {"$gt": now}},
+        ],
+        "type": {"$in": ABON_TYPES},
+    }
+
 @bp.get("/")
 @login_required
 def index():
@@ -26,65 +79,26 @@ def index():
     user_id = str(current_user.id)
     now = datetime.now(timezone.utc)
 
-    # Marque comme expirés pour la sécurité : on ne touche qu'aux tickets qui ont une expiration dépassée coté BD
-    db.tickets.update_many(
-        {
-            "user_id": user_id, 
-            "expires_at": {"$ne": None, "$lt": now}, 
-            "status": {"$ne": "expired"}
-        },
-        {"$set": {"status": "expired", "expired_at": now, "validation_status": None}}
-    )
+    # Compteurs : $group côté Mongo (rien n'est chargé en Python)
+    counts = next(db.tickets.aggregate(_counts_pipeline(user_id, now)), {})
+    # Abonnements valides : filtre statut / échéance servi par idx_ticket_user_status_exp
+    abonnements = db.tickets.find(_active_subscriptions_query(user_id, now), ROW_FIELDS)
+    # 5 derniers : parcours borné de idx_ticket_user_id (user_id, _id), sans tri en mémoire
+    derniers = (db.tickets.find({"user_id": user_id}, ROW_FIELDS)
+                .sort("_id", -1).limit(5).hint("idx_ticket_user_id"))
 
-    # Récupération brute des tickets utilisateur et normalisation timezone
-    tickets_= list(db.tickets.find({"user_id": user_id}))
-    tickets = [_norm_doc_dates(t) for t in tickets_]  # normalise tout
-
-
-    # --- NORMALISATION: on force UTC "aware" pour tous les champs datetime extraits de Mongo  afin d'eviter l'erreur TypeError cote python---
-    """def to_aware_utc(dt):
-        if isinstance(dt, datetime) and dt.tzinfo is None:
-            return dt.replace(tzinfo=timezone.utc)
-        return dt
-
-        for t in tickets:
-            for k in ("purchased_at", "validated_at", "expires_at", "expired_at"):
-                if t.get(k):
-                    t[k] = to_aware_utc(t[k])
-"""
-    # Comptages
-    n_total     = len(tickets)
-    n_active    = sum(1 for t in tickets if t.get("status") == "active" and t.get("validation_status") is None)
-    n_pending   = sum(1 for t in tickets if t.get("validation_status") == "pending")
-    n_validated = sum(1 for t in tickets if t.get("status") == "validated" and (not t.get("expires_at") or t["expires_at"] >= now))
-    n_expired   = sum(1 for t in tickets if t.get("status") == "expired")
-
-    # Abonnements actifs = types (weekly/monthly/yearly ) qui sont non expirés
-    abon_types = {"weekly", "monthly", "yearly"}
-    abonnements_actifs = []
-    for t in tickets:
-        ttype = (t.get("type") or "").lower()
-        if ttype in abon_types and t.get("status") != "expired":
-            # si expiration existe, on vérifie qu'elle n'est pas dépassée
-            if t.get("expires_at") and t["expires_at"] < now:
-                continue
-            abonnements_actifs.append(t)
-
-    # Derniers tickets achetés (5 plus récents) normalisé pour l'affichage
-    #derniers = list(db.tickets.find({"user_id": user_id}).sort("_id", -1).limit(5))
-    derniers = [
-        _norm_doc_dates(x)
-        for x in db.tickets.find({"user_id": user_id}).sort("_id", -1).limit(5)
-    ]
+    def rows(cursor):
+        # normalisation timezone + statut effectif (pas d'écriture : cf. app/expiry.py)
+        return [apply_effective_status(_norm_doc_dates(t), now) for t in cursor]
 
     return render_template(
         "dashboard/index.html",
         now=now,  # le fichier localtime.js l'affichera en heure locale 
-        n_total=n_total,
-        n_active=n_active,
-        n_pending=n_pending,
-        n_validated=n_validated,
-        n_expired=n_expired,
-        abonnements_actifs=abonnements_actifs,
-        derniers=derniers,
-    )
\ No newline at end of file
+        n_total=counts.get("total", 0),
+        n_active=counts.get("active", 0),
+        n_pending=counts.get("pending", 0),
+        n_validated=counts.get("validated", 0),
+        n_expired=counts.get("expired", 0),
+        abonnements_actifs=rows(abonnements),
+        derniers=rows(derniers),
+    )
@@ -3,16 +3,19 @@
 # Cette page est inaccessible sans être connecté: @login_required
 
 # imports
-from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app, abort, send_file, jsonify
+from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app, abort, jsonify
 from flask_login import login_required, current_user
 from bson.objectid import ObjectId
-from datetime import datetime, timedelta, timezone
-from io import BytesIO                     # <<< nécessaire pour /qrcode.png
-import os, json, qrcode 
-import stripe as s                 # Stripe pour vérifier le PaymentIntent côté serveur
+from pymongo.errors import BulkWriteError
+from datetime import datetime, timezone
 from app.extensions import csrf
 
 from app.mqtt import mqtt_manager   # MQTT
+from app.qrcodes import qr_cache, qr_key
+from app.security import qr_token_for
+from app.expiry import apply_effective_status
+from app import ticket_state
+from app.ticket_state import TicketNotFound, InvalidTransition
 
 
 bp = Blueprint("tickets", __name__, url_prefix="/tickets")
@@ -37,18 +40,10 @@ def normalize_type(raw: str) -> str:
 
 def compute_expires(ttype: str, start: datetime | None = None) -> datetime:
     """Retourne l'heure d'expiration en fonction du type de ticket."""
-    TICKET_TYPES = {
-        # (label, durée de validité)
-        "single": ("Horaires", timedelta(hours=2)),
-        "day":    ("Jour",      timedelta(days=1)),
-        "week":   ("Semaine",   timedelta(weeks=1)),
-        "month":  ("Mois",      timedelta(days=30)),
-    }
-
+    # Durées partagées avec la machine à états (app/ticket_state.py)
     ttype = normalize_type(ttype)
     start = start or datetime.now(timezone.utc)  # évite None et garantit un datetime "aware"
-    _, duration = TICKET_TYPES.get(ttype, ("Par défaut", timedelta(days=1)))
-    return start + duration
+    return start + ticket_state.DURATIONS[ttype]  # normalize_type -> toujours une clé connue
 
 def _price_cents_for_type(ttype: str) -> int:
     """Prix en centimes: il doit matcher PRICES côté front (paiements.js)."""
@@ -60,58 +55,109 @@ def _price_cents_for_type(ttype: str) -> int:
     }
     return price.get((ttype or "single").lower(), 150)
 
-def _insert_tickets(db, user_id: str, ttype: str, qty: int) -> list[str]:
+# Champs d'une ligne de liste (pas de qr_payload / qr_path)
+LIST_FIELDS = {"type": 1, "status": 1, "validation_status": 1, "purchased_at": 1, "expires_at": 1}
+
+def _page_size(raw) -> int:
+    """Taille de page demandée, bornée par la config."""
+    default = int(current_app.config.get("TICKETS_PAGE_SIZE", 20))
+    maxi = int(current_app.config.get("TICKETS_PAGE_SIZE_MAX", 100))
+    try:
+        size = int(raw) if raw else default
+    except (TypeError, ValueError):
+        size = default
+    return max(1, min(size, maxi))
+
+def _list_page(db, user_id: str, before: ObjectId | None, limit: int) -> tuple[list[dict], str | None]:
     """
-    Crée 'qty' tickets pour l'utilisateur, génère les QR et publie MQTT.
-    Retourne la liste des IDs créés.
+    Une page de tickets (du plus récent au plus ancien), pagination keyset sur _id.
+    'before' = dernier _id de la page précédente. Retourne (lignes, curseur suivant | None).
     """
+    query = {"user_id": user_id}
+    if before is not None:
+        query["_id"] = {"$lt": before}
+
+    # limit+1 : permet de savoir s'il reste une page sans count_documents
+    rows = list(db.tickets.find(query, LIST_FIELDS).sort("_id", -1).limit(limit + 1))
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = str(rows[-1]["_id"])
+
     now = datetime.now(timezone.utc)
-    qr_dir = os.path.join(current_app.static_folder, "qrcodes")
-    os.makedirs(qr_dir, exist_ok=True)
+    return [apply_effective_status(t, now) for t in rows], next_cursor
 
-    mm = mqtt_manager()  # peut être None si MQTT désactivé
-    created_ids: list[str] = []
+def _iso(dt):
+    if not dt:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.isoformat().replace("+00:00", "Z")
 
-    for _ in range(max(1, int(qty or 1))):
-        doc = {
+def _insert_tickets(db, user_id: str, ttype: str, qty: int, pi_id: str | None = None) -> list[str]:
+    """
+    Crée 'qty' tickets pour l'utilisateur, génère les QR et publie MQTT.
+    Retourne la liste des IDs créés.
+
+    Avec pi_id (paiement Stripe, cf. app/fulfilment.py) : chaque ticket porte
+    (pi_id, pi_seq), unique en base -> un second appel pour le même paiement
+    ne crée rien et renvoie les tickets déjà émis.
+
+    Émission groupée :
+      - les ObjectId sont pré-alloués → qr_path est déjà dans les docs,
+        donc UN seul insert_many (au lieu de insert_one + update_one par ticket) ;
+      - aucun PNG n'est rendu ici : /qrcode.png le génère à la demande (cache app.qrcodes) ;
+      - UN seul événement MQTT "tickets_bought" avec la liste des IDs.
+    """
+    now = datetime.now(timezone.utc)
+    now_iso = now.isoformat().replace("+00:00", "Z")
+    ttype = normalize_type(ttype)
+    qty = max(1, int(qty or 1))
+
+    docs = []
+    for seq in range(qty):
+        oid = ObjectId()
+        ticket_id = str(oid)
+        docs.append({
+            "_id": oid,
             "user_id": user_id,
-            "type": normalize_type(ttype),
+            "type": ttype,
             "status": "active",          # acheté mais pas encore "validé"
             "purchased_at": now,
             "validated_at": None,
             "validation_status": None,   # None | "pending" | "validated"
             "expires_at": None,          # fixé plus tard lors de la validation
-        }
-        res = db.tickets.insert_one(doc)
-        ticket_id = str(res.inserted_id)
-        created_ids.append(ticket_id)
+            "qr_path": url_for("tickets.qrcode_png", ticket_id=ticket_id),
+            # pas de jeton stocké : /qrcode.png le signe depuis l'état courant (qr_token_for)
+        })
+        if pi_id:
+            docs[-1].update(pi_id=pi_id, pi_seq=seq)
+
+    if not pi_id:
+        db.tickets.insert_many(docs, ordered=True)
+        created_ids = [str(d["_id"]) for d in docs]
+    else:
+        try:
+            db.tickets.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            # doublons (pi_id, pi_seq) = tickets déjà émis pour ce paiement
+            if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+                raise
+        emitted = [d["_id"] for d in db.tickets.find({"pi_id": pi_id}, {"_id": 1}).sort("pi_seq", 1)]
+        created_ids = [str(oid) for oid in emitted]
+        if not {d["_id"] for d in docs} & set(emitted):
+            return created_ids  # rien de nouveau : pas de second événement MQTT
 
-        payload = {
-            "ticket_id": ticket_id,
-            "user_id": user_id,
-            "type": doc["type"],
-            "issued_at": now.isoformat().replace("+00:00", "Z"),
-        }
-
-        img = qrcode.make(json.dumps(payload, separators=(",", ":")))
-        img_path = os.path.join(qr_dir, f"{ticket_id}.png")
-        img.save(img_path)
-
-        db.tickets.update_one(
-            {"_id": res.inserted_id},
-            {"$set": {"qr_path": f"/static/qrcodes/{ticket_id}.png", "qr_payload": payload}}
-        )
-
-        if mm:
-            try:
-                mm.publish_event(
-                    user_id=user_id,
-                    ticket_id=ticket_id,
-                    payload={"event": "ticket_bought", "type": doc["type"], "ts": now.isoformat().replace("+00:00","Z")},
-                    qos=1, retain=False
-                )
-            except Exception as e:
-                current_app.logger.warning(f"[MQTT] publish ticket_bought ignoré: {e}")
+    mm = mqtt_manager()  # peut être None si MQTT désactivé
+    if mm:
+        try:
+            mm.publish_user_event(
+                user_id=user_id,
+                payload={"event": "tickets_bought", "type": ttype, "ticket_ids": created_ids, "ts": now_iso},
+                qos=1, retain=False
+            )
+        except Exception as e:
+            current_app.logger.warning(f"[MQTT] publish tickets_bought ignoré: {e}")
 
     return created_ids
 
@@ -125,16 +171,36 @@ def _insert_tickets(db, user_id: str, ttype: str, qty: int) -> list[str]:
 def liste():
     db = current_app.db
     user_id = str(current_user.id)           #  unifie le type
-    now = datetime.now(timezone.utc)
 
-    # Ne marquer expiré QUE si une date d'expiration existe et est dépassée
-    db.tickets.update_many(
-        {"user_id": user_id, "expires_at": {"$ne": None, "$lt": now}, "status": {"$ne": "expired"}},
-        {"$set": {"status": "expired", "expired_at": now, "validation_status": None}}
-    )
+    # Curseur invalide -> on repart simplement de la première page
+    before = request.args.get("before")
+    before = ObjectId(before) if before and ObjectId.is_valid(before) else None
 
-    rows = list(db.tickets.find({"user_id": user_id}).sort("_id", -1))
-    return render_template("tickets/liste_ticket.html", tickets=rows)
+    # Lecture seule : le statut "expiré" est calculé ici, le balayeur (app/expiry.py) l'écrit en base
+    rows, next_cursor = _list_page(db, user_id, before, _page_size(request.args.get("limit")))
+    return render_template("tickets/liste_ticket.html", tickets=rows, next_cursor=next_cursor)
+
+# Variante JSON (défilement infini) : /tickets/api/list?before=<id>&limit=20
+@bp.get("/api/list")
+@login_required
+def api_liste():
+    before = request.args.get("before")
+    if before and not ObjectId.is_valid(before):
+        return jsonify({"error": "curseur invalide"}), 400
+
+    rows, next_cursor = _list_page(
+        current_app.db, str(current_user.id),
+        ObjectId(before) if before else None, _page_size(request.args.get("limit")),
+    )
+    items = [{
+        "id": str(t["_id"]),
+        "type": t.get("type"),
+        "status": t.get("status"),
+        "validation_status": t.get("validation_status"),
+        "purchased_at": _iso(t.get("purchased_at")),
+        "expires_at": _iso(t.get("expires_at")),
+    } for t in rows]
+    return jsonify({"items": items, "next_cursor": next_cursor})
 
 # -------------------- DÉTAIL du ticket --------------------
 @bp.get("/<ticket_id>")
@@ -151,20 +217,8 @@ def affichage(ticket_id):
             t[k] = t[k].replace(tzinfo=timezone.utc)
 
     now = datetime.now(timezone.utc)
-    ## marque expiré si l'échéance est passée, peu importe l'ancien statut
-    if t.get("expires_at") and t["expires_at"] <= now and t.get("status") != "expired":
-        db.tickets.update_one(
-            {"_id": t["_id"]},
-            {"$set": {
-                "status": "expired", 
-                "expired_at": now, 
-                "validation_status": None
-                }
-            }
-        )
-        t["status"] = "expired"
-        t["expired_at"] = now
-        t["validation_status"] = None
+    ## expiré si l'échéance est passée, peu importe l'ancien statut (sans écriture en base)
+    apply_effective_status(t, now)
 
     # On passe l'heure serveur au template pour éviter les décalages client
     return render_template("tickets/affichage.html", t=t, server_now=now)
@@ -198,44 +252,23 @@ def buy_post():
 def api_after_payment():
     """
     Appelé par le front après confirmCardPayment OK.
-    Vérifie le PaymentIntent auprès de Stripe, contrôle le montant, crée les tickets.
-    JSON attendu: { pi_id: str, type: str, qty: int }
+    Lecture du statut du paiement : les tickets sont émis une seule fois, par le
+    webhook Stripe (app/fulfilment.py). 200 + ticket_ids, ou 202 tant que ce n'est pas fait.
+    JSON attendu: { pi_id: str }
     """
+    from app.paiements import payment_status  # import tardif (blueprint voisin)
+
     data = request.get_json(force=True, silent=True) or {}
     pi_id = (data.get("pi_id") or "").strip()
-    ttype = normalize_type(data.get("type"))
-    try:
-        qty = max(1, int(data.get("qty") or 1))
-    except Exception:
-        return jsonify({"error": "qty invalide"}), 400
-
     if not pi_id.startswith("pi_"):
         return jsonify({"error": "pi_id manquant ou invalide"}), 400
 
-    # Init Stripe
-    s.api_key = current_app.config.get("STRIPE_SECRET_KEY")
-    if not s.api_key:
-        return jsonify({"error": "Clé Stripe serveur absente"}), 500
-
-    # Vérifie le PaymentIntent auprès de Stripe
     try:
-        pi = s.PaymentIntent.retrieve(pi_id)
+        body, status = payment_status(pi_id, str(current_user.id))
     except Exception as e:
-        current_app.logger.error(f"[Stripe] retrieve PI failed: {e}")
+        current_app.logger.error(f"[Stripe] statut PI {pi_id} indisponible: {e}")
         return jsonify({"error": "Impossible de retrouver le paiement Stripe"}), 400
-
-    if getattr(pi, "status", None) != "succeeded":
-        return jsonify({"error": "Le paiement n'est pas confirmé côté Stripe"}), 400
-
-    # Vérifie le montant attendu
-    prix = {"single": 150, "day": 500, "week": 1500, "month": 4500}.get(ttype, 150)
-    expected = prix * qty
-    if int(getattr(pi, "amount", 0) or 0) != expected or (pi.currency or "").lower() != "eur":
-        return jsonify({"error": "Montant inattendu"}), 400
-
-    # Crée les tickets
-    ids = _insert_tickets(current_app.db, str(current_user.id), ttype, qty)
-    return jsonify({"ok": True, "ticket_ids": ids}), 201
+    return jsonify(body), (201 if status == 200 else status)
 
 
 # -------------------- QR dynamique --------------------
@@ -248,51 +281,49 @@ def qrcode_png(ticket_id):
     except Exception:
         abort(404)
 
-    t = db.tickets.find_one({"_id": oid, "user_id": str(current_user.id)})
+    t = db.tickets.find_one(
+        {"_id": oid, "user_id": str(current_user.id)},
+        {"type": 1, "purchased_at": 1, "validated_at": 1, "expires_at": 1},
+    )
     if not t:
         abort(404)
 
-    img = qrcode.make(str(t["_id"]))         # payload minimal
-    buf = BytesIO()
-    img.save(buf, format="PNG")
-    buf.seek(0)
-    return send_file(buf, mimetype="image/png")
+    # Contenu du QR : jeton signé reflétant l'état courant (fenêtre de validité une fois validé).
+    # Jeton déterministe -> même ETag tant que le ticket ne change pas d'état.
+    text = qr_token_for(t)
+    etag = qr_key(text)
+
+    # Déjà en cache côté client -> 304 sans rien rendre
+    if etag in request.if_none_match:
+        resp = current_app.response_class(status=304)
+    else:
+        _, png = qr_cache().get_png(text)
+        resp = current_app.response_class(png, mimetype="image/png")
+    resp.set_etag(etag)
+    # URL fixe mais contenu qui change à la validation : le navigateur revalide à
+    # chaque affichage (304 tant que l'ETag tient, nouveau QR dès que l'état change)
+    resp.headers["Cache-Control"] = "private, no-cache"
+    return resp
 
 # -------------------- VALIDATION du ticket (démarrage de la decompte du temps) --------------------
 @bp.post("/validate/<ticket_id>/start")
 @login_required
 def validate_start(ticket_id):
-    db = current_app.db
-    t = db.tickets.find_one({"_id": ObjectId(ticket_id), "user_id": str(current_user.id)})
-    if not t:
-        abort(404)
-
     now = datetime.now(timezone.utc)
 
-    # Si déjà expiré (cas où un ticket est expiré existait et a été dépassée)
-    if t.get("expires_at") and t["expires_at"] <= now:
-        db.tickets.update_one({"_id": t["_id"]}, {"$set": {"status": "expired", "validation_status": None}})
-        flash("Ticket expiré.", "warning")
-        return redirect(url_for("dashboard.index"))
-
-    # Si déjà en attente ou déjà validé, on n'empile pas.
-    if t.get("validation_status") in ("pending", "validated"):
-        flash("Validation déjà engagée." if t["validation_status"] == "pending" else "Ticket déjà validé.", "info")
-        return redirect(url_for("tickets.affichage", ticket_id=t["_id"]))
-
-
-    # Met en attente de confirmation
-    db.tickets.update_one(
-        {"_id": t["_id"]},
-        {"$set": {
-            "status": "active",
-            "validation_status": "pending",          # en attente de confirmation
-            "validated_at": None,
-            "expires_at": None,
-            "confirmation_requested_at": now         # informatif
-        }}
-    )
-    #flash("Validation en cours…", "info")
+    # active -> pending, en un seul find_one_and_update conditionnel
+    try:
+        t = ticket_state.transition(current_app.db, ticket_id, "start", user_id=str(current_user.id), now=now)
+    except TicketNotFound:
+        abort(404)
+    except InvalidTransition as e:
+        # Si déjà expiré (cas où un ticket est expiré existait et a été dépassée)
+        if e.state == ticket_state.EXPIRED:
+            flash("Ticket expiré.", "warning")
+            return redirect(url_for("dashboard.index"))
+        # Si déjà en attente ou déjà validé, on n'empile pas.
+        flash("Validation déjà engagée." if e.state == ticket_state.PENDING else "Ticket déjà validé.", "info")
+        return redirect(url_for("tickets.affichage", ticket_id=ticket_id))
 
     # Event MQTT (optionnel)
     mm = mqtt_manager()
@@ -316,30 +347,23 @@ def validate_start(ticket_id):
 @bp.post("/validate/<ticket_id>/confirm")
 @login_required
 def validate_confirm(ticket_id):
-    db = current_app.db
-    t = db.tickets.find_one({"_id": ObjectId(ticket_id), "user_id": str(current_user.id)})
-    if not t:
-        abort(404)
-
     now = datetime.now(timezone.utc)
 
-    # Si c'est déjà validé et non expiré, inutile de relancer
-    if t.get("status") == "validated" and t.get("expires_at") and t["expires_at"] > now:
-        flash("Validation déjà en cours.", "info")
-        return redirect(url_for("tickets.affichage", ticket_id=t["_id"]))
-
-    # Au moment de confirmer, on fixe l'expiration à partir de 'now'
-    expires = compute_expires(normalize_type(t.get("type")), now)
-    
-    db.tickets.update_one(
-        {"_id": t["_id"]},
-        {"$set": {
-            "status": "validated",
-            "validation_status": "validated",
-            "validated_at": now,          # maintenant
-            "expires_at": expires         # calculé depuis maintenant
-        }}
-    )
+    # pending -> validated : l'expiration est calculée côté Mongo à partir de 'now' et du type
+    try:
+        t = ticket_state.transition(current_app.db, ticket_id, "confirm", user_id=str(current_user.id), now=now)
+    except TicketNotFound:
+        abort(404)
+    except InvalidTransition as e:
+        if e.state == ticket_state.VALIDATED:
+            flash("Validation déjà en cours.", "info")
+        elif e.state == ticket_state.EXPIRED:
+            flash("Ticket expiré.", "warning")
+        else:
+            flash("Démarrez d'abord la validation.", "warning")
+        return redirect(url_for("tickets.affichage", ticket_id=ticket_id))
+
+    expires = t["expires_at"]
     flash("Ticket validé.", "success")
 
     # Evenement MQTT 
@@ -352,8 +376,8 @@ def validate_confirm(ticket_id):
                 payload={
                     "event": "ticket_validated",
                     "type": t.get("type"),
-                    "validated_at": now.isoformat().replace("+00:00","Z"),
-                    "expires_at": expires.isoformat().replace("+00:00","Z")
+                    "validated_at": _iso(now),
+                    "expires_at": _iso(expires)
                 },
                 qos=1, retain=False
             )
@@ -368,37 +392,19 @@ def validate_confirm(ticket_id):
 @bp.post("/<ticket_id>/delete")
 @login_required
 def delete(ticket_id):
-    db = current_app.db
-    try:
-        oid = ObjectId(ticket_id)
-    except Exception:
-        abort(404)
-
-    t = db.tickets.find_one({"_id": oid, "user_id": str(current_user.id)})
-    if not t:
-        abort(404)
-
     now = datetime.now(timezone.utc)
 
-    # Si une expiration existe et qu'elle est dépassée mais que le statut n'a pas été mis à jour,
-    # on le passe en 'expired' pour permettre la suppression.
-    
-    if t.get("expires_at"):
-        exp = t["expires_at"]
-        if getattr(exp, "tzinfo", None) is None:
-            exp = exp.replace(tzinfo=timezone.utc)
-        if exp <= now and t.get("status") != "expired":
-            db.tickets.update_one(
-                {"_id": oid},
-                {"$set": {"status": "expired", "expired_at": now, "validation_status": None}}
-            )
-            t["status"] = "expired"
-            
-    if t.get("status") != "expired":
+    # expired -> supprimé (find_one_and_delete conditionnel).
+    # Une échéance dépassée suffit (le balayeur n'est peut-être pas encore passé)
+    try:
+        t = ticket_state.transition(current_app.db, ticket_id, "delete", user_id=str(current_user.id), now=now)
+    except TicketNotFound:
+        abort(404)
+    except InvalidTransition:
         flash("Ce ticket n'est pas encore expiré, impossible de le supprimer.", "warning")
-        return redirect(url_for("tickets.affichage", ticket_id=t["_id"]))
+        return redirect(url_for("tickets.affichage", ticket_id=ticket_id))
 
-    # Event MQTT (avant suppression
+    # Event MQTT
     mm = mqtt_manager()
     if mm:
         try:
@@ -411,6 +417,5 @@ def delete(ticket_id):
         except Exception as e:
             current_app.logger.warning(f"[MQTT] publish ticket_deleted ignoré: {e}")
 
-    db.tickets.delete_one({"_id": oid, "user_id": str(current_user.id)})
     flash("Ticket supprimé.", "success")
     return redirect(url_for("tickets.liste"))
@@ -0,0 +1,87 @@
+# app/security.py
+"""
+Jetons QR signés (sans état) pour la vérification des scans.
+
+Points clés :
+- Le QR d'un ticket contient un jeton compact signé (itsdangerous, clé SECRET_KEY) :
+      [ticket_id, type, émis_le, valide_depuis, valide_jusqu_a]   (epoch secondes)
+- Un jeton avec fenêtre de validité (ticket validé) suffit à répondre à un scan
+  SANS base de données ; la base ne sert plus qu'au contrôle de révocation
+  (option QR_REVOCATION_CHECK) ou quand le jeton ne porte pas de fenêtre.
+- Le jeton est déterministe : mêmes champs -> même texte -> même QR en cache.
+"""
+
+from datetime import datetime, timezone
+
+from flask import current_app
+from itsdangerous import URLSafeSerializer, BadSignature
+
+QR_TOKEN_SALT = "bc-qr-v1"
+
+
+def _serializer() -> URLSafeSerializer:
+    return URLSafeSerializer(current_app.config["SECRET_KEY"], salt=QR_TOKEN_SALT)
+
+
+def _epoch(dt: datetime | None) -> int | None:
+    if dt is None:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
+
+
+def make_qr_token(
+    ticket_id: str,
+    ttype: str,
+    issued_at: datetime | None = None,
+    valid_from: datetime | None = None,
+    valid_until: datetime | None = None,
+) -> str:
+    """Signe les champs utiles au contrôle d'un ticket (format liste = QR plus petit)."""
+    return _serializer().dumps(
+        [str(ticket_id), ttype, _epoch(issued_at), _epoch(valid_from), _epoch(valid_until)]
+    )
+
+
+def qr_token_for(doc: dict) -> str:
+    """Jeton reflétant l'état courant d'un document ticket."""
+    return make_qr_token(
+        doc["_id"],
+        doc.get("type"),
+        issued_at=doc.get("purchased_at"),
+        valid_from=doc.get("validated_at"),
+        valid_until=doc.get("expires_at"),
+    )
+
+
+def verify_qr_token(token: str) -> dict | None:
+    """
+    Vérifie la signature et retourne les champs décodés :
+        {"tid", "typ", "iat", "nbf", "exp"}  (dates en epoch secondes ou None)
+    Retourne None si le jeton est invalide ou falsifié.
+    """
+    try:
+        tid, typ, iat, nbf, exp = _serializer().loads(token)
+    except (BadSignature, ValueError, TypeError):
+        return None
+    return {"tid": tid, "typ": typ, "iat": iat, "nbf": nbf, "exp": exp}
+
+
+def token_window_state(claims: dict, now: datetime) -> str | None:
+    """
+    État déductible du jeton seul :
+      - "validated" si now est dans [nbf, exp[
+      - "expired"   si now >= exp
+      - None        si le jeton ne porte pas de fenêtre (ticket pas encore validé à l'émission)
+    """
+    exp = claims.get("exp")
+    if not exp:
+        return None
+    ts = now.timestamp()
+    if ts >= exp:
+        return "expired"
+    nbf = claims.get("nbf")
+    if nbf and ts < nbf:
+        return None
+    return "validated"
@@ -4,7 +4,69 @@
 
   function ready(fn){ document.readyState==="loading" ? document.addEventListener("DOMContentLoaded", fn) : fn(); }
 
+  // --- Autocomplétion de la recherche (GET /stops/autocomplete à chaque frappe)
+  function setupAutocomplete() {
+    const input = document.getElementById("stop-search");
+    const box = document.getElementById("stop-suggest");
+    if (!input || !box) return;
+    const url = input.dataset.autocompleteUrl || "/stops/autocomplete";
+    let timer = null, ctrl = null, active = -1;
+
+    function escapeHtml(s) {
+      return String(s ?? "").replace(/[&<>"']/g, (c) => ({"&":"&amp;","<":"&lt;",">":"&gt;","\"":"&quot;","'":"&#39;"}[c]));
+    }
+    function hide() { box.classList.add("d-none"); box.innerHTML = ""; active = -1; }
+    function highlight(i) {
+      const links = box.querySelectorAll("a");
+      links.forEach((a, j) => a.classList.toggle("active", j === i));
+      active = i;
+    }
+    function render(items) {
+      if (!items.length) { hide(); return; }
+      box.innerHTML = items.map((it) => `
+        <a href="/stops/${encodeURIComponent(it.id)}" class="list-group-item list-group-item-action">
+          ${escapeHtml(it.name)}
+          <small class="text-muted ms-1"><code>${escapeHtml(it.code || "")}</code> ${escapeHtml(it.city || "")}</small>
+        </a>`).join("");
+      active = -1;
+      box.classList.remove("d-none");
+    }
+    async function fetchSuggestions(q) {
+      if (ctrl) ctrl.abort();  // on annule la frappe précédente
+      ctrl = new AbortController();
+      try {
+        const res = await fetch(`${url}?q=${encodeURIComponent(q)}&limit=8`,
+                                {headers: {"Accept": "application/json"}, signal: ctrl.signal});
+        if (!res.ok) return;
+        const data = await res.json();
+        if (input.value.trim() === q) render(data.items || []);
+      } catch (e) {
+        if (e.name !== "AbortError") console.error(e);
+      }
+    }
+
+    input.addEventListener("input", () => {
+      const q = input.value.trim();
+      clearTimeout(timer);
+      if (!q) { hide(); return; }
+      timer = setTimeout(() => fetchSuggestions(q), 120);
+    });
+    input.addEventListener("keydown", (e) => {
+      const links = box.querySelectorAll("a");
+      if (!links.length) return;
+      if (e.key === "ArrowDown") { e.preventDefault(); highlight((active + 1) % links.length); }
+      else if (e.key === "ArrowUp") { e.preventDefault(); highlight((active - 1 + links.length) % links.length); }
+      else if (e.key === "Enter" && active >= 0) { e.preventDefault(); window.location = links[active].href; }
+      else if (e.key === "Escape") { hide(); }
+    });
+    document.addEventListener("click", (e) => {
+      if (!box.contains(e.target) && e.target !== input) hide();
+    });
+  }
+
   ready(() => {
+    setupAutocomplete();
+
     const btn = document.getElementById("btn-near");
     if (!btn) return;
 
@@ -1,6 +1,7 @@
 //    app/static/js/map_stops.js
 // app/static/js/map_stops.js
-// Remplit la liste des villes, affiche les arrêts d'une ville sur Leaflet.
+// Remplit la liste des villes ; les arrêts de la zone visible sont chargés par tuiles
+// (agrégés aux petits zooms), la ville choisie sert à centrer la carte.
 
 (function () {
   const citySelect = document.getElementById("citySelect");
@@ -20,7 +21,7 @@
     markersLayer.clearLayers();
   }
   function fitIfAny(bounds) {
-    if (bounds && bounds.isValid()) map.fitBounds(bounds, { padding: [30, 30] });
+    if (bounds && bounds.isValid()) map.fitBounds(bounds, { padding: [30, 30], maxZoom: 16 });
   }
 
   // Charge la liste des villes
@@ -29,6 +30,9 @@
       const resp = await fetch("/stops/cities");
       const data = await resp.json();
       const cities = data.cities || [];
+      for (const it of data.items || []) {
+        if (it.bbox) cityBounds.set(it.name.toLowerCase(), it.bbox);
+      }
 
       // reset
       citySelect.innerHTML = '<option value="" selected disabled>— Choisir une ville —</option>';
@@ -50,63 +54,111 @@
     }
   }
 
-  // Charge les arrêts d'une ville et place les marqueurs
-  async function loadStopsForCity(city) {
-    markersLayer.clearLayers();
-    if (!city) return;
-
-    try {
-      const resp = await fetch(`/stops/by_city?city=${encodeURIComponent(city)}`);
-      const data = await resp.json();
+  // --- Tuiles d'arrêts (/stops/tiles/z/x/y.json) : agrégats aux petits zooms,
+  //     arrêts individuels aux grands zooms ; seules les tuiles visibles sont chargées.
+  const tileCache = new Map();   // "z/x/y" -> réponse JSON
+  const cityBounds = new Map();  // nom de ville (option) -> bbox [minLng, minLat, maxLng, maxLat]
+  let generation = 0;
+
+  function tileRange(bounds, z) {
+    const n = 2 ** z;
+    const clampLat = (lat) => Math.max(-85.0511, Math.min(85.0511, lat));
+    const tx = (lng) => Math.min(n - 1, Math.max(0, Math.floor((lng + 180) / 360 * n)));
+    const ty = (lat) => {
+      const r = clampLat(lat) * Math.PI / 180;
+      return Math.min(n - 1, Math.max(0, Math.floor((1 - Math.asinh(Math.tan(r)) / Math.PI) / 2 * n)));
+    };
+    return {
+      x0: tx(bounds.getWest()), x1: tx(bounds.getEast()),
+      y0: ty(bounds.getNorth()), y1: ty(bounds.getSouth()),
+    };
+  }
 
-      // Accepte un array brut ou { items: [...] }
-      const items = Array.isArray(data) ? data : (data.items || []);
+  async function fetchTile(z, x, y) {
+    const key = `${z}/${x}/${y}`;
+    if (tileCache.has(key)) return tileCache.get(key);
+    const resp = await fetch(`/stops/tiles/${key}.json`, { headers: { "Accept": "application/json" } });
+    const data = resp.ok ? await resp.json() : { items: [] };
+    tileCache.set(key, data);
+    return data;
+  }
 
-      const bounds = L.latLngBounds();
+  function clusterIcon(count) {
+    const size = count < 10 ? 30 : count < 100 ? 38 : 46;
+    return L.divIcon({
+      html: `<div class="d-flex align-items-center justify-content-center rounded-circle bg-primary text-white fw-bold"
+                  style="width:${size}px;height:${size}px;opacity:.85">${count}</div>`,
+      className: "",
+      iconSize: [size, size],
+    });
+  }
 
-      for (const s of items) {
-      // Récupère lat/lng depuis plusieurs formats possibles
-      const lat = Number(
-        s.lat ??
-        (s.location && Array.isArray(s.location.coordinates) ? s.location.coordinates[1] : undefined) ??
-        s.latitude
-      );
-      const lng = Number(
-        s.lng ??
-        (s.location && Array.isArray(s.location.coordinates) ? s.location.coordinates[0] : undefined) ??
-        s.longitude
-      );
-
-      if (!Number.isFinite(lat) || !Number.isFinite(lng)) {
-        // Aide au debug si un arrêt n'a pas de coord
-        console.warn("Arrêt ignoré (coord manquantes):", s);
-        continue;
-      }
+  function addItem(it) {
+    if (it.type === "cluster") {
+      L.marker([it.lat, it.lng], { icon: clusterIcon(it.count) })
+        .on("click", () => map.setView([it.lat, it.lng], Math.min(map.getZoom() + 2, 19)))
+        .addTo(markersLayer);
+      return;
+    }
+    L.marker([it.lat, it.lng]).bindPopup(`
+      <strong>${it.name || "Sans nom"}</strong><br/>
+      Code: ${it.code || "-"}<br/>
+      <a href="/stops/${it.id}">Détails</a>
+    `).addTo(markersLayer);
+  }
 
-      const m = L.marker([lat, lng]).bindPopup(`
-        <strong>${s.name || "Sans nom"}</strong><br/>
-        Code: ${s.code || "-"}<br/>
-        <a href="/stops/${s.id || s._id}">Détails</a>
-      `);
-      m.addTo(markersLayer);
-      bounds.extend([lat, lng]);
+  async function refreshTiles() {
+    const gen = ++generation;
+    const z = Math.max(0, Math.min(22, Math.round(map.getZoom())));
+    const { x0, x1, y0, y1 } = tileRange(map.getBounds(), z);
+    const jobs = [];
+    for (let x = x0; x <= x1; x++) {
+      for (let y = y0; y <= y1; y++) jobs.push(fetchTile(z, x, y));
     }
+    try {
+      const tiles = await Promise.all(jobs);
+      if (gen !== generation) return;  // la carte a bougé entre-temps
+      clearMarkers();
+      for (const t of tiles) (t.items || []).forEach(addItem);
+    } catch (e) {
+      console.error("refreshTiles error:", e);
+    }
+  }
 
-    if (items.length === 0) {
-      console.warn("Aucun arrêt renvoyé pour la ville:", city, data);
+  // Centre la carte sur la ville choisie (emprise du catalogue, sinon ses arrêts)
+  async function focusCity(city) {
+    if (!city) return;
+    const bbox = cityBounds.get(city);
+    if (bbox) {
+      fitIfAny(L.latLngBounds([bbox[1], bbox[0]], [bbox[3], bbox[2]]));
+      return;
+    }
+    try {
+      const resp = await fetch(`/stops/by_city?city=${encodeURIComponent(city)}`);
+      const data = await resp.json();
+      const b = data.bbox;
+      if (b) {
+        fitIfAny(L.latLngBounds([b[1], b[0]], [b[3], b[2]]));
+        return;
+      }
+      const bounds = L.latLngBounds();
+      for (const s of data.items || []) {
+        if (Number.isFinite(s.lat) && Number.isFinite(s.lng)) bounds.extend([s.lat, s.lng]);
+      }
+      if (!bounds.isValid()) console.warn("Aucun arrêt renvoyé pour la ville:", city, data);
+      fitIfAny(bounds);
+    } catch (e) {
+      console.error("focusCity error:", e);
     }
-    if (bounds.isValid()) map.fitBounds(bounds, { padding: [30, 30] });
-  } catch (e) {
-    console.error("loadStopsForCity error:", e);
   }
-}
 
   // Evennements
   citySelect.addEventListener("change", (ev) => {
-    const city = ev.target.value;
-    loadStopsForCity(city);
+    focusCity(ev.target.value);
   });
+  map.on("moveend", refreshTiles);
 
   // Go!
   loadCities();
+  refreshTiles();
 })();
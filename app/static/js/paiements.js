@@ -37,7 +37,9 @@
   // URLs injectées via data-*
   const CONFIG_URL   = root.dataset.configUrl || '/payments/config';
   const CREATE_PI_URL = root.dataset.createIntentUrl || '/payments/create-payment-intent';
-  const FINALIZE_URL   = '/tickets/api/after-payment';      // endpoint qui crée les tickets après succès du paiement
+  const FINALIZE_URL   = '/tickets/api/after-payment';      // statut du paiement / tickets émis (webhook)
+  const FINALIZE_POLLS = 20;        // tentatives tant que le paiement est "en cours" (202)
+  const FINALIZE_DELAY_MS = 1000;
   const CSRF_TOKEN    = root.dataset.csrf || ''; // utile si on veut garder CSRF (sinon, @csrf.exempt)
 
   // Widgets / états
@@ -230,16 +232,31 @@
         const headers = { 'Content-Type': 'application/json' };
         if (CSRF_TOKEN) headers['X-CSRFToken'] = CSRF_TOKEN; 
 
-        const fin = await fetch(FINALIZE_URL, {
-          method: 'POST',
-          credentials: 'same-origin',
-          headers,
-          body: JSON.stringify({ pi_id: paymentIntent.id, type, qty }),
-        });
+        // Les tickets sont émis par le webhook Stripe : 202 = pas encore, on rappelle
+        let ready = false;
+        for (let attempt = 0; attempt < FINALIZE_POLLS; attempt++) {
+          const fin = await fetch(FINALIZE_URL, {
+            method: 'POST',
+            credentials: 'same-origin',
+            headers,
+            body: JSON.stringify({ pi_id: paymentIntent.id, type, qty }),
+          });
+
+          if (fin.status !== 202) {
+            if (!fin.ok) {
+              const txt = await fin.text();
+              throw new Error(`Création des tickets échouée: ${txt}`);
+            }
+            ready = true;
+            break;
+          }
+          await new Promise(r => setTimeout(r, FINALIZE_DELAY_MS));
+        }
 
-        if (!fin.ok) {
-          const txt = await fin.text();
-          throw new Error(`Création des tickets échouée: ${txt}`);
+        if (!ready) {
+          // Paiement encaissé mais tickets pas encore émis : pas de redirection trompeuse
+          showError("Paiement reçu, vos tickets sont en cours d'émission. Ils apparaîtront dans « Mes tickets » d'ici quelques instants.");
+          return;
         }
 
         // si Succès -> on redirige
@@ -0,0 +1,315 @@
+# app/stop_index.py
+"""
+Index en mémoire des arrêts : spatial (/stops/near) et texte (/stops/autocomplete,
+cf. app/stop_search.py), construits ensemble à partir du même instantané.
+
+Points clés :
+- Grille régulière lat/lng (cellules de STOP_INDEX_CELL_DEG degrés, ~1 km par défaut) :
+    * rayon  : on ne parcourt que les cellules qui recouvrent le cercle ;
+    * k plus proches : parcours en anneaux autour de la cellule du point,
+      arrêt dès que l'anneau suivant ne peut plus rien apporter de plus proche.
+  Distances en mètres (haversine), renvoyées avec chaque arrêt.
+- Chargé en arrière-plan au démarrage, puis rechargé quand les arrêts changent :
+  les imports (app/liste_ville) incrémentent un marqueur de version dans
+  db.meta ({_id: "stops"}) via mark_stops_changed(). L'index relit ce marqueur
+  au plus toutes les STOP_INDEX_CHECK_INTERVAL secondes.
+- Instantané périmé (pas encore chargé, version dépassée, trop vieux) -> is_fresh()
+  retourne False et l'appelant interroge Mongo ($geoNear) pendant le rechargement.
+- Config (app.config ou ENV) :
+    * STOP_INDEX_ENABLED        -> "0" pour toujours passer par Mongo (défaut "1")
+    * STOP_INDEX_CELL_DEG       -> taille des cellules en degrés (défaut 0.01)
+    * STOP_INDEX_CHECK_INTERVAL -> relecture du marqueur de version, en s (défaut 30)
+    * STOP_INDEX_MAX_AGE        -> âge max de l'instantané, en s (défaut 3600, 0 = illimité)
+"""
+
+import os
+import math
+import time
+import threading
+from datetime import datetime, timezone
+
+from flask import current_app, has_app_context
+
+from app.stop_search import StopTextIndex
+
+STOPS_META_ID = "stops"
+EARTH_RADIUS_M = 6371008.8
+M_PER_DEG_LAT = math.pi * EARTH_RADIUS_M / 180
+# Au-delà de ce nombre d'anneaux on balaie tout (données très clairsemées)
+MAX_RINGS = 64
+
+
+def mark_stops_changed(db):
+    """À appeler après toute écriture sur db.stops : invalide les index en mémoire."""
+    db.meta.update_one(
+        {"_id": STOPS_META_ID},
+        {"$inc": {"version": 1}, "$set": {"updated_at": datetime.now(timezone.utc)}},
+        upsert=True,
+    )
+    # Même process (route, app context) : inutile d'attendre la prochaine vérification
+    if has_app_context():
+        idx = current_app.extensions.get("stop_index")
+        if idx:
+            idx.invalidate()
+
+
+def stops_version(db) -> int:
+    doc = db.meta.find_one({"_id": STOPS_META_ID}, {"version": 1})
+    return int((doc or {}).get("version") or 0)
+
+
+def haversine_m(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp, dl = p2 - p1, math.radians(lng2 - lng1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+def stop_row(doc: dict, lat: float, lng: float) -> dict:
+    """Champs renvoyés par /stops/near (même forme en mémoire et depuis Mongo)."""
+    return {
+        "id": str(doc["_id"]),
+        "name": doc.get("name"),
+        "code": doc.get("code"),
+        "zone": doc.get("zone"),
+        "lat": lat,
+        "lng": lng,
+    }
+
+
+class StopGrid:
+    """Instantané immuable : cellule (i, j) -> [(lat, lng, ligne JSON), ...]."""
+
+    def __init__(self, points: list[tuple[float, float, dict]], cell_deg: float):
+        self.cell = cell_deg
+        self.size = len(points)
+        self.cells: dict[tuple[int, int], list] = {}
+        for p in points:
+            self.cells.setdefault(self._key(p[0], p[1]), []).append(p)
+
+    def _key(self, lat: float, lng: float) -> tuple[int, int]:
+        return int(math.floor(lat / self.cell)), int(math.floor(lng / self.cell))
+
+    def _ring(self, ci: int, cj: int, r: int):
+        if r == 0:
+            yield ci, cj
+            return
+        for j in range(cj - r, cj + r + 1):
+            yield ci - r, j
+            yield ci + r, j
+        for i in range(ci - r + 1, ci + r):
+            yield i, cj - r
+            yield i, cj + r
+
+    def _outside_m(self, lat: float, lng: float, ci: int, cj: int, r: int) -> float:
+        """Distance minimale du point à tout ce qui est hors des anneaux 0..r (bord le plus proche)."""
+        d_lat = min(lat - (ci - r) * self.cell, (ci + r + 1) * self.cell - lat)
+        d_lng = min(lng - (cj - r) * self.cell, (cj + r + 1) * self.cell - lng)
+        # parallèle : écart de latitude ; méridien (grand cercle) : R * asin(cos(lat) * sin(dlng))
+        to_parallel = math.radians(d_lat) * EARTH_RADIUS_M
+        to_meridian = EARTH_RADIUS_M * math.asin(
+            math.cos(math.radians(lat)) * math.sin(math.radians(min(90.0, d_lng))))
+        return min(to_parallel, to_meridian)
+
+    def near(self, lat: float, lng: float, radius_m: float | None, limit: int) -> list[dict]:
+        """
+        Les `limit` arrêts les plus proches (dans `radius_m` si fourni), triés par distance.
+        Chaque ligne porte distance_m.
+        """
+        if not self.size or limit <= 0:
+            return []
+        ci, cj = self._key(lat, lng)
+
+        found: list[tuple[float, dict]] = []
+        r = 0
+        while r <= MAX_RINGS:
+            for key in self._ring(ci, cj, r):
+                for plat, plng, row in self.cells.get(key, ()):
+                    d = haversine_m(lat, lng, plat, plng)
+                    if radius_m is None or d <= radius_m:
+                        found.append((d, row))
+            # tout point des anneaux suivants est à >= outside du point
+            outside = self._outside_m(lat, lng, ci, cj, r)
+            if radius_m is not None and outside > radius_m:
+                break
+            if len(found) >= limit:
+                found.sort(key=lambda x: x[0])
+                if found[limit - 1][0] <= outside:
+                    break
+            r += 1
+        else:
+            # données clairsemées (ou hautes latitudes) : balayage complet
+            found = [(d, p[2]) for pts in self.cells.values() for p in pts
+                     for d in (haversine_m(lat, lng, p[0], p[1]),)
+                     if radius_m is None or d <= radius_m]
+
+        found.sort(key=lambda x: x[0])
+        return [{**row, "distance_m": round(d, 1)} for d, row in found[:limit]]
+
+    def within(self, south: float, west: float, north: float, east: float) -> list[tuple[float, float, dict]]:
+        """Points (lat, lng, ligne) contenus dans une emprise."""
+        i0, j0 = self._key(south, west)
+        i1, j1 = self._key(north, east)
+        if (i1 - i0 + 1) * (j1 - j0 + 1) <= len(self.cells):
+            keys = ((i, j) for i in range(i0, i1 + 1) for j in range(j0, j1 + 1))
+        else:
+            # grande emprise : moins coûteux de parcourir les cellules occupées
+            keys = (k for k in self.cells if i0 <= k[0] <= i1 and j0 <= k[1] <= j1)
+        return [p for k in keys for p in self.cells.get(k, ())
+                if south <= p[0] <= north and west <= p[1] <= east]
+
+
+class StopIndex:
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = True
+        self.cell_deg = 0.01
+        self.check_interval = 30.0
+        self.max_age = 3600.0
+        self._grid: StopGrid | None = None
+        self._text: StopTextIndex | None = None
+        self._version = -1
+        self._loaded_at = 0.0          # monotonic
+        self._checked_at = 0.0
+        self._stale = True
+        self._lock = threading.Lock()
+        self._loading = False
+        self._stats = {"loads": 0, "load_errors": 0, "last_load_ms": 0.0,
+                       "memory_queries": 0, "search_queries": 0, "fallback_queries": 0}
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Lit la config, s'enregistre dans app.extensions et lance le premier chargement."""
+        self.app = app
+        self.enabled = str(os.getenv("STOP_INDEX_ENABLED") or app.config.get("STOP_INDEX_ENABLED", "1")).lower() \
+            not in ("0", "false", "no")
+        self.cell_deg = float(os.getenv("STOP_INDEX_CELL_DEG") or app.config.get("STOP_INDEX_CELL_DEG", 0.01))
+        self.check_interval = float(os.getenv("STOP_INDEX_CHECK_INTERVAL") or app.config.get("STOP_INDEX_CHECK_INTERVAL", 30))
+        self.max_age = float(os.getenv("STOP_INDEX_MAX_AGE") or app.config.get("STOP_INDEX_MAX_AGE", 3600))
+        app.extensions["stop_index"] = self
+        if self.enabled:
+            self.refresh_async()
+
+    # ---- chargement ------------------------------------------------------
+
+    def load(self, db):
+        """Construit un nouvel instantané depuis db.stops (remplacement atomique)."""
+        t0 = time.perf_counter()
+        version = stops_version(db)  # lu AVANT les arrêts : une écriture pendant le scan re-périme
+        points, rows = [], []
+        for d in db.stops.find({}, {"name": 1, "code": 1, "city": 1, "zone": 1, "location": 1}):
+            rows.append({"id": str(d["_id"]), "name": d.get("name"), "code": d.get("code"), "city": d.get("city")})
+            coords = (d.get("location") or {}).get("coordinates") or []
+            if len(coords) != 2:
+                continue
+            lng, lat = float(coords[0]), float(coords[1])
+            points.append((lat, lng, stop_row(d, lat, lng)))
+        grid = StopGrid(points, self.cell_deg)
+        text = StopTextIndex(rows)
+        with self._lock:
+            self._grid = grid
+            self._text = text
+            self._version = version
+            self._loaded_at = self._checked_at = time.monotonic()
+            self._stale = False
+            self._stats["loads"] += 1
+            self._stats["last_load_ms"] = round((time.perf_counter() - t0) * 1000, 3)
+        return grid
+
+    def refresh_async(self):
+        """Recharge en arrière-plan (un seul chargement à la fois)."""
+        with self._lock:
+            if self._loading or not self.enabled:
+                return
+            self._loading = True
+
+        def _run():
+            try:
+                self.load(self.app.db)
+                self.app.logger.info(f"[STOPS] index spatial chargé ({self._grid.size} arrêts)")
+            except Exception as e:
+                with self._lock:
+                    self._stats["load_errors"] += 1
+                self.app.logger.warning(f"[STOPS] chargement de l'index spatial impossible: {e}")
+            finally:
+                with self._lock:
+                    self._loading = False
+
+        threading.Thread(target=_run, name="stop-index-load", daemon=True).start()
+
+    # ---- fraîcheur -------------------------------------------------------
+
+    def invalidate(self):
+        with self._lock:
+            self._stale = True
+
+    def is_fresh(self, db=None) -> bool:
+        """
+        True si l'instantané peut répondre. Sinon (et si besoin) déclenche un
+        rechargement : l'appelant passe par Mongo en attendant.
+        """
+        if not self.enabled:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            if self._grid is None:
+                return False
+            if self.max_age and now - self._loaded_at > self.max_age:
+                self._stale = True
+            check = not self._stale and now - self._checked_at >= self.check_interval
+            if check:
+                self._checked_at = now
+        if check:
+            try:
+                if stops_version(db if db is not None else self.app.db) != self._version:
+                    with self._lock:
+                        self._stale = True
+            except Exception:
+                pass  # Mongo indisponible : l'instantané reste la meilleure réponse
+        if self._stale:
+            self.refresh_async()
+            return False
+        return True
+
+    # ---- requêtes --------------------------------------------------------
+
+    def near(self, lat: float, lng: float, radius_m: float | None, limit: int) -> list[dict]:
+        with self._lock:
+            grid = self._grid
+            self._stats["memory_queries"] += 1
+        return grid.near(lat, lng, radius_m, limit) if grid else []
+
+    def within(self, south: float, west: float, north: float, east: float) -> list[tuple[float, float, dict]]:
+        with self._lock:
+            grid = self._grid
+            self._stats["memory_queries"] += 1
+        return grid.within(south, west, north, east) if grid else []
+
+    def search(self, query: str, limit: int = 10) -> list[dict]:
+        """Autocomplétion (nom / code / ville), insensible aux accents, classée."""
+        with self._lock:
+            text = self._text
+            self._stats["search_queries"] += 1
+        return text.search(query, limit) if text else []
+
+    def count_fallback(self):
+        with self._lock:
+            self._stats["fallback_queries"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self._stats,
+                "enabled": self.enabled,
+                "stops": self._grid.size if self._grid else 0,
+                "cells": len(self._grid.cells) if self._grid else 0,
+                "version": self._version,
+                "stale": self._stale,
+                "age_s": round(time.monotonic() - self._loaded_at, 1) if self._grid else None,
+            }
+
+
+# Helper pour récupérer l'index depuis n'importe où
+def stop_index() -> "StopIndex | None":
+    return current_app.extensions.get("stop_index")
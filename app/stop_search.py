@@ -0,0 +1,108 @@
+# app/stop_search.py
+"""
+Index de recherche en mémoire des arrêts (autocomplétion).
+
+Points clés :
+- Insensible à la casse et aux accents : "hotel de v" trouve "Hôtel de Ville".
+- Champs indexés : nom, code, ville (poids 3 / 3 / 1, +1 pour le premier mot du nom).
+- Deux structures :
+    * préfixes de chaque mot (jusqu'à MAX_PREFIX caractères) -> frappe en cours ;
+    * trigrammes de chaque mot -> fautes de frappe et morceaux au milieu d'un mot,
+      utilisés seulement quand un terme n'a aucun préfixe correspondant.
+- Tous les termes de la requête doivent correspondre (ET) ; classement par score
+  puis par nom le plus court.
+- Construit par StopIndex.load() (app/stop_index.py), donc rechargé avec lui
+  après chaque import.
+"""
+
+import re
+import unicodedata
+
+MAX_PREFIX = 12
+TRIGRAM_MIN_RATIO = 0.5
+FIELD_WEIGHTS = (("name", 3.0), ("code", 3.0), ("city", 1.0))
+
+_NON_ALNUM = re.compile(r"[^0-9a-z]+")
+
+
+def normalize(text: str | None) -> str:
+    """Minuscules, sans accents, ponctuation -> espaces."""
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFKD", str(text))
+    text = "".join(c for c in text if not unicodedata.combining(c)).lower()
+    return _NON_ALNUM.sub(" ", text).strip()
+
+
+def trigrams(token: str) -> set[str]:
+    padded = f"${token}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class StopTextIndex:
+    def __init__(self, rows: list[dict]):
+        """rows : lignes JSON (id, name, code, city, …) ; l'ordre sert d'identifiant interne."""
+        self.rows = rows
+        self._texts: list[str] = []                       # " nom code ville " normalisé
+        self._prefix: dict[str, dict[int, float]] = {}    # préfixe -> {doc: meilleur poids}
+        self._grams: dict[str, dict[int, float]] = {}     # trigramme -> {doc: meilleur poids}
+        for i, row in enumerate(rows):
+            words = []
+            for field, weight in FIELD_WEIGHTS:
+                tokens = normalize(row.get(field)).split()
+                words += tokens
+                for pos, tok in enumerate(tokens):
+                    w = weight + (1.0 if field == "name" and pos == 0 else 0.0)
+                    for n in range(1, min(len(tok), MAX_PREFIX) + 1):
+                        self._put(self._prefix, tok[:n], i, w)
+                    for g in trigrams(tok):
+                        self._put(self._grams, g, i, w)
+            self._texts.append(" " + " ".join(words) + " ")
+
+    @staticmethod
+    def _put(table: dict, key: str, doc: int, weight: float):
+        entry = table.setdefault(key, {})
+        if entry.get(doc, 0.0) < weight:
+            entry[doc] = weight
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def _term_scores(self, term: str) -> dict[int, float]:
+        """Score de chaque document pour un terme (préfixe d'abord, trigrammes sinon)."""
+        hits = self._prefix.get(term[:MAX_PREFIX])
+        if hits:
+            if len(term) > MAX_PREFIX:  # au-delà de la longueur indexée : on vérifie le texte
+                needle = " " + term
+                hits = {d: w for d, w in hits.items() if needle in self._texts[d]}
+            if hits:
+                # bonus quand le terme est un mot entier
+                whole = " " + term + " "
+                return {d: w + (0.5 if whole in self._texts[d] else 0.0) for d, w in hits.items()}
+
+        grams = trigrams(term)
+        counts: dict[int, list] = {}
+        for g in grams:
+            for d, w in self._grams.get(g, {}).items():
+                c = counts.setdefault(d, [0, 0.0])
+                c[0] += 1
+                c[1] = max(c[1], w)
+        need = TRIGRAM_MIN_RATIO * len(grams)
+        return {d: w * 0.5 * n / len(grams) for d, (n, w) in counts.items() if n >= need}
+
+    def search(self, query: str, limit: int = 10) -> list[dict]:
+        terms = normalize(query).split()
+        if not terms or limit <= 0:
+            return []
+        scores: dict[int, float] | None = None
+        for term in terms:
+            ts = self._term_scores(term)
+            if scores is None:
+                scores = ts
+            else:
+                scores = {d: s + ts[d] for d, s in scores.items() if d in ts}
+            if not scores:
+                return []
+        ranked = sorted(scores.items(), key=lambda x: (-x[1], len(self.rows[x[0]].get("name") or ""),
+                                                        self.rows[x[0]].get("name") or ""))
+        return [{**self.rows[d], "score": round(s, 2)} for d, s in ranked[:limit]]
@@ -0,0 +1,94 @@
+# app/stop_tiles.py
+"""
+Tuiles d'arrêts pour la carte (/stops/tiles/<z>/<x>/<y>.json).
+
+Points clés :
+- Découpage "slippy map" standard (Web Mercator, comme les tuiles OSM de Leaflet).
+- Zoom < CLUSTER_MAX_ZOOM : chaque tuile est découpée en 2^CLUSTER_BITS x 2^CLUSTER_BITS
+  cellules ; une cellule avec plusieurs arrêts devient un agrégat
+  {type: "cluster", count, lat, lng} (centre de gravité), un arrêt isolé reste un arrêt.
+- Zoom >= CLUSTER_MAX_ZOOM : arrêts individuels.
+- Les arrêts d'une tuile viennent de l'index en mémoire (StopIndex) s'il est frais,
+  sinon de Mongo ($geoWithin sur stops_geo).
+- Une tuile ne dépend que de (z, x, y) et de la version des arrêts (db.meta) :
+  réponse cacheable (ETag + Cache-Control) côté navigateur / proxy.
+"""
+
+import math
+
+from app.stop_index import stop_row
+
+CLUSTER_MAX_ZOOM = 15
+CLUSTER_BITS = 3
+MAX_ZOOM = 22
+
+
+def tile_bounds(z: int, x: int, y: int) -> tuple[float, float, float, float]:
+    """(sud, ouest, nord, est) d'une tuile, en degrés."""
+    n = 2 ** z
+
+    def lat(yy):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * yy / n))))
+
+    return lat(y + 1), x / n * 360.0 - 180.0, lat(y), (x + 1) / n * 360.0 - 180.0
+
+
+def tile_fraction(lat: float, lng: float, z: int) -> tuple[float, float]:
+    """Position (x, y) fractionnaire d'un point dans la grille de tuiles du zoom z."""
+    n = 2 ** z
+    lat = max(-85.05112878, min(85.05112878, lat))
+    xf = (lng + 180.0) / 360.0 * n
+    yf = (1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n
+    return xf, yf
+
+
+def valid_tile(z: int, x: int, y: int) -> bool:
+    return 0 <= z <= MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def within_mongo(db, south: float, west: float, north: float, east: float) -> list[tuple[float, float, dict]]:
+    """Arrêts d'une emprise via Mongo ($geoWithin), même forme que StopGrid.within."""
+    if east - west >= 180 or north - south >= 90:
+        # très grande emprise : un polygone 2dsphere n'y est plus fiable, on filtre après coup
+        query = {"location.coordinates": {"$exists": True}}
+    else:
+        # arêtes du polygone = géodésiques (pas des parallèles) : marge, puis filtre exact
+        pad = (north - south) * 0.1
+        s, n = max(-90.0, south - pad), min(90.0, north + pad)
+        ring = [[west, s], [east, s], [east, n], [west, n], [west, s]]
+        query = {"location": {"$geoWithin": {"$geometry": {"type": "Polygon", "coordinates": [ring]}}}}
+    out = []
+    for d in db.stops.find(query, {"name": 1, "code": 1, "zone": 1, "location": 1}):
+        coords = (d.get("location") or {}).get("coordinates") or []
+        if len(coords) != 2:
+            continue
+        lng, lat = float(coords[0]), float(coords[1])
+        if south <= lat <= north and west <= lng <= east:
+            out.append((lat, lng, stop_row(d, lat, lng)))
+    return out
+
+
+def build_tile(points: list[tuple[float, float, dict]], z: int, x: int, y: int) -> dict:
+    """Réponse d'une tuile : agrégats aux petits zooms, arrêts individuels sinon."""
+    clustered = z < CLUSTER_MAX_ZOOM
+    items = []
+    if not clustered:
+        items = [{"type": "stop", **row} for _, _, row in points]
+    else:
+        sub_z = z + CLUSTER_BITS
+        cells: dict[tuple[int, int], list] = {}
+        for lat, lng, row in points:
+            xf, yf = tile_fraction(lat, lng, sub_z)
+            cells.setdefault((int(xf), int(yf)), []).append((lat, lng, row))
+        for key in sorted(cells):
+            members = cells[key]
+            if len(members) == 1:
+                items.append({"type": "stop", **members[0][2]})
+                continue
+            items.append({
+                "type": "cluster",
+                "count": len(members),
+                "lat": round(sum(m[0] for m in members) / len(members), 6),
+                "lng": round(sum(m[1] for m in members) / len(members), 6),
+            })
+    return {"z": z, "x": x, "y": y, "clustered": clustered, "count": len(points), "items": items}
@@ -0,0 +1,184 @@
+# app/stripe_gateway.py
+"""
+Accès Stripe centralisé, configuré une seule fois au démarrage de l'app.
+
+Points clés :
+- StripeGateway lit les clés et réglages une seule fois (init_app),
+  puis sert toutes les requêtes avec le même client :
+    * backend "stripe" : stripe.StripeClient + session HTTP partagée (keep-alive,
+      pool de connexions), timeouts connexion / lecture et nb de réessais réseau
+      configurables ;
+    * backend "fake"   : PaymentIntents en mémoire, sans réseau, pour les tests de
+      charge du parcours d'achat (latence simulée réglable).
+- Les méthodes renvoient des dict (id, client_secret, status, amount_received,
+  metadata…), quel que soit le backend ou la version du SDK.
+- Config (app.config ou ENV) :
+    * STRIPE_BACKEND          -> "stripe" (défaut) | "fake"
+    * STRIPE_CONNECT_TIMEOUT / STRIPE_READ_TIMEOUT (s), STRIPE_MAX_RETRIES, STRIPE_HTTP_POOL
+    * STRIPE_FAKE_LATENCY_MS  -> latence ajoutée à chaque appel du faux backend
+    * STRIPE_FAKE_STATUS      -> statut des PaymentIntents créés ("succeeded" par défaut)
+"""
+
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import stripe
+from flask import current_app
+from requests import Session
+from requests.adapters import HTTPAdapter
+
+
+def _cfg(app, key, default):
+    return os.getenv(key) or app.config.get(key, default)
+
+
+class StripeBackend:
+    name = "stripe"
+
+    def __init__(self, secret: str, connect_timeout: float, read_timeout: float, retries: int, pool: int):
+        self._client = None
+        if not secret:
+            return
+        session = Session()
+        session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool)))
+        http = stripe.RequestsClient(timeout=(connect_timeout, read_timeout), session=session)
+        client = stripe.StripeClient(secret, http_client=http, max_network_retries=retries)
+        self._client = getattr(client, "v1", client)  # SDK récents : services sous client.v1
+
+    def _services(self):
+        if self._client is None:
+            raise RuntimeError("Clé Stripe serveur absente")
+        return self._client
+
+    def create_payment_intent(self, **params) -> dict:
+        return self._services().payment_intents.create(params=params).to_dict()
+
+    def retrieve_payment_intent(self, pi_id: str) -> dict:
+        return self._services().payment_intents.retrieve(pi_id).to_dict()
+
+    def create_checkout_session(self, **params) -> dict:
+        return self._services().checkout.sessions.create(params=params).to_dict()
+
+
+class FakeBackend:
+    """PaymentIntents en mémoire (bornés), même forme de réponse que Stripe."""
+    name = "fake"
+
+    def __init__(self, latency_ms: float = 0.0, status: str = "succeeded", max_items: int = 100_000):
+        self.latency = max(0.0, latency_ms) / 1000.0
+        self.status = status
+        self.max_items = max_items
+        self._intents: OrderedDict[str, dict] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def create_payment_intent(self, **params) -> dict:
+        self._wait()
+        pi_id = f"pi_fake_{uuid.uuid4().hex[:24]}"
+        amount = int(params.get("amount") or 0)
+        pi = {
+            "id": pi_id,
+            "object": "payment_intent",
+            "amount": amount,
+            "amount_received": amount if self.status == "succeeded" else 0,
+            "currency": (params.get("currency") or "eur").lower(),
+            "client_secret": f"{pi_id}_secret_{uuid.uuid4().hex[:16]}",
+            "metadata": dict(params.get("metadata") or {}),
+            "status": self.status,
+            "created": int(time.time()),
+        }
+        with self._lock:
+            self._intents[pi_id] = pi
+            while len(self._intents) > self.max_items:
+                self._intents.popitem(last=False)
+        return dict(pi)
+
+    def retrieve_payment_intent(self, pi_id: str) -> dict:
+        self._wait()
+        with self._lock:
+            pi = self._intents.get(pi_id)
+        if pi is None:
+            raise LookupError(f"No such payment_intent: '{pi_id}'")
+        return dict(pi)
+
+    def create_checkout_session(self, **params) -> dict:
+        self._wait()
+        cs_id = f"cs_fake_{uuid.uuid4().hex[:24]}"
+        return {"id": cs_id, "object": "checkout.session", "url": params.get("success_url")}
+
+
+class StripeGateway:
+    def __init__(self, app=None):
+        self.app = None
+        self.backend = None
+        self.publishable_key = ""
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "errors": 0, "total_ms": 0.0}
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Construit le backend une fois et s'enregistre dans app.extensions."""
+        self.app = app
+        self.publishable_key = app.config.get("STRIPE_PUBLISHABLE_KEY") or os.getenv("STRIPE_PUBLISHABLE_KEY", "")
+        secret = app.config.get("STRIPE_SECRET_KEY") or os.getenv("STRIPE_SECRET_KEY", "")
+        kind = str(_cfg(app, "STRIPE_BACKEND", "stripe")).strip().lower()
+
+        if kind == "fake":
+            self.backend = FakeBackend(
+                latency_ms=float(_cfg(app, "STRIPE_FAKE_LATENCY_MS", 0)),
+                status=str(_cfg(app, "STRIPE_FAKE_STATUS", "succeeded")),
+            )
+            app.logger.warning("[Stripe] backend factice (STRIPE_BACKEND=fake) : aucun paiement réel")
+        else:
+            self.backend = StripeBackend(
+                secret,
+                connect_timeout=float(_cfg(app, "STRIPE_CONNECT_TIMEOUT", 5)),
+                read_timeout=float(_cfg(app, "STRIPE_READ_TIMEOUT", 20)),
+                retries=int(_cfg(app, "STRIPE_MAX_RETRIES", 2)),
+                pool=int(_cfg(app, "STRIPE_HTTP_POOL", 10)),
+            )
+        app.extensions["stripe"] = self
+
+    @property
+    def fake(self) -> bool:
+        return self.backend is not None and self.backend.name == "fake"
+
+    def _call(self, fn, *args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        except Exception:
+            with self._lock:
+                self._stats["errors"] += 1
+            raise
+        finally:
+            with self._lock:
+                self._stats["calls"] += 1
+                self._stats["total_ms"] += (time.perf_counter() - t0) * 1000
+
+    def create_payment_intent(self, **params) -> dict:
+        return self._call(self.backend.create_payment_intent, **params)
+
+    def retrieve_payment_intent(self, pi_id: str) -> dict:
+        return self._call(self.backend.retrieve_payment_intent, pi_id)
+
+    def create_checkout_session(self, **params) -> dict:
+        return self._call(self.backend.create_checkout_session, **params)
+
+    def stats(self) -> dict:
+        with self._lock:
+            st = dict(self._stats)
+        st["mean_ms"] = round(st.pop("total_ms") / st["calls"], 2) if st["calls"] else None
+        return {**st, "backend": self.backend.name if self.backend else None}
+
+
+# Helper pour récupérer la passerelle depuis n'importe où
+def stripe_gateway() -> "StripeGateway | None":
+    return current_app.extensions.get("stripe")
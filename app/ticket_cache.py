@@ -0,0 +1,145 @@
+# app/ticket_cache.py
+"""
+Cache en mémoire des tickets "chauds" pour le chemin de scan.
+
+Points clés :
+- Un même ticket est souvent rescanné à quelques minutes d'intervalle
+  (correspondances, contrôleurs) : on garde les champs utiles au scan
+  (SCAN_FIELDS) dans un LRU à durée de vie limitée (TTL).
+- Invalidation :
+    * à chaque événement publié par l'app (MqttManager.publish_event /
+      publish_user_event : achat, validation, suppression…) ;
+    * via un change stream Mongo quand il est disponible (replica set),
+      ce qui couvre aussi les écritures des autres process.
+- Sans change stream (Mongo standalone, option désactivée, flux interrompu), les
+  écritures des autres process (autres instances, balayeur…) ne sont pas vues :
+  le TTL est alors ramené à SCAN_CACHE_TTL_NO_STREAM (0 = cache désactivé), choix
+  loggé au démarrage. Le TTL complet n'est appliqué qu'une fois le flux ouvert.
+- Config (app.config ou ENV) :
+    * SCAN_CACHE_SIZE          -> nb max d'entrées (défaut 10000, 0 = désactivé)
+    * SCAN_CACHE_TTL           -> durée de vie en secondes (défaut 120)
+    * SCAN_CACHE_TTL_NO_STREAM -> durée de vie sans change stream (défaut 5)
+    * SCAN_CACHE_CHANGE_STREAM -> "1" pour tenter le change stream (défaut "1")
+"""
+
+import time
+import threading
+from collections import OrderedDict
+
+
+# Champs nécessaires pour répondre à un scan
+SCAN_FIELDS = {
+    "user_id": 1, "type": 1, "status": 1, "validation_status": 1,
+    "validated_at": 1, "expires_at": 1, "expired_at": 1,
+}
+
+
+class TicketCache:
+    def __init__(self, max_items: int = 10000, ttl: float = 120.0, ttl_no_stream: float = 5.0):
+        self.max_items = max(0, int(max_items))
+        self.ttl = float(ttl)
+        self.full_ttl = self.ttl
+        self.ttl_no_stream = max(0.0, float(ttl_no_stream))
+        self._lock = threading.Lock()
+        self._items: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.change_stream = "off"   # off | running | unavailable
+        self._watch_thread: threading.Thread | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_items > 0
+
+    def get(self, ticket_id) -> dict | None:
+        """Copie du document en cache (None si absent ou expiré)."""
+        if not self.enabled:
+            return None
+        key = str(ticket_id)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is None or entry[0] < now:
+                if entry is not None:
+                    del self._items[key]
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return dict(entry[1])
+
+    def put(self, doc: dict):
+        if not self.enabled or not doc or "_id" not in doc:
+            return
+        slim = {k: doc.get(k) for k in SCAN_FIELDS}
+        slim["_id"] = doc["_id"]
+        with self._lock:
+            self._items[str(doc["_id"])] = (time.monotonic() + self.ttl, slim)
+            self._items.move_to_end(str(doc["_id"]))
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def invalidate(self, *ticket_ids):
+        with self._lock:
+            for tid in ticket_ids:
+                if self._items.pop(str(tid), None) is not None:
+                    self.invalidations += 1
+
+    def without_change_stream(self, logger, why: str):
+        """Pas d'invalidation inter-process : TTL court, ou cache coupé si ce TTL vaut 0."""
+        with self._lock:
+            self.ttl = min(self.full_ttl, self.ttl_no_stream)
+            if self.ttl <= 0:
+                self.max_items = 0
+            self._items.clear()
+        if not self.enabled:
+            logger.info(f"[SCAN-CACHE] pas de change stream ({why}) → cache désactivé")
+        else:
+            logger.info(f"[SCAN-CACHE] pas de change stream ({why}) → TTL ramené à {self.ttl:g}s")
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._items),
+                "max_items": self.max_items,
+                "ttl_s": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+                "miss_ratio": round(self.misses / total, 4) if total else 0.0,
+                "invalidations": self.invalidations,
+                "change_stream": self.change_stream,
+            }
+
+    # ---- change stream ---------------------------------------------------
+
+    def watch(self, db, logger):
+        """
+        Démarre (thread daemon) l'écoute des modifications de db.tickets.
+        Sur un Mongo standalone (pas de replica set) le change stream n'existe pas :
+        on le note et on passe au TTL court (without_change_stream).
+        """
+        if not self.enabled or self._watch_thread is not None:
+            return
+        self.ttl = min(self.full_ttl, self.ttl_no_stream)  # TTL complet une fois le flux ouvert
+
+        def _run():
+            try:
+                with db.tickets.watch(
+                    [{"$match": {"operationType": {"$in": ["insert", "update", "replace", "delete"]}}}]
+                ) as stream:
+                    self.change_stream = "running"
+                    self.ttl = self.full_ttl
+                    logger.info(f"[SCAN-CACHE] change stream actif sur tickets (TTL {self.ttl:g}s)")
+                    for change in stream:
+                        key = (change.get("documentKey") or {}).get("_id")
+                        if key is not None:
+                            self.invalidate(key)
+            except Exception as e:  # standalone (pas de replica set), droits, réseau…
+                self.change_stream = "unavailable"
+                self.without_change_stream(logger, f"indisponible : {e}")
+
+        self._watch_thread = threading.Thread(target=_run, name="scan-cache-watch", daemon=True)
+        self._watch_thread.start()
@@ -0,0 +1,171 @@
+# app/ticket_state.py
+"""
+Machine à états des tickets.
+
+    active ──start──▶ pending ──confirm──▶ validated ──expire──▶ expired ──delete──▶ (supprimé)
+       └────────────── validate (borne/scan) ──▶ validated
+
+Points clés :
+- Chaque transition = UN seul aller-retour Mongo (find_one_and_update /
+  find_one_and_delete conditionnel) qui renvoie le document APRÈS transition.
+- La condition porte sur l'état de départ : deux actions simultanées
+  (double-clic, scanner + navigateur) ne peuvent pas réussir toutes les deux.
+- En cas d'échec seulement, on relit le ticket pour expliquer pourquoi
+  (TicketNotFound / InvalidTransition).
+
+Correspondance avec les champs en base :
+    active    -> status="active",    validation_status=None
+    pending   -> status="active",    validation_status="pending"
+    validated -> status="validated", validation_status="validated"
+    expired   -> status="expired"    (ou expires_at dépassé, cf. app/expiry.py)
+"""
+
+from datetime import datetime, timedelta, timezone
+
+from bson.objectid import ObjectId
+from pymongo import ReturnDocument
+
+from app.expiry import is_expired
+
+ACTIVE, PENDING, VALIDATED, EXPIRED, DELETED = "active", "pending", "validated", "expired", "deleted"
+
+# Durée de validité par type (à partir de la validation)
+DURATIONS = {
+    "single": timedelta(hours=2),
+    "day":    timedelta(days=1),
+    "week":   timedelta(weeks=1),
+    "month":  timedelta(days=30),
+}
+DEFAULT_TYPE = "single"
+
+# action -> (états de départ autorisés, état d'arrivée)
+TRANSITIONS = {
+    "start":    ({ACTIVE}, PENDING),
+    "confirm":  ({PENDING}, VALIDATED),
+    "validate": ({ACTIVE, PENDING}, VALIDATED),
+    "expire":   ({ACTIVE, PENDING, VALIDATED}, EXPIRED),
+    "delete":   ({EXPIRED}, DELETED),
+}
+
+# Filtre Mongo de chaque état (hors contrôle de l'échéance, ajouté à part)
+_STATE_FILTERS = {
+    ACTIVE:    {"status": "active", "validation_status": None},
+    PENDING:   {"status": "active", "validation_status": "pending"},
+    VALIDATED: {"status": "validated"},
+}
+
+
+class TicketNotFound(Exception):
+    pass
+
+
+class InvalidTransition(Exception):
+    def __init__(self, action: str, state: str):
+        super().__init__(f"transition '{action}' impossible depuis l'état '{state}'")
+        self.action = action
+        self.state = state
+
+
+def state_of(doc: dict, now: datetime | None = None) -> str:
+    """État logique d'un document ticket (lecture seule)."""
+    if is_expired(doc, now):
+        return EXPIRED
+    if doc.get("status") == "validated":
+        return VALIDATED
+    if doc.get("validation_status") == "pending":
+        return PENDING
+    return ACTIVE
+
+
+def _source_filter(sources: set[str], now: datetime) -> dict:
+    if sources == {EXPIRED}:
+        return {"$or": [{"status": "expired"}, {"expires_at": {"$lte": now}}]}
+    alive = {"$or": [{"expires_at": None}, {"expires_at": {"$gt": now}}]}
+    states = [_STATE_FILTERS[s] for s in sorted(sources)]
+    return {"$and": [states[0] if len(states) == 1 else {"$or": states}, alive]}
+
+
+def _expires_expr(now: datetime) -> dict:
+    """Échéance calculée côté serveur selon le champ 'type' (update en pipeline)."""
+    ms = lambda d: int(d.total_seconds() * 1000)
+    return {"$add": [now, {"$switch": {
+        "branches": [{"case": {"$eq": ["$type", t]}, "then": ms(d)} for t, d in DURATIONS.items()],
+        "default": ms(DURATIONS[DEFAULT_TYPE]),
+    }}]}
+
+
+def _update_for(target: str, now: datetime):
+    if target == PENDING:
+        return {"$set": {
+            "status": "active",
+            "validation_status": "pending",          # en attente de confirmation
+            "validated_at": None,
+            "expires_at": None,
+            "confirmation_requested_at": now,        # informatif
+        }}
+    if target == VALIDATED:
+        return [{"$set": {
+            "status": "validated",
+            "validation_status": "validated",
+            "validated_at": now,
+            "expires_at": _expires_expr(now),
+        }}]
+    if target == EXPIRED:
+        return {"$set": {"status": "expired", "expired_at": now, "validation_status": None}}
+    raise ValueError(target)
+
+
+def transition(db, ticket_id, action: str, user_id: str | None = None,
+               now: datetime | None = None) -> dict:
+    """
+    Applique 'action' au ticket et retourne le document résultant
+    (pour 'delete' : le document supprimé).
+    Lève TicketNotFound ou InvalidTransition si la condition ne tient pas.
+    """
+    sources, target = TRANSITIONS[action]
+    now = now or datetime.now(timezone.utc)
+
+    try:
+        oid = ticket_id if isinstance(ticket_id, ObjectId) else ObjectId(ticket_id)
+    except Exception:
+        raise TicketNotFound(ticket_id)
+
+    owner = {"_id": oid}
+    if user_id is not None:
+        owner["user_id"] = user_id
+    query = {**owner, **_source_filter(sources, now)}
+
+    if target == DELETED:
+        doc = db.tickets.find_one_and_delete(query)
+    else:
+        doc = db.tickets.find_one_and_update(
+            query, _update_for(target, now), return_document=ReturnDocument.AFTER
+        )
+    if doc is not None:
+        return doc
+
+    # Échec : on relit pour savoir pourquoi (chemin rare)
+    current = db.tickets.find_one(owner, {"status": 1, "validation_status": 1, "expires_at": 1})
+    if current is None:
+        raise TicketNotFound(ticket_id)
+    raise InvalidTransition(action, state_of(current, now))
+
+
+def transition_many(db, ticket_ids, action: str, now: datetime | None = None) -> int:
+    """
+    Variante groupée (scans par lots) : UN update_many conditionnel sur tous les IDs.
+    Les tickets qui ne sont pas dans un état de départ valide sont simplement ignorés.
+    Retourne le nombre de tickets modifiés. 'delete' n'est pas supporté ici.
+    """
+    sources, target = TRANSITIONS[action]
+    if target == DELETED:
+        raise ValueError("transition_many ne gère pas 'delete'")
+    oids = [t if isinstance(t, ObjectId) else ObjectId(t) for t in ticket_ids if ObjectId.is_valid(t)]
+    if not oids:
+        return 0
+    now = now or datetime.now(timezone.utc)
+    res = db.tickets.update_many(
+        {"_id": {"$in": oids}, **_source_filter(sources, now)},
+        _update_for(target, now),
+    )
+    return res.modified_count
@@ -32,6 +32,16 @@ class Config:
     STRIPE_SUCCESS_URL     = os.environ.get("STRIPE_SUCCESS_URL", "http://localhost:5000/dashboard/")
     STRIPE_CANCEL_URL      = os.environ.get("STRIPE_CANCEL_URL", "http://localhost:5000/tickets/buy")
     STRIPE_CURRENCY        = os.getenv("STRIPE_CURRENCY", "eur")
+    # Client Stripe (app/stripe_gateway.py) : créé une fois, connexions réutilisées
+    STRIPE_BACKEND         = os.getenv("STRIPE_BACKEND", "stripe")        # "fake" = PaymentIntents en mémoire (tests de charge)
+    STRIPE_CONNECT_TIMEOUT = float(os.getenv("STRIPE_CONNECT_TIMEOUT", 5))  # secondes
+    STRIPE_READ_TIMEOUT    = float(os.getenv("STRIPE_READ_TIMEOUT", 20))    # secondes
+    STRIPE_MAX_RETRIES     = int(os.getenv("STRIPE_MAX_RETRIES", 2))
+    STRIPE_HTTP_POOL       = int(os.getenv("STRIPE_HTTP_POOL", 10))         # connexions keep-alive
+    STRIPE_FAKE_LATENCY_MS = float(os.getenv("STRIPE_FAKE_LATENCY_MS", 0))
+    STRIPE_FAKE_STATUS     = os.getenv("STRIPE_FAKE_STATUS", "succeeded")
+    # Émission des tickets après webhook (app/fulfilment.py) : reprise des paiements en attente
+    FULFILMENT_RETRY_INTERVAL = float(os.getenv("FULFILMENT_RETRY_INTERVAL", 30))   # secondes, 0 = traitement immédiat
 
     # Tarifs en centimes
     TICKET_UNIT_AMOUNTS = {
@@ -41,9 +51,69 @@ class Config:
         "month":  5000,
     }
 
+    # Cache des QR codes (rendu à la demande) : mémoire + disque, bornés en octets
+    QR_CACHE_MEM_BYTES  = int(os.getenv("QR_CACHE_MEM_BYTES", 8 * 1024 * 1024))
+    QR_CACHE_DISK_BYTES = int(os.getenv("QR_CACHE_DISK_BYTES", 64 * 1024 * 1024))
+    QR_CACHE_DIR        = os.getenv("QR_CACHE_DIR", "")   # vide -> <instance_path>/qrcache
+
+    # Balayeur d'expiration des tickets (voir app/expiry.py)
+    EXPIRY_SWEEP_INTERVAL = int(os.getenv("EXPIRY_SWEEP_INTERVAL", 60))   # secondes, 0 = désactivé
+    EXPIRY_SWEEP_BATCH    = int(os.getenv("EXPIRY_SWEEP_BATCH", 500))
+
+    # Liste "Mes tickets" : pagination par curseur (_id)
+    TICKETS_PAGE_SIZE     = int(os.getenv("TICKETS_PAGE_SIZE", 20))
+    TICKETS_PAGE_SIZE_MAX = int(os.getenv("TICKETS_PAGE_SIZE_MAX", 100))
+
+    # Scan par jeton QR signé : contrôle de révocation en base (1) ou réponse 100% jeton (0).
+    # Avec 0 (défaut), un ticket annulé / expiré en base reste accepté jusqu'à l'exp de son jeton.
+    QR_REVOCATION_CHECK = os.getenv("QR_REVOCATION_CHECK", "0")
+
     # On démarrera le client MQTT plus tard (si besoin)
     START_MQTT = os.getenv("START_MQTT", "0")  # "1" pour activer
 
+    # Traitement des scans MQTT : threads + profondeur de file (au-delà : réponse "busy")
+    MQTT_SCAN_WORKERS = int(os.getenv("MQTT_SCAN_WORKERS", 4))
+    MQTT_SCAN_QUEUE   = int(os.getenv("MQTT_SCAN_QUEUE", 100))
+    MQTT_SCAN_BATCH_MAX = int(os.getenv("MQTT_SCAN_BATCH_MAX", 50))   # tickets par scan groupé
+
+    # Index spatial en mémoire des arrêts (/stops/near, cf. app/stop_index.py)
+    STOP_INDEX_ENABLED        = os.getenv("STOP_INDEX_ENABLED", "1")
+    STOP_INDEX_CELL_DEG       = float(os.getenv("STOP_INDEX_CELL_DEG", 0.01))
+    STOP_INDEX_CHECK_INTERVAL = float(os.getenv("STOP_INDEX_CHECK_INTERVAL", 30))   # secondes
+    STOP_INDEX_MAX_AGE        = float(os.getenv("STOP_INDEX_MAX_AGE", 3600))        # secondes, 0 = illimité
+
+    # Tuiles d'arrêts de la carte (/stops/tiles/<z>/<x>/<y>.json) : durée de cache HTTP
+    STOPS_TILE_MAX_AGE = int(os.getenv("STOPS_TILE_MAX_AGE", 300))   # secondes
+
+    # Instrumentation du scan : histogrammes glissants + résumé retenu sur bc/service/bus-city-api/metrics
+    SCAN_METRICS_WINDOW   = float(os.getenv("SCAN_METRICS_WINDOW", 60))     # secondes
+    MQTT_METRICS_INTERVAL = float(os.getenv("MQTT_METRICS_INTERVAL", 30))   # secondes, 0 = pas de publication
+    METRICS_TOKEN         = os.getenv("METRICS_TOKEN", "")   # GET /metrics* : "Authorization: Bearer <jeton>", vide = routes désactivées
+
+    # Limite de débit par borne (seau à jetons, cf. app/rate_limit.py)
+    MQTT_DEVICE_RATE      = float(os.getenv("MQTT_DEVICE_RATE", 20))   # req/s, 0 = pas de limite
+    MQTT_DEVICE_BURST     = float(os.getenv("MQTT_DEVICE_BURST", 40))
+    MQTT_DEVICE_TRACK_MAX = int(os.getenv("MQTT_DEVICE_TRACK_MAX", 10000))
+
+    # Plusieurs instances : abonnement partagé $share/<groupe>/... (vide = abonnement classique)
+    MQTT_SHARED_GROUP   = os.getenv("MQTT_SHARED_GROUP", "")
+    # Requêtes déjà vues (device_id, req_id) : redélivrances QoS 1 ignorées
+    MQTT_REQ_DEDUP_TTL  = float(os.getenv("MQTT_REQ_DEDUP_TTL", 60))   # secondes, 0 = désactivé
+    MQTT_REQ_DEDUP_SIZE = int(os.getenv("MQTT_REQ_DEDUP_SIZE", 10000))
+
+    # Cache des tickets scannés (voir app/ticket_cache.py)
+    SCAN_CACHE_SIZE = int(os.getenv("SCAN_CACHE_SIZE", 10000))   # 0 = désactivé
+    SCAN_CACHE_TTL  = int(os.getenv("SCAN_CACHE_TTL", 120))      # secondes
+    SCAN_CACHE_TTL_NO_STREAM = float(os.getenv("SCAN_CACHE_TTL_NO_STREAM", 5))  # sans change stream, 0 = désactivé
+    SCAN_CACHE_CHANGE_STREAM = os.getenv("SCAN_CACHE_CHANGE_STREAM", "1")
+
+    # Outbox des événements MQTT (voir app/outbox.py)
+    OUTBOX_MEMORY_SIZE    = int(os.getenv("OUTBOX_MEMORY_SIZE", 1000))
+    OUTBOX_SPILL_BYTES    = int(os.getenv("OUTBOX_SPILL_BYTES", 16 * 1024 * 1024))
+    OUTBOX_BATCH          = int(os.getenv("OUTBOX_BATCH", 100))
+    OUTBOX_FLUSH_INTERVAL = float(os.getenv("OUTBOX_FLUSH_INTERVAL", 1))
+    OUTBOX_INSTANCE       = os.getenv("OUTBOX_INSTANCE", "")   # vide -> nom d'hôte
+
 class DevelopmentConfig(Config):
     DEBUG = True
     ENV = "development"
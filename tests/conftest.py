@@ -0,0 +1,43 @@
+# tests/conftest.py
+# Fixtures communes : Mongo en mémoire (mongomock) et app Flask sans services externes
+# (pas de broker MQTT, pas de Stripe, pas de threads de fond).
+
+import os
+import sys
+
+import mongomock
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TEST_ENV = {
+    "START_MQTT": "0",
+    "EXPIRY_SWEEP_INTERVAL": "0",
+    "SCAN_CACHE_CHANGE_STREAM": "0",
+    "FULFILMENT_RETRY_INTERVAL": "0",   # émission des tickets sans file (immédiate)
+    "STOP_INDEX_ENABLED": "0",
+    "STRIPE_BACKEND": "fake",
+    "STRIPE_WEBHOOK_SECRET": "whsec_test",
+}
+
+
+@pytest.fixture
+def db():
+    return mongomock.MongoClient(tz_aware=True)["bus_city"]
+
+
+@pytest.fixture
+def app(db, monkeypatch):
+    for key, value in TEST_ENV.items():
+        monkeypatch.setenv(key, value)
+    import app as app_pkg
+
+    def fake_init_db(application):
+        application.mongo_client = db.client
+        application.db = db
+        return db
+
+    monkeypatch.setattr(app_pkg, "init_db", fake_init_db)
+    application = app_pkg.create_app()
+    application.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    return application
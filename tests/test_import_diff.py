@@ -0,0 +1,42 @@
+# tests/test_import_diff.py
+from app.liste_ville.import_all_stop import diff_city, import_diff, norm_stop
+
+
+def _stops(*rows):
+    return [norm_stop({"name": n, "code": c, "lat": lat, "lng": 6.0}, "Besançon") for n, c, lat in rows]
+
+
+def test_diff_counts_and_second_run_is_noop(db):
+    import_diff(db, {"Besançon": _stops(("Gare", "G1", 47.24), ("Centre", "C1", 47.23), ("Hôpital", "H1", 47.22))})
+    assert db.stops.count_documents({}) == 3
+
+    totals = import_diff(db, {"Besançon": _stops(("Gare Viotte", "G1", 47.24), ("Centre", "C1", 47.23),
+                                                 ("Fac", "F1", 47.25))})
+    assert (totals["inserted"], totals["updated"], totals["deleted"], totals["unchanged"]) == (1, 1, 1, 1)
+    assert sorted(d["code"] for d in db.stops.find()) == ["C1", "F1", "G1"]
+
+    again = import_diff(db, {"Besançon": _stops(("Gare Viotte", "G1", 47.24), ("Centre", "C1", 47.23),
+                                                ("Fac", "F1", 47.25))})
+    assert again["unchanged"] == 3 and again["inserted"] == again["updated"] == again["deleted"] == 0
+
+
+def test_diff_keeps_lines_and_backfills_import_key(db):
+    gare, = _stops(("Gare", "G1", 47.24))
+    legacy = {k: v for k, v in gare.items() if k != "import_key"}
+    legacy["lines"] = ["L3", "L4"]          # renseignées par un autre import (GTFS)
+    db.stops.insert_one(legacy)
+
+    _, counts = diff_city(db, "Besançon", _stops(("Gare", "G1", 47.24)))
+    assert counts["keyed"] == 1 and counts["updated"] == 0
+    import_diff(db, {"Besançon": _stops(("Gare", "G1", 47.24))})
+    doc = db.stops.find_one({"code": "G1"})
+    assert doc["import_key"] == "c:G1"
+    assert doc["lines"] == ["L3", "L4"]
+
+
+def test_diff_collapses_duplicates(db):
+    db.stops.insert_many(_stops(("Gare", "G1", 47.24), ("Gare", "G1", 47.24)))
+    _, counts = diff_city(db, "Besançon", _stops(("Gare", "G1", 47.24), ("Gare bis", "G1", 47.24)))
+    assert counts["duplicates"] == 1      # dans le fichier : la dernière gagne
+    assert counts["deleted"] == 1         # doublon déjà en base
+    assert counts["updated"] == 1
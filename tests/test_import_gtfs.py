@@ -0,0 +1,52 @@
+# tests/test_import_gtfs.py
+import zipfile
+
+import pytest
+
+from app.liste_ville.import_gtfs import import_gtfs
+
+FEED = {
+    "stops.txt": (
+        "\ufeffstop_id,stop_code,stop_name,stop_lat,stop_lon,location_type,zone_id\n"
+        "S1,G1,Gare,47.24,6.02,0,A\n"
+        "S2,,Centre,47.23,6.03,,\n"
+        "P1,,Pôle gare,47.24,6.02,1,\n"              # station parente : ignorée
+        "S3,H1,Hôpital,pas-une-latitude,6.01,0,\n"  # coordonnées invalides : ignoré
+    ),
+    "routes.txt": "route_id,route_short_name,route_long_name\nR1,L3,\nR2,,Tram\n",
+    "trips.txt": "route_id,service_id,trip_id\nR1,sem,T1\nR2,sem,T2\n",
+    "stop_times.txt": "trip_id,stop_id,stop_sequence\nT1,S1,1\nT1,S2,2\nT2,S1,1\n",
+}
+
+
+@pytest.fixture
+def feed(tmp_path):
+    path = tmp_path / "gtfs.zip"
+    with zipfile.ZipFile(path, "w") as zf:
+        for name, text in FEED.items():
+            zf.writestr(f"reseau/{name}", text)
+    return str(path)
+
+
+def test_stops_lines_and_zone(db, feed):
+    prog = import_gtfs(db, feed, "Besançon", progress=0)
+    assert prog.inserted == 2
+    gare = db.stops.find_one({"code": "G1"})
+    assert gare["lines"] == ["L3", "Tram"] and gare["zone"] == "A"
+    assert gare["city_key"] == "besancon"
+    centre = db.stops.find_one({"name": "Centre"})
+    assert centre["code"] == "S2" and centre["lines"] == ["L3"]
+    assert db.cities.find_one({"_id": "besancon"}) is not None
+
+
+def test_reimport_updates_instead_of_duplicating(db, feed):
+    import_gtfs(db, feed, "Besançon", progress=0)
+    ids = sorted(d["_id"] for d in db.stops.find())
+
+    prog = import_gtfs(db, feed, "Besançon", progress=0)
+    assert prog.inserted == 0
+    assert sorted(d["_id"] for d in db.stops.find()) == ids
+
+    import_gtfs(db, feed, "Besançon", clear=True, with_lines=False, progress=0)
+    assert db.stops.count_documents({}) == 2
+    assert db.stops.find_one({"code": "G1"})["lines"] == []
@@ -0,0 +1,119 @@
+# tests/test_outbox.py
+import logging
+from types import SimpleNamespace
+
+import paho.mqtt.client as mqtt
+import pytest
+
+from app.outbox import Outbox, SPILL_COLLECTION
+
+
+class FakeClient:
+    def __init__(self):
+        self.connected = False
+        self.sent = []
+
+    def is_connected(self):
+        return self.connected
+
+    def publish(self, topic, payload, qos=1, retain=False):
+        self.sent.append(payload)
+        return SimpleNamespace(rc=mqtt.MQTT_ERR_SUCCESS)
+
+
+class SpillOutbox(Outbox):
+    """mongomock n'a pas de collection capped : collection ordinaire."""
+
+    def _ensure_spill(self, db, size):
+        return db[SPILL_COLLECTION]
+
+
+@pytest.fixture
+def make_outbox(db):
+    def make(owner="a", client=None, memory_size=2):
+        client = client or FakeClient()
+        app = SimpleNamespace(db=db, logger=logging.getLogger("test-outbox"), config={
+            "OUTBOX_INSTANCE": owner, "OUTBOX_MEMORY_SIZE": memory_size, "OUTBOX_FLUSH_INTERVAL": 60,
+        })
+        ob = SpillOutbox(app, lambda: client)
+        # flush_once piloté par le test, pas par le thread de fond
+        ob.stop()
+        ob._thread.join(timeout=2)
+        return ob, client
+    return make
+
+
+def _drain(ob):
+    while ob.flush_once():
+        pass
+
+
+def test_memory_only(make_outbox):
+    ob, client = make_outbox(memory_size=10)
+    for i in range(3):
+        ob.enqueue("t", str(i))
+    client.connected = True
+    _drain(ob)
+    assert client.sent == ["0", "1", "2"]
+    assert ob.stats()["spilled"] == 0
+
+
+def test_overflow_keeps_fifo_and_leaves_spill_mode(make_outbox, db):
+    ob, client = make_outbox()
+    for i in range(5):
+        ob.enqueue("t", str(i))
+    st = ob.stats()
+    assert (st["memory_queued"], st["spilled"], st["spill_active"]) == (2, 3, True)
+    assert [d["seq"] for d in db[SPILL_COLLECTION].find()] == [1, 2, 3]
+
+    client.connected = True
+    _drain(ob)
+    assert client.sent == ["0", "1", "2", "3", "4"]
+    assert ob.stats()["spill_active"] is False
+    assert db[SPILL_COLLECTION].count_documents({"sent": False}) == 0
+
+    ob.enqueue("t", "5")
+    assert ob.stats()["memory_queued"] == 1
+
+
+def test_instances_only_publish_their_own_entries(make_outbox):
+    a, ca = make_outbox(owner="a", memory_size=1)
+    b, cb = make_outbox(owner="b", memory_size=1)
+    for i in range(3):
+        a.enqueue("t", f"a{i}")
+        b.enqueue("t", f"b{i}")
+
+    ca.connected = True
+    _drain(a)
+    assert ca.sent == ["a0", "a1", "a2"]
+    assert a.stats()["overwritten"] == 0
+    cb.connected = True
+    _drain(b)
+    assert cb.sent == ["b0", "b1", "b2"]
+
+
+def test_restart_resumes_own_backlog(make_outbox):
+    first, _ = make_outbox(owner="a", memory_size=1)
+    for i in range(4):
+        first.enqueue("t", str(i))        # "0" en mémoire (perdu à l'arrêt), 1..3 en base
+
+    again, client = make_outbox(owner="a", memory_size=1)
+    assert again.stats()["spill_active"] is True
+    assert again._next_seq == 4
+    again.enqueue("t", "4")
+    client.connected = True
+    _drain(again)
+    assert client.sent == ["1", "2", "3", "4"]
+
+
+def test_overwritten_entries_are_counted(make_outbox, db):
+    ob, client = make_outbox(memory_size=1)
+    for i in range(5):
+        ob.enqueue("t", str(i))
+    # collection capped pleine : Mongo a écrasé l'entrée seq=2 avant son envoi
+    db[SPILL_COLLECTION].delete_one({"seq": 2})
+
+    client.connected = True
+    _drain(ob)
+    assert client.sent == ["0", "1", "3", "4"]
+    assert ob.stats()["overwritten"] == 1
@@ -0,0 +1,31 @@
+# tests/test_stop_index.py
+import random
+
+import pytest
+
+from app.stop_index import StopGrid, haversine_m
+
+
+def _brute(points, lat, lng, radius_m, limit):
+    dist = sorted((haversine_m(lat, lng, p[0], p[1]), p[2]["id"]) for p in points)
+    return [i for d, i in dist if radius_m is None or d <= radius_m][:limit]
+
+
+@pytest.mark.parametrize("center_lat", [0.0, 47.2, 70.0, 85.0])
+def test_near_matches_brute_force(center_lat):
+    rnd = random.Random(center_lat)
+    for _ in range(60):
+        points = [(center_lat + rnd.uniform(-0.5, 0.5), rnd.uniform(-1, 1), {"id": str(i)})
+                  for i in range(rnd.choice([3, 20, 200]))]
+        grid = StopGrid(points, rnd.choice([0.01, 0.05]))
+        lat, lng = center_lat + rnd.uniform(-0.5, 0.5), rnd.uniform(-1, 1)
+        limit, radius = rnd.choice([1, 3, 10]), rnd.choice([None, 2000, 20000])
+        got = [row["id"] for row in grid.near(lat, lng, radius, limit)]
+        assert got == _brute(points, lat, lng, radius, limit)
+
+
+def test_near_sparse_grid_falls_back_to_full_scan():
+    points = [(47.0, 6.0, {"id": "proche"}), (48.5, 6.0, {"id": "loin"})]
+    rows = StopGrid(points, 0.001).near(47.0005, 6.0, None, 2)
+    assert [r["id"] for r in rows] == ["proche", "loin"]
+    assert rows[0]["distance_m"] == pytest.approx(55.6, abs=0.5)
@@ -0,0 +1,62 @@
+# tests/test_stream_import.py
+import io
+import json
+import re
+
+import pytest
+
+from app.liste_ville import stream_import as si
+
+
+def _rows(path, **kw):
+    return list(si.iter_rows(str(path), **kw))
+
+
+def test_json_array_across_read_boundaries(monkeypatch):
+    # petites lectures : éléments et séparateurs coupés entre deux read()
+    monkeypatch.setattr(si, "READ_SIZE", 7)
+    items = [{"name": f"Arrêt {i}", "lat": 47.0 + i / 100, "lng": 6.0, "tags": ["a,b", "]"]} for i in range(50)]
+    fp = io.StringIO(json.dumps(items, indent=1, ensure_ascii=False))
+    assert list(si.iter_json_array(fp, si._open_array(fp, re.compile(r"\[")))) == items
+
+
+def test_truncated_array_raises(monkeypatch):
+    monkeypatch.setattr(si, "READ_SIZE", 5)
+    fp = io.StringIO('[{"a": 1}, {"b": ')
+    with pytest.raises(ValueError):
+        list(si.iter_json_array(fp, si._open_array(fp, re.compile(r"\["))))
+
+
+def test_formats_a_and_b(tmp_path):
+    a = tmp_path / "a.json"
+    a.write_text(json.dumps({"cities": [{"city": "Dole", "clear": True, "stops": [{"name": "X", "lat": 1, "lng": 2}]}]}))
+    b = tmp_path / "b.json"
+    b.write_text(json.dumps([{"city": "Dole", "name": "X", "lat": 1, "lng": 2}]))
+    assert _rows(a) == [("Dole", {"name": "X", "lat": 1, "lng": 2}, True)]
+    assert _rows(b) == [("Dole", {"city": "Dole", "name": "X", "lat": 1, "lng": 2}, False)]
+
+
+def test_bad_ndjson_lines_are_skipped(db, tmp_path):
+    path = tmp_path / "stops.ndjson"
+    path.write_text("\n".join([
+        json.dumps({"city": "Dole", "name": "Gare", "code": "G", "lat": 47.09, "lng": 5.49}),
+        '{"city": "Dole", "name": ',                       # tronquée
+        "[1, 2]",                                          # pas un objet
+        "",
+        json.dumps({"city": "Dole", "name": "Centre", "lat": "47.1", "lng": "5.5"}),
+        json.dumps({"city": "Dole", "name": "Sans coordonnées"}),
+    ]) + "\n")
+
+    prog = si.stream_import(db, iter(_rows(path)), chunk=2, progress=0)
+    assert (prog.inserted, prog.skipped, prog.errors) == (2, 3, 0)
+    assert sorted(d["name"] for d in db.stops.find()) == ["Centre", "Gare"]
+    assert db.cities.count_documents({}) == 1
+
+
+def test_clear_purges_each_city_once(db, tmp_path):
+    path = tmp_path / "stops.ndjson"
+    path.write_text("".join(json.dumps({"city": "Dole", "name": f"S{i}", "lat": 47, "lng": 5}) + "\n"
+                            for i in range(5)))
+    si.stream_import(db, iter(_rows(path)), chunk=2, progress=0)
+    si.stream_import(db, iter(_rows(path, clear_all=True)), chunk=2, progress=0)
+    assert db.stops.count_documents({}) == 5
@@ -0,0 +1,101 @@
+# tests/test_ticket_state.py
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from bson.objectid import ObjectId
+
+from app import ticket_state as ts
+
+NOW = datetime(2026, 1, 1, 12, tzinfo=timezone.utc)
+
+
+def _ticket(db, **fields):
+    doc = {"user_id": "u1", "type": "single", "status": "active",
+           "validation_status": None, "validated_at": None, "expires_at": None, **fields}
+    return db.tickets.insert_one(doc).inserted_id
+
+
+def test_state_of():
+    assert ts.state_of({"status": "active", "validation_status": None}, NOW) == ts.ACTIVE
+    assert ts.state_of({"status": "active", "validation_status": "pending"}, NOW) == ts.PENDING
+    assert ts.state_of({"status": "validated", "expires_at": NOW + timedelta(hours=1)}, NOW) == ts.VALIDATED
+    assert ts.state_of({"status": "validated", "expires_at": NOW - timedelta(seconds=1)}, NOW) == ts.EXPIRED
+    assert ts.state_of({"status": "expired"}, NOW) == ts.EXPIRED
+
+
+def test_start_then_start_again(db):
+    tid = _ticket(db)
+    doc = ts.transition(db, tid, "start", user_id="u1", now=NOW)
+    assert doc["validation_status"] == "pending"
+    assert doc["confirmation_requested_at"] == NOW
+
+    with pytest.raises(ts.InvalidTransition) as exc:
+        ts.transition(db, tid, "start", user_id="u1", now=NOW)
+    assert exc.value.state == ts.PENDING
+
+
+def test_confirm_requires_pending(db):
+    tid = _ticket(db)
+    with pytest.raises(ts.InvalidTransition) as exc:
+        ts.transition(db, tid, "confirm", now=NOW)
+    assert exc.value.state == ts.ACTIVE
+
+
+def test_other_user_or_bad_id_is_not_found(db):
+    tid = _ticket(db)
+    with pytest.raises(ts.TicketNotFound):
+        ts.transition(db, tid, "start", user_id="someone-else", now=NOW)
+    with pytest.raises(ts.TicketNotFound):
+        ts.transition(db, "pas-un-id", "start", now=NOW)
+    with pytest.raises(ts.TicketNotFound):
+        ts.transition(db, ObjectId(), "start", now=NOW)
+
+
+def test_past_expiry_counts_as_expired(db):
+    tid = _ticket(db, status="validated", validation_status="validated",
+                  expires_at=NOW - timedelta(minutes=1))
+    with pytest.raises(ts.InvalidTransition) as exc:
+        ts.transition(db, tid, "start", now=NOW)
+    assert exc.value.state == ts.EXPIRED
+
+    # déjà échu : supprimable sans passer par "expire"
+    deleted = ts.transition(db, tid, "delete", user_id="u1", now=NOW)
+    assert deleted["_id"] == tid
+    assert db.tickets.count_documents({}) == 0
+
+
+def test_expire_then_delete(db):
+    tid = _ticket(db, status="validated", validation_status="validated",
+                  expires_at=NOW + timedelta(hours=1))
+    with pytest.raises(ts.InvalidTransition):
+        ts.transition(db, tid, "delete", now=NOW)
+
+    doc = ts.transition(db, tid, "expire", now=NOW)
+    assert doc["status"] == "expired"
+    assert doc["expired_at"] == NOW
+    with pytest.raises(ts.InvalidTransition):
+        ts.transition(db, tid, "expire", now=NOW)
+    ts.transition(db, tid, "delete", now=NOW)
+    assert db.tickets.find_one({"_id": tid}) is None
+
+
+def test_transition_many_skips_ineligible(db):
+    active = _ticket(db)
+    pending = _ticket(db, validation_status="pending")
+    expired = _ticket(db, status="expired")
+    n = ts.transition_many(db, [str(active), str(pending), str(expired), "pas-un-id"], "expire", now=NOW)
+    assert n == 2
+    assert db.tickets.count_documents({"status": "expired"}) == 3
+
+    with pytest.raises(ValueError):
+        ts.transition_many(db, [str(active)], "delete", now=NOW)
+
+
+def test_validated_expiry_by_type():
+    # mongomock n'évalue pas $add sur une date : on vérifie l'échéance calculée par type
+    upd = ts._update_for(ts.VALIDATED, NOW)[0]["$set"]
+    branches = upd["expires_at"]["$add"][1]["$switch"]["branches"]
+    ms = {b["case"]["$eq"][1]: b["then"] for b in branches}
+    assert ms["single"] == 2 * 3600 * 1000
+    assert ms["month"] == 30 * 86400 * 1000
+    assert upd["status"] == "validated" and upd["validated_at"] == NOW
@@ -0,0 +1,96 @@
+# tests/test_webhook.py
+import hashlib
+import hmac
+import json
+import time
+
+import pytest
+
+from app.fulfilment import record_created, FULFILLED, FAILED
+from app.paiements import PRICES
+
+
+def _signed(payload: str, secret: str = "whsec_test") -> dict:
+    ts = int(time.time())
+    sig = hmac.new(secret.encode(), f"{ts}.{payload}".encode(), hashlib.sha256).hexdigest()
+    return {"Stripe-Signature": f"t={ts},v1={sig}", "Content-Type": "application/json"}
+
+
+def _event(pi_id: str, kind: str = "payment_intent.succeeded", amount: int | None = None,
+           user_id: str | None = "u1", ttype: str = "single", qty: int = 2) -> str:
+    meta = {"type": ttype, "qty": str(qty)}
+    if user_id:
+        meta["user_id"] = user_id
+    pi = {"id": pi_id, "object": "payment_intent", "currency": "eur", "metadata": meta,
+          "amount_received": PRICES[ttype] * qty if amount is None else amount}
+    return json.dumps({"id": f"evt_{pi_id}", "object": "event", "type": kind, "data": {"object": pi}})
+
+
+@pytest.fixture
+def post(app):
+    client = app.test_client()
+
+    def post(body: str, headers: dict | None = None):
+        return client.post("/payments/webhook", data=body, headers=headers or _signed(body))
+    return post
+
+
+def test_replayed_event_issues_tickets_once(app, db, post):
+    record_created(db, "pi_1", "u1", "single", 2, PRICES["single"] * 2, "eur")
+    body = _event("pi_1")
+    for _ in range(3):
+        assert post(body).status_code == 200
+
+    pay = db.payments.find_one({"pi_id": "pi_1"})
+    assert pay["status"] == FULFILLED
+    assert db.tickets.count_documents({"pi_id": "pi_1"}) == 2
+    assert sorted(str(t["_id"]) for t in db.tickets.find({"pi_id": "pi_1"})) == sorted(pay["ticket_ids"])
+
+
+def test_unknown_payment_is_ignored(db, post):
+    assert post(_event("pi_other")).status_code == 200
+    assert db.payments.count_documents({}) == 0   # pas d'upsert
+    assert db.tickets.count_documents({}) == 0
+
+
+def test_payment_of_another_user_is_ignored(db, post):
+    record_created(db, "pi_2", "u1", "single", 2, PRICES["single"] * 2, "eur")
+    assert post(_event("pi_2", user_id="u2")).status_code == 200
+    assert db.payments.find_one({"pi_id": "pi_2"})["status"] == "created"
+    assert db.tickets.count_documents({}) == 0
+
+
+def test_short_amount_fails_without_tickets(db, post):
+    record_created(db, "pi_3", "u1", "single", 2, PRICES["single"] * 2, "eur")
+    assert post(_event("pi_3", amount=PRICES["single"])).status_code == 200
+    pay = db.payments.find_one({"pi_id": "pi_3"})
+    assert pay["status"] == FAILED and pay["error"] == "Montant incohérent"
+    assert db.tickets.count_documents({}) == 0
+
+
+def test_failed_event_after_fulfilment_keeps_tickets(db, post):
+    record_created(db, "pi_4", "u1", "single", 1, PRICES["single"], "eur")
+    post(_event("pi_4", qty=1))
+    post(_event("pi_4", kind="payment_intent.payment_failed", qty=1))
+    assert db.payments.find_one({"pi_id": "pi_4"})["status"] == FULFILLED
+    assert db.tickets.count_documents({"pi_id": "pi_4"}) == 1
+
+
+def test_bad_signature_is_rejected(db, post):
+    record_created(db, "pi_5", "u1", "single", 2, PRICES["single"] * 2, "eur")
+    body = _event("pi_5")
+    assert post(body, _signed(body, secret="whsec_wrong")).status_code == 400
+    assert db.payments.find_one({"pi_id": "pi_5"})["status"] == "created"
+
+
+def test_fulfil_after_crash_reuses_issued_tickets(app, db):
+    from app.fulfilment import fulfil
+    from app.routes.tickets import _insert_tickets
+
+    record_created(db, "pi_6", "u1", "single", 3, PRICES["single"] * 3, "eur")
+    db.payments.update_one({"pi_id": "pi_6"}, {"$set": {"status": "paid"}})
+    with app.test_request_context():
+        first = _insert_tickets(db, "u1", "single", 3, pi_id="pi_6")   # crash avant "fulfilled"
+        pay = fulfil(db, "pi_6")
+    assert sorted(pay["ticket_ids"]) == sorted(first)
+    assert db.tickets.count_documents({"pi_id": "pi_6"}) == 3